@@ -0,0 +1,239 @@
+import logging
+import logging.handlers
+import multiprocessing
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Verteilung der Sensoren auf mehrere Bluetooth-Adapter
+# Pro Adapter (hci0, hci1, ...) läuft ein eigener Worker-Prozess mit eigenen BLE-Sessions, der die Sensoren
+# seines Shards liest und dekodiert. Die Ergebnisse gehen über eine gemeinsame Queue zurück an den
+# Hauptprozess, der wie bisher archiviert und über den einen MQTT-Client veröffentlicht.
+# Log-Einträge der Worker werden ebenfalls an den Hauptprozess weitergereicht (eine Logdatei).
+
+# Startmethode "spawn": der Hauptprozess hat bereits Threads (Logging, paho), fork wäre nicht sicher
+_mp = multiprocessing.get_context("spawn")
+
+
+def _worker_main(iface, request_queue, result_queue, log_queue, max_connections, handle_cache_path, handle_cache_max_age,
+                 max_sessions, worker_init):
+    # Logging vor dem Import von main auf die Queue umstellen; configure_logging() in main tut dann nichts
+    root = logging.getLogger()
+    root.handlers[:] = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(logging.DEBUG) # Gefiltert wird im Hauptprozess
+    if worker_init is not None:
+        worker_init()
+
+    import main
+    from ble_session import BleSessionManager, HandleCache, SessionLimit
+
+    handle_cache = HandleCache(handle_cache_path, max_age=handle_cache_max_age) if handle_cache_path else None
+    session_limit = SessionLimit(max_sessions) if max_sessions else None # gilt für diesen Adapter, über alle Sensortypen
+    sessions_by_type = {name: BleSessionManager(t["service_uuid"], main.decoder_registries[name].uuids(), iface=iface,
+                                                handle_cache=handle_cache, session_limit=session_limit)
+                        for name, t in main.SENSOR_TYPES.items()}
+    executor = ThreadPoolExecutor(max_workers=max_connections, thread_name_prefix=f"hci{iface}")
+
+    def read(cycle_id, mac, sensor_type, deadline):
+        start = time.perf_counter()
+        try:
+            data_list, measurement = main.get_sensor_data(mac, deadline, sessions=sessions_by_type[sensor_type],
+                                                          sensor_type=sensor_type)
+        except Exception as e:
+            logger.error(f"Unhandled error while reading sensor {mac} on hci{iface}: {e}", exc_info=True)
+            data_list, measurement = [], main.decoder_registries[sensor_type].empty_measurement()
+        result_queue.put((iface, cycle_id, mac, data_list, measurement, time.perf_counter() - start))
+
+    def release(mac, sensor_type):
+        # Sensor wurde einem anderen Adapter zugeteilt: gehaltene Verbindung freigeben
+        sessions_by_type[sensor_type].disconnect(mac)
+
+    logger.info(f"Adapter worker for hci{iface} started.")
+    try:
+        while True:
+            request = request_queue.get()
+            if request is None:
+                break
+            kind, args = request[0], request[1:]
+            executor.submit(read if kind == "read" else release, *args)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        for sessions in sessions_by_type.values():
+            sessions.close_all()
+        logger.info(f"Adapter worker for hci{iface} stopped.")
+
+
+# Handle auf einen Worker-Prozess im Hauptprozess
+class AdapterWorker:
+    def __init__(self, iface, result_queue, log_queue, max_connections=4, handle_cache_path=None,
+                 handle_cache_max_age=7 * 86400, max_sessions=5, worker_init=None):
+        self.iface = iface
+        self.result_queue = result_queue
+        self.log_queue = log_queue
+        self.max_connections = max_connections # gleichzeitige Verbindungen über diesen Adapter
+        self.handle_cache_path = handle_cache_path # gemeinsame Datei für alle Worker (siehe HandleCache), None = aus
+        self.handle_cache_max_age = handle_cache_max_age
+        self.max_sessions = max_sessions # gehaltene Verbindungen über diesen Adapter, None = unbegrenzt
+        self.worker_init = worker_init # Optionale Funktion, die im Worker vor dem Import von main läuft
+        self.request_queue = None
+        self.process = None
+
+    def start(self):
+        self.request_queue = _mp.Queue()
+        self.process = _mp.Process(target=_worker_main, name=f"ble-hci{self.iface}", daemon=True,
+                                   args=(self.iface, self.request_queue, self.result_queue, self.log_queue,
+                                         self.max_connections, self.handle_cache_path, self.handle_cache_max_age,
+                                         self.max_sessions, self.worker_init))
+        self.process.start()
+        return self
+
+    def is_alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def submit(self, cycle_id, mac, sensor_type, deadline):
+        # deadline auf time.monotonic(); CLOCK_MONOTONIC ist unter Linux prozessübergreifend gleich
+        self.request_queue.put(("read", cycle_id, mac, sensor_type, deadline))
+
+    def release(self, mac, sensor_type):
+        self.request_queue.put(("release", mac, sensor_type))
+
+    def stop(self, timeout=5):
+        if self.process is None:
+            return
+        if self.process.is_alive():
+            self.request_queue.put(None)
+            self.process.join(timeout)
+        if self.process.is_alive():
+            logger.warning(f"Adapter worker for hci{self.iface} did not stop in time. Terminating it.")
+            self.process.terminate()
+            self.process.join(timeout)
+        self.request_queue.close()
+        self.process = None
+
+
+# Platzierung der Sensoren auf Adapter
+# Jeder Sensor bleibt auf seinem Adapter, solange dieser gesund ist und der Sensor dort lesbar bleibt.
+# Neue bzw. verschobene Sensoren landen auf dem gesunden Adapter mit der geringsten erwarteten Last
+# (Summe der gemittelten Lesezeiten). Nach failover_after Fehlversuchen in Folge wechselt ein Sensor den
+# Adapter (z.B. außer Reichweite eines Dongles); ein ausgefallener Adapter wird nach retry_interval erneut genutzt.
+class ShardPlacement:
+    def __init__(self, adapters, failover_after=3, retry_interval=300, default_cost=1.0, smoothing=0.2):
+        self.adapters = list(adapters)
+        self.failover_after = failover_after
+        self.retry_interval = retry_interval
+        self.default_cost = default_cost
+        self.smoothing = smoothing
+        self.assignment = {} # MAC -> Adapter
+        self._cost = {} # MAC -> gleitender Mittelwert der Lesezeit in Sekunden
+        self._failures = {} # MAC -> Fehlversuche in Folge auf dem aktuellen Adapter
+        self._down_until = {} # Adapter -> Zeitpunkt (monotonic), ab dem er wieder genutzt wird
+        self._last_healthy = None
+
+    def healthy_adapters(self, now=None):
+        now = time.monotonic() if now is None else now
+        return [a for a in self.adapters if self._down_until.get(a, 0) <= now]
+
+    def load(self, adapter):
+        return sum(self._cost.get(mac, self.default_cost) for mac, a in self.assignment.items() if a == adapter)
+
+    def _least_loaded(self, exclude=()):
+        candidates = [a for a in self.healthy_adapters() if a not in exclude] or self.healthy_adapters()
+        if not candidates:
+            return None
+        loads = {a: 0.0 for a in candidates}
+        for mac, a in self.assignment.items():
+            if a in loads:
+                loads[a] += self._cost.get(mac, self.default_cost)
+        return min(candidates, key=lambda a: (loads[a], a))
+
+    def place(self, macs):
+        # Gibt {MAC: Adapter} für alle übergebenen Sensoren zurück und platziert fehlende bzw. verwaiste neu
+        healthy = set(self.healthy_adapters())
+        if not healthy:
+            return {}
+        if self._last_healthy is not None and healthy - self._last_healthy:
+            # Ein Adapter ist (wieder) verfügbar: Last neu verteilen
+            self.rebalance()
+        self._last_healthy = healthy
+        unplaced = [mac for mac in macs if self.assignment.get(mac) not in healthy]
+        for mac in unplaced:
+            self.assignment.pop(mac, None)
+        # Teure Sensoren zuerst verteilen (Greedy-Balancing)
+        for mac in sorted(unplaced, key=lambda m: -self._cost.get(m, self.default_cost)):
+            self.assignment[mac] = self._least_loaded()
+            self._failures.pop(mac, None)
+        return {mac: self.assignment[mac] for mac in macs}
+
+    def record(self, mac, adapter, ok, seconds):
+        previous = self._cost.get(mac)
+        self._cost[mac] = seconds if previous is None else previous + self.smoothing * (seconds - previous)
+        if ok:
+            self._failures.pop(mac, None)
+            return
+        failures = self._failures.get(mac, 0) + 1
+        self._failures[mac] = failures
+        if failures >= self.failover_after and len(self.healthy_adapters()) > 1:
+            target = self._least_loaded(exclude=(adapter,))
+            if target is not None and target != adapter:
+                logger.warning(f"Sensor {mac} failed {failures} times on hci{adapter}. Moving it to hci{target}.")
+                self.assignment[mac] = target
+                self._failures.pop(mac, None)
+
+    def mark_down(self, adapter, reason):
+        if adapter in self._down_until and self._down_until[adapter] > time.monotonic():
+            return
+        logger.error(f"Adapter hci{adapter} marked as failed ({reason}). Moving its sensors for {self.retry_interval} seconds.")
+        self._down_until[adapter] = time.monotonic() + self.retry_interval
+        for mac, a in list(self.assignment.items()):
+            if a == adapter:
+                del self.assignment[mac]
+
+    def rebalance(self):
+        # Nach der Rückkehr eines Adapters: Sensoren vom am stärksten zum am schwächsten belasteten verschieben,
+        # solange sich die Differenz dadurch verringert
+        healthy = self.healthy_adapters()
+        if len(healthy) < 2:
+            return
+        while True:
+            loads = {a: self.load(a) for a in healthy}
+            busiest = max(healthy, key=lambda a: loads[a])
+            idlest = min(healthy, key=lambda a: loads[a])
+            movable = sorted((self._cost.get(mac, self.default_cost), mac) for mac, a in self.assignment.items() if a == busiest)
+            if not movable:
+                return
+            cost, mac = movable[0]
+            if loads[busiest] - loads[idlest] <= cost:
+                return
+            self.assignment[mac] = idlest
+
+
+# Leitet Log-Einträge der Worker an die Logger des Hauptprozesses weiter
+class _ForwardingHandler(logging.Handler):
+    def emit(self, record):
+        target = logging.getLogger(record.name)
+        if target.isEnabledFor(record.levelno):
+            target.handle(record)
+
+
+def start_log_forwarding():
+    # Gibt (Queue für die Worker, Listener) zurück; der Listener läuft als Thread im Hauptprozess
+    log_queue = _mp.Queue()
+    listener = logging.handlers.QueueListener(log_queue, _ForwardingHandler())
+    listener.start()
+    return log_queue, listener
+
+
+def new_result_queue():
+    return _mp.Queue()
+
+
+def drain(result_queue, timeout):
+    # Ein Ergebnis holen oder None nach Ablauf von timeout
+    try:
+        return result_queue.get(timeout=max(0.0, timeout))
+    except queue.Empty:
+        return None
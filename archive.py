@@ -0,0 +1,203 @@
+import csv
+import gzip
+import io
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CSV_FIELDNAMES = [
+    "datetime_utc", "timestamp_utc", "Room", "Position", "Sensor_ID_MAC",
+    "CO2_ppm", "Temperature_Celsius", "Humidity_Percent", "Pressure_Pa"
+]
+
+_SEGMENT_NAME = re.compile(r"^(?P<room>.+)_(?P<day>\d{4}-\d{2}-\d{2})(?:_(?P<seq>\d+))?\.csv$")
+
+
+# Offene Datei eines Raums inkl. Rotationszustand
+class _ArchiveSegment:
+    def __init__(self, path, day, seq):
+        self.path = path
+        self.day = day
+        self.seq = seq
+        file_exists = os.path.exists(path)
+        self.file = open(path, mode='a', newline='', encoding='utf-8', buffering=64 * 1024)
+        self.size = self.file.tell()
+        # Zeilen erst in einen StringIO formatieren: file.tell() würde bei jeder Zeile den Puffer leeren,
+        # deshalb wird die Größe selbst mitgezählt
+        self._line = io.StringIO()
+        self.writer = csv.DictWriter(self._line, fieldnames=CSV_FIELDNAMES)
+        if not file_exists:
+            self.writer.writeheader()
+            self._write_line()
+
+    def _write_line(self):
+        text = self._line.getvalue()
+        self._line.seek(0)
+        self._line.truncate()
+        self.file.write(text)
+        self.size += len(text.encode('utf-8'))
+
+    def write(self, row):
+        self.writer.writerow(row)
+        self._write_line()
+
+    def sync(self, fsync=True):
+        self.file.flush()
+        if fsync:
+            os.fsync(self.file.fileno())
+
+    def close(self, fsync=True):
+        self.sync(fsync)
+        self.file.close()
+
+
+# Archive Writer
+# Hält die CSV-Datei jedes Raums offen, puffert Zeilen und schreibt sie gesammelt (flush + fsync) nach
+# flush_rows Zeilen oder flush_interval Sekunden. Rotiert täglich und bei max_bytes; abgeschlossene
+# Segmente werden optional im Hintergrund mit gzip komprimiert. Das schont die SD-Karte des Raspberry Pi.
+# Segmente, die ein früherer Prozess abgeschlossen, aber nicht mehr komprimiert hat (Neustart, --once),
+# werden beim Anlegen des Writers nachträglich komprimiert; close() wartet auf laufende Komprimierungen.
+# Dateinamen: <base_path>/<Room>_<YYYY-MM-DD>.csv bzw. <Room>_<YYYY-MM-DD>_<n>.csv
+class CsvArchiveWriter:
+    def __init__(self, base_path, flush_rows=20, flush_interval=60, max_bytes=10 * 1024 * 1024,
+                 compress=True, fsync=True):
+        self.base_path = base_path
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.fsync = fsync
+        self._segments = {} # Room -> _ArchiveSegment
+        self._lock = threading.Lock()
+        self._unflushed_rows = 0
+        self._last_flush = time.monotonic()
+        self._compress_threads = []
+        os.makedirs(base_path, exist_ok=True)
+        self._recover_segments()
+
+    def _recover_segments(self):
+        # Reste abgebrochener Komprimierungen entfernen und abgeschlossene Segmente (frühere Tage oder voll)
+        # nachkomprimieren. Das aktuelle, nicht volle Segment eines Tages bleibt offen für weitere Zeilen.
+        today = time.strftime("%Y-%m-%d", time.gmtime())
+        closed = []
+        try:
+            for name in sorted(os.listdir(self.base_path)):
+                path = os.path.join(self.base_path, name)
+                if name.endswith(".gz.tmp"):
+                    os.remove(path)
+                    logger.info(f"Removed incomplete compressed archive segment {path}")
+                    continue
+                match = _SEGMENT_NAME.match(name)
+                if match is None:
+                    continue
+                if os.path.exists(path + ".gz"):
+                    # gzip war vollständig (os.replace), nur das Löschen des Originals fehlte
+                    os.remove(path)
+                    continue
+                if match.group("day") < today or os.path.getsize(path) >= self.max_bytes:
+                    closed.append(path)
+        except OSError as e:
+            logger.error(f"Failed to check archive segments in {self.base_path}: {e}", exc_info=True)
+        if closed and self.compress:
+            logger.info(f"Compressing {len(closed)} archive segment(s) left over from an earlier run.")
+            self._compress_in_background(closed)
+
+    def _compress_in_background(self, paths):
+        # Kein Daemon-Thread: ein beim Beenden abgebrochenes gzip hinterließe nur eine .gz.tmp-Datei
+        self._compress_threads = [t for t in self._compress_threads if t.is_alive()]
+        thread = threading.Thread(target=_compress_segments, args=(paths,), name="archive-gzip")
+        thread.start()
+        self._compress_threads.append(thread)
+
+    def _segment_path(self, room, day, seq):
+        suffix = f"_{seq}" if seq else ""
+        return os.path.join(self.base_path, f"{room}_{day}{suffix}.csv")
+
+    def _open_segment(self, room, day, seq=0):
+        # Nächstes nicht volles und nicht bereits komprimiertes Segment des Tages suchen
+        path = self._segment_path(room, day, seq)
+        while os.path.exists(path + ".gz") or (os.path.exists(path) and os.path.getsize(path) >= self.max_bytes):
+            seq += 1
+            path = self._segment_path(room, day, seq)
+        segment = _ArchiveSegment(path, day, seq)
+        self._segments[room] = segment
+        logger.info(f"Opened archive segment {path}")
+        return segment
+
+    def _segment_for(self, room, day):
+        segment = self._segments.get(room)
+        if segment is None:
+            return self._open_segment(room, day)
+        if segment.day != day:
+            self._rotate(room, segment)
+            return self._open_segment(room, day)
+        if segment.size >= self.max_bytes:
+            self._rotate(room, segment)
+            return self._open_segment(room, day, segment.seq + 1)
+        return segment
+
+    def _rotate(self, room, segment):
+        segment.close(self.fsync)
+        del self._segments[room]
+        logger.info(f"Closed archive segment {segment.path}")
+        if self.compress:
+            self._compress_in_background([segment.path])
+
+    def write(self, measurement_data):
+        room = measurement_data["Room"]
+        timestamp = measurement_data.get("timestamp_utc") or time.time()
+        day = time.strftime("%Y-%m-%d", time.gmtime(timestamp))
+        row = {key: measurement_data.get(key) for key in CSV_FIELDNAMES}
+        with self._lock:
+            segment = self._segment_for(room, day)
+            segment.write(row)
+            self._unflushed_rows += 1
+            if self._unflushed_rows >= self.flush_rows or time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush_locked()
+
+    def _flush_locked(self):
+        for segment in self._segments.values():
+            segment.sync(self.fsync)
+        self._unflushed_rows = 0
+        self._last_flush = time.monotonic()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def flush_if_due(self):
+        # Zeitbasiertes Flush, auch wenn keine neuen Zeilen mehr eintreffen
+        with self._lock:
+            if self._unflushed_rows and time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush_locked()
+
+    def close(self):
+        with self._lock:
+            for segment in self._segments.values():
+                segment.close(self.fsync)
+            self._segments = {}
+            self._unflushed_rows = 0
+            threads, self._compress_threads = self._compress_threads, []
+        for thread in threads:
+            thread.join()
+
+
+def _compress_segments(paths):
+    for path in paths:
+        _compress_segment(path)
+
+
+def _compress_segment(path):
+    try:
+        with open(path, 'rb') as source, gzip.open(path + ".gz.tmp", 'wb') as target:
+            shutil.copyfileobj(source, target)
+        os.replace(path + ".gz.tmp", path + ".gz")
+        os.remove(path)
+        logger.info(f"Compressed archive segment {path}")
+    except OSError as e:
+        logger.error(f"Failed to compress archive segment {path}: {e}", exc_info=True)
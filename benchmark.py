@@ -0,0 +1,421 @@
+import argparse
+import functools
+import json
+import logging
+import os
+import random
+import resource
+import struct
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid as uuid_module
+
+from log_setup import configure_logging
+from mqtt_standin import MqttStandinBroker
+
+# Benchmark ohne Hardware
+# Ersetzt btle.Peripheral durch simulierte Sensoren mit einstellbaren Latenzen, Fehler- und Abbruchraten
+# und den Broker durch MqttStandinBroker. Anschließend läuft die echte main()-Schleife (Polling Engine,
+# BleSessionManager, Decoder, CSV-/Binärarchiv, Edge Stage, MqttClientHandler) für N Sensoren.
+# Aufruf z.B.: python benchmark.py --sensors 50 --cycles 5 --interval 5 --json bench.json
+# Scan-Modus ohne GATT-Verbindungen: python benchmark.py --mode scan --sensors 300 --interval 5
+
+
+# Simulierte BLE-Sensoren
+class FakeBleConfig:
+    connect_latency = 0.2 # Sekunden
+    discovery_latency = 0.3
+    read_latency = 0.05 # pro Charakteristik
+    failure_rate = 0.0 # Wahrscheinlichkeit, dass ein Verbindungsaufbau scheitert
+    dead_macs = () # Sensoren, die nie antworten
+    disconnect_rate = 0.0 # Wahrscheinlichkeit, dass die Verbindung bei einem Lesevorgang abreißt
+    jitter = 0.2 # relative Streuung der Latenzen
+    service_uuid = None
+    characteristics = [] # Charakteristik-Konfigurationen aus main.SENSOR_TYPES
+    advert_interval = 1.0 # Sekunden zwischen zwei Advertisements eines Sensors (Scan-Modus)
+    advert_change_rate = 0.2 # Wahrscheinlichkeit, dass sich die Messwerte im nächsten Advertisement ändern
+    advertisement = None # Advertisement-Konfiguration aus main.SENSOR_TYPES
+
+    @classmethod
+    def sleep(cls, latency):
+        if latency > 0:
+            time.sleep(latency * random.uniform(1 - cls.jitter, 1 + cls.jitter))
+
+
+def _fake_value(config):
+    # Plausible Rohdaten im Format der Charakteristik erzeugen
+    layout = struct.Struct(config.get("format", "<I"))
+    name = config["name"]
+    if name == "co2_ppm":
+        return layout.pack(random.randint(400, 1500))
+    if name == "pressure_Pa":
+        return layout.pack(random.randint(94800, 95000))
+    if config.get("format") == "<HH":
+        return layout.pack(random.randint(20, 30), random.randint(0, 999))
+    return os.urandom(layout.size)
+
+
+def _disconnect_error(btle, mac):
+    return btle.BTLEDisconnectError(f"Simulated disconnect from {mac}")
+
+
+class _FakeCharacteristic:
+    def __init__(self, uuid, handle):
+        self.uuid = uuid
+        self._handle = handle
+
+    def getHandle(self):
+        return self._handle
+
+
+class _FakeService:
+    def __init__(self, characteristics):
+        self._characteristics = characteristics
+
+    def getCharacteristics(self, forUUID=None):
+        if forUUID is None:
+            return list(self._characteristics)
+        return [c for c in self._characteristics if str(c.uuid) == str(forUUID)]
+
+
+def install_fake_ble(settings):
+    # Setzt die simulierten Sensoren ein; läuft auch in den Worker-Prozessen von ShardedPollingEngine
+    from bluepy import btle
+    for name, value in settings.items():
+        setattr(FakeBleConfig, name, value)
+    btle.Peripheral = make_fake_peripheral(btle)
+
+
+def make_fake_peripheral(btle):
+    class FakePeripheral:
+        def __init__(self, deviceAddr=None, addrType="public", iface=None):
+            self.addr = deviceAddr
+            self.iface = iface
+            self._connected = False
+            FakeBleConfig.sleep(FakeBleConfig.connect_latency)
+            if deviceAddr in FakeBleConfig.dead_macs or random.random() < FakeBleConfig.failure_rate:
+                raise _disconnect_error(btle, deviceAddr)
+            self._connected = True
+            # Feste GATT-Tabelle: Declaration auf handle - 1, Wert auf handle (wie bei echten Sensoren)
+            self._by_handle = {}
+            self._declarations = {}
+            for index, config in enumerate(FakeBleConfig.characteristics):
+                handle = 0x11 + 2 * index
+                self._by_handle[handle] = config
+                self._declarations[handle - 1] = (bytes([0x02]) + handle.to_bytes(2, "little")
+                                                  + uuid_module.UUID(config["uuid"]).bytes[::-1])
+
+        def _check(self):
+            if not self._connected:
+                raise _disconnect_error(btle, self.addr)
+
+        def getServiceByUUID(self, uuid):
+            self._check()
+            FakeBleConfig.sleep(FakeBleConfig.discovery_latency)
+            characteristics = [_FakeCharacteristic(btle.UUID(config["uuid"]), handle) for handle, config in self._by_handle.items()]
+            return _FakeService(characteristics)
+
+        def readCharacteristic(self, handle):
+            self._check()
+            FakeBleConfig.sleep(FakeBleConfig.read_latency)
+            if random.random() < FakeBleConfig.disconnect_rate:
+                self._connected = False
+                raise _disconnect_error(btle, self.addr)
+            if handle in self._declarations:
+                return self._declarations[handle]
+            if handle not in self._by_handle:
+                raise btle.BTLEGattError(f"Invalid handle {handle}")
+            return _fake_value(self._by_handle[handle])
+
+        def disconnect(self):
+            self._connected = False
+
+    return FakePeripheral
+
+
+# Simulierter Scanner: jeder Sensor sendet alle advert_interval Sekunden ein Advertisement
+def _fake_advert(config):
+    fields = config["fields"]
+    payload = bytearray(max(f.get("position", 0) + struct.calcsize(f.get("format", "<I")) for f in fields))
+    for field in fields:
+        if field["name"] == "co2_ppm":
+            value = random.randint(400, 1500)
+        elif field["name"] == "pressure_Pa":
+            value = random.randint(94800, 95000)
+        else:
+            value = random.randint(1000, 3000)
+        struct.pack_into(field.get("format", "<I"), payload, field.get("position", 0), value)
+    prefix = config.get("service_uuid16") if config.get("source") == "service_data" else config.get("company_id")
+    return (prefix or 0).to_bytes(2, "little") + bytes(payload)
+
+
+class _FakeScanEntry:
+    def __init__(self, addr, ad_type, data):
+        self.addr = addr
+        self.rssi = random.randint(-90, -40)
+        self._data = {ad_type: data}
+
+    def getValue(self, sdid):
+        return self._data.get(sdid)
+
+
+def make_fake_scanner(btle, macs):
+    class FakeScanner:
+        def __init__(self, iface=0):
+            self.iface = iface
+            self.delegate = None
+            self._macs = [mac.lower() for mac in macs]
+            self._payloads = {}
+            self._next = 0
+            self._credit = 0.0
+
+        def withDelegate(self, delegate):
+            self.delegate = delegate
+            return self
+
+        def start(self, passive=False):
+            pass
+
+        def stop(self):
+            pass
+
+        def clear(self):
+            pass
+
+        def process(self, timeout=10.0):
+            config = FakeBleConfig.advertisement
+            ad_type = btle.ScanEntry.SERVICE_DATA_16B if config.get("source") == "service_data" else btle.ScanEntry.MANUFACTURER
+            rate = len(self._macs) / FakeBleConfig.advert_interval # Advertisements pro Sekunde insgesamt
+            end = time.monotonic() + timeout
+            last = time.monotonic()
+            while True:
+                now = time.monotonic()
+                if now >= end:
+                    return
+                time.sleep(min(0.02, end - now))
+                now = time.monotonic()
+                self._credit += (now - last) * rate
+                last = now
+                while self._credit >= 1:
+                    self._credit -= 1
+                    mac = self._macs[self._next % len(self._macs)]
+                    self._next += 1
+                    if mac not in self._payloads or random.random() < FakeBleConfig.advert_change_rate:
+                        self._payloads[mac] = _fake_advert(config)
+                    self.delegate.handleDiscovery(_FakeScanEntry(mac, ad_type, self._payloads[mac]), False, True)
+
+    return FakeScanner
+
+
+# Zeitmessung pro Stufe
+class StageTimer:
+    def __init__(self):
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+    def wrap(self, stage, func):
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start)
+        return timed
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def run_benchmark(args):
+    workdir = tempfile.mkdtemp(prefix="co2_bench_")
+    # Logging vor dem Import von main konfigurieren, damit sensor_mqtt.log unberührt bleibt
+    configure_logging(os.path.join(workdir, "benchmark.log"), level=getattr(logging, args.log_level))
+
+    import main
+    import ble_session
+    import ble_scan
+    from bluepy import btle
+    from edge import EdgeStage
+
+    broker = MqttStandinBroker(ack_delay=args.broker_latency, topic_alias_maximum=args.topic_aliases).start()
+    arrivals = []
+    broker.on_message = lambda message: arrivals.append(message.received_at)
+
+    sensor_type = main.SENSOR_TYPES[main.DEFAULT_SENSOR_TYPE]
+    fake_settings = {
+        "connect_latency": args.connect_latency,
+        "discovery_latency": args.discovery_latency,
+        "read_latency": args.read_latency,
+        "failure_rate": args.failure_rate,
+        "disconnect_rate": args.disconnect_rate,
+        "characteristics": sensor_type["characteristics"],
+        "advert_interval": args.advert_interval,
+        "advertisement": sensor_type.get("advertisement"),
+    }
+    install_fake_ble(fake_settings)
+
+    # Konfiguration von main auf die simulierte Umgebung umbiegen
+    main.SENSORS = [{"BT_TARGET_ADDRESSES": "02:00:00:%02X:%02X:%02X" % (i >> 16 & 0xFF, i >> 8 & 0xFF, i & 0xFF),
+                     "Room": f"BENCH{i % max(1, args.rooms)}", "Sensor_Position": "1.5m"} for i in range(args.sensors)]
+    fake_settings["dead_macs"] = FakeBleConfig.dead_macs = {s["BT_TARGET_ADDRESSES"] for s in main.SENSORS[:args.dead_sensors]}
+    main.MQTT_BROKER, main.MQTT_PORT = broker.host, broker.port
+    main.MQTT_CLIENT_ID = "benchmark"
+    main.MQTT_COMBINED_PAYLOAD = args.combined
+    main.MEASUREMENT_INTERVAL = args.interval
+    main.SENSOR_TIMEOUT = min(args.interval, args.sensor_timeout)
+    main.MAX_WORKERS = args.workers
+    main.CSV_BASE_PATH = os.path.join(workdir, "csv")
+    main.BINARY_ARCHIVE_PATH = os.path.join(workdir, "tsb")
+    main.OUTBOX_PATH = os.path.join(workdir, "outbox.db")
+    main.HANDLE_CACHE_PATH = os.path.join(workdir, "gatt_handles.json")
+    main.METRICS_PORT = args.metrics_port
+    main.COLLECTION_MODE = args.mode
+    main.SCHEDULING = args.scheduling
+    main.SENSOR_RETRY_DELAY = args.retry_delay
+    main.BLE_ADAPTERS = list(range(args.adapters))
+    main.ADAPTER_MAX_CONNECTIONS = args.max_connections
+    main.BLE_MAX_SESSIONS = args.max_sessions or None
+    btle.Scanner = make_fake_scanner(btle, [s["BT_TARGET_ADDRESSES"] for s in main.SENSORS])
+    if args.no_edge:
+        main.edge_stage = EdgeStage()
+
+    timer = StageTimer()
+    main.get_sensor_data = timer.wrap("ble_read_total", main.get_sensor_data)
+    main.write_to_csv = timer.wrap("csv_write", main.write_to_csv)
+    main.write_to_binary_archive = timer.wrap("binary_write", main.write_to_binary_archive)
+    main.SensorPollingEngine.run_cycle = timer.wrap("cycle", main.SensorPollingEngine.run_cycle)
+    main.SensorScanEngine.run_cycle = timer.wrap("cycle", main.SensorScanEngine.run_cycle)
+    main.ShardedPollingEngine.run_cycle = timer.wrap("cycle", main.ShardedPollingEngine.run_cycle)
+    # Ohne gemeinsame Zyklen: Zeit von der Fälligkeit bis zur verarbeiteten Messung pro Sensor
+    original_record_cycle = main.ScheduledPollingEngine._record_cycle
+    def record_cycle(self, sensor_mac, cycle_seconds):
+        timer.record("cycle", cycle_seconds)
+        return original_record_cycle(self, sensor_mac, cycle_seconds)
+    main.ScheduledPollingEngine._record_cycle = record_cycle
+    # Worker-Prozesse starten per spawn und brauchen die Simulation ebenfalls
+    main.ShardedPollingEngine = functools.partial(main.ShardedPollingEngine,
+                                                  worker_init=functools.partial(install_fake_ble, fake_settings))
+    main.MqttClientHandler.publish = timer.wrap("mqtt_publish", main.MqttClientHandler.publish)
+    ble_session.BleSessionManager._connect = timer.wrap("ble_connect", ble_session.BleSessionManager._connect)
+    ble_session.BleSessionManager._discover = timer.wrap("ble_discovery", ble_session.BleSessionManager._discover)
+    main.DecoderRegistry.decode = timer.wrap("decode", main.DecoderRegistry.decode)
+    ble_scan.AdvertisementDecoder.decode = timer.wrap("decode", ble_scan.AdvertisementDecoder.decode)
+    main.EdgeStage.process = timer.wrap("edge", main.EdgeStage.process)
+
+    original_on_publish = main.MqttClientHandler.on_publish
+    def on_publish(self, client, userdata, mid):
+        entry = self._pending.get(mid)
+        if entry is not None:
+            timer.record("mqtt_ack", time.monotonic() - entry[1])
+        return original_on_publish(self, client, userdata, mid)
+    main.MqttClientHandler.on_publish = on_publish
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    start = time.monotonic()
+    if args.once:
+        # Jeder Durchlauf wie ein neuer Cron-Prozess: Handles nur aus der Cache-Datei, nicht aus dem Speicher
+        for _ in range(args.cycles):
+            for sessions in main.ble_sessions_by_type.values():
+                sessions._handles.clear()
+            run_start = time.monotonic()
+            already_received = len(arrivals)
+            main.run_once()
+            timer.record("once_total", time.monotonic() - run_start)
+            if len(arrivals) > already_received:
+                timer.record("once_first_publish", arrivals[already_received] - run_start)
+    else:
+        main.main(max_cycles=args.cycles)
+    elapsed = time.monotonic() - start
+    broker.stop()
+
+    result = {
+        "sensors": args.sensors,
+        "cycles": args.cycles,
+        "elapsed_s": round(elapsed, 3),
+        "messages": broker.messages_received,
+        "messages_per_s": round(broker.messages_received / elapsed, 1) if elapsed else 0.0,
+        "bytes_received": broker.bytes_received,
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "stages": {},
+        "workdir": workdir,
+    }
+    if args.tracemalloc:
+        result["tracemalloc_peak_kb"] = tracemalloc.get_traced_memory()[1] // 1024
+        tracemalloc.stop()
+    for stage, values in sorted(timer.samples.items()):
+        result["stages"][stage] = {
+            "count": len(values),
+            "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+            "max_ms": round(max(values) * 1000, 3),
+        }
+    return result
+
+
+def print_report(result, out=sys.stdout):
+    out.write(f"Sensors: {result['sensors']}  Cycles: {result['cycles']}  Elapsed: {result['elapsed_s']} s\n")
+    out.write(f"MQTT messages: {result['messages']} ({result['messages_per_s']}/s, {result['bytes_received']} bytes)\n")
+    out.write(f"Max RSS: {result['max_rss_kb']} kB")
+    if "tracemalloc_peak_kb" in result:
+        out.write(f"  tracemalloc peak: {result['tracemalloc_peak_kb']} kB")
+    out.write("\n\n")
+    out.write(f"{'stage':<16}{'count':>8}{'p50 ms':>12}{'p95 ms':>12}{'p99 ms':>12}{'max ms':>12}\n")
+    for stage, stats in result["stages"].items():
+        out.write(f"{stage:<16}{stats['count']:>8}{stats['p50_ms']:>12}{stats['p95_ms']:>12}{stats['p99_ms']:>12}{stats['max_ms']:>12}\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Hardware-free benchmark of the sensor polling and publishing pipeline.")
+    parser.add_argument("--sensors", type=int, default=10)
+    parser.add_argument("--rooms", type=int, default=1)
+    parser.add_argument("--cycles", type=int, default=3)
+    parser.add_argument("--interval", type=float, default=5, help="MEASUREMENT_INTERVAL in seconds")
+    parser.add_argument("--sensor-timeout", type=float, default=20)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--connect-latency", type=float, default=0.2)
+    parser.add_argument("--discovery-latency", type=float, default=0.3)
+    parser.add_argument("--read-latency", type=float, default=0.05)
+    parser.add_argument("--mode", choices=["connect", "scan"], default="connect", help="COLLECTION_MODE of main.py")
+    parser.add_argument("--advert-interval", type=float, default=1.0, help="Seconds between adverts of one sensor (scan mode)")
+    parser.add_argument("--once", action="store_true", help="Run main.run_once() --cycles times (cron mode)")
+    parser.add_argument("--scheduling", choices=["priority", "grid"], default="priority", help="SCHEDULING of main.py")
+    parser.add_argument("--retry-delay", type=float, default=5, help="SENSOR_RETRY_DELAY in seconds")
+    parser.add_argument("--dead-sensors", type=int, default=0, help="Number of sensors that never answer")
+    parser.add_argument("--adapters", type=int, default=1, help="Number of simulated Bluetooth adapters (worker processes)")
+    parser.add_argument("--max-connections", type=int, default=4, help="ADAPTER_MAX_CONNECTIONS per adapter")
+    parser.add_argument("--max-sessions", type=int, default=5, help="BLE_MAX_SESSIONS per adapter (0 = unlimited)")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--disconnect-rate", type=float, default=0.0)
+    parser.add_argument("--broker-latency", type=float, default=0.024, help="Simulated PUBACK round trip in seconds")
+    parser.add_argument("--topic-aliases", type=int, default=64, help="TopicAliasMaximum announced by the stand-in broker")
+    parser.add_argument("--combined", action="store_true", help="Publish one combined payload per reading")
+    parser.add_argument("--no-edge", action="store_true", help="Disable deadband suppression and aggregates")
+    parser.add_argument("--metrics-port", type=int, default=None, help="Serve the Prometheus endpoint during the run")
+    parser.add_argument("--tracemalloc", action="store_true", help="Track Python heap peak (slows the run down)")
+    parser.add_argument("--log-level", default="WARNING", choices=["DEBUG", "INFO", "WARNING", "ERROR"])
+    parser.add_argument("--json", help="Write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    result = run_benchmark(args)
+    print_report(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import logging
+import threading
+import time
+from bluepy import btle
+from decoders import CharacteristicDecoder
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Passive Erfassung über BLE-Advertisements
+# Statt pro Sensor eine GATT-Verbindung aufzubauen, hört ein btle.Scanner auf die Advertisements, in denen
+# die Sensoren ihre Messwerte als Manufacturer Data (AD-Typ 0xFF) oder Service Data (AD-Typ 0x16) senden.
+# Nur MACs aus SENSORS werden ausgewertet, identische Wiederholungen eines Advertisements nicht erneut dekodiert.
+# Hinweis: bluepy-helper benötigt für Scans dieselben Capabilities wie für Verbindungen (cap_net_raw,cap_net_admin).
+
+
+# Decoder für den Payload eines Advertisements
+# source "manufacturer": die ersten beiden Bytes sind die Company ID (little-endian), danach folgen die Felder.
+# source "service_data": die ersten beiden Bytes sind die 16-Bit-Service-UUID (little-endian).
+# Jedes Feld wird wie eine Charakteristik konfiguriert (format, weights, scale, ...) und liegt ab "position"
+# (Byte-Offset nach der Company ID bzw. Service-UUID).
+class AdvertisementDecoder:
+    def __init__(self, fields, source="manufacturer", company_id=None, service_uuid16=None):
+        self.source = source
+        self.ad_type = btle.ScanEntry.SERVICE_DATA_16B if source == "service_data" else btle.ScanEntry.MANUFACTURER
+        prefix = service_uuid16 if source == "service_data" else company_id
+        self.prefix = prefix.to_bytes(2, "little") if prefix is not None else None
+        self.fields = list(fields) # [(Position, CharacteristicDecoder)]
+        self.min_length = max((position + decoder.layout.size for position, decoder in self.fields), default=0)
+
+    @classmethod
+    def from_config(cls, config):
+        fields = [(field.get("position", 0), CharacteristicDecoder.from_config(dict(field, uuid=field["name"])))
+                  for field in config["fields"]]
+        return cls(fields, source=config.get("source", "manufacturer"), company_id=config.get("company_id"),
+                   service_uuid16=config.get("service_uuid16"))
+
+    def payload(self, scan_entry):
+        # Rohdaten des passenden AD-Eintrags ohne Company ID/Service-UUID, None wenn nicht vorhanden
+        raw = scan_entry.getValue(self.ad_type)
+        if raw is None or len(raw) < 2:
+            return None
+        if self.prefix is not None and bytes(raw[:2]) != self.prefix:
+            return None
+        return bytes(raw[2:])
+
+    def decode(self, payload):
+        # Gibt (data_list für MQTT, measurement für CSV) zurück, analog zu DecoderRegistry.decode
+        if len(payload) < self.min_length:
+            raise ValueError(f"Advertisement payload too short: {len(payload)} < {self.min_length} bytes")
+        data_list = []
+        measurement = {}
+        for position, decoder in self.fields:
+            value = decoder.decode(payload[position:])
+            data_list.append({"name": decoder.name, "unit": decoder.unit, "value": value})
+            measurement[decoder.field] = value
+        return data_list, measurement
+
+    def empty_measurement(self):
+        return {decoder.field: None for _, decoder in self.fields}
+
+
+# Sammelt die jeweils neueste dekodierte Messung pro Sensor
+class AdvertisementCollector:
+    def __init__(self, decoders_by_mac):
+        # decoders_by_mac: {MAC: AdvertisementDecoder}; MACs werden wie von bluepy gemeldet klein geschrieben
+        self.decoders_by_mac = {mac.lower(): decoder for mac, decoder in decoders_by_mac.items()}
+        self._lock = threading.Lock()
+        self._latest = {} # MAC -> (Payload, data_list, measurement, RSSI, Empfangszeitpunkt)
+        self._collected_since = time.time()
+
+    def handle(self, mac, scan_entry):
+        decoder = self.decoders_by_mac.get(mac)
+        if decoder is None:
+            return # Fremdes Gerät
+        payload = decoder.payload(scan_entry)
+        if payload is None:
+            metrics.inc("ble_adverts_total", result="ignored")
+            return
+        now = time.time()
+        with self._lock:
+            previous = self._latest.get(mac)
+            if previous is not None and previous[0] == payload:
+                # Gleicher Inhalt wie zuvor: nur den Empfangszeitpunkt aktualisieren
+                self._latest[mac] = previous[:3] + (scan_entry.rssi, now)
+                metrics.inc("ble_adverts_total", result="duplicate")
+                return
+        try:
+            data_list, measurement = decoder.decode(payload)
+        except Exception as e:
+            logger.warning(f"Could not decode advertisement of sensor {mac}: {e}", extra={"rate_key": "advert_decode_error"})
+            metrics.inc("ble_adverts_total", result="invalid")
+            return
+        with self._lock:
+            self._latest[mac] = (payload, data_list, measurement, scan_entry.rssi, now)
+        metrics.inc("ble_adverts_total", result="decoded")
+
+    def pending(self):
+        # Anzahl der Sensoren, die seit dem letzten drain() gesendet haben
+        with self._lock:
+            return sum(1 for entry in self._latest.values() if entry[4] >= self._collected_since)
+
+    def drain(self):
+        # Neueste Messung jedes Sensors, der seit dem letzten Aufruf gesendet hat:
+        # {MAC: (data_list, measurement, RSSI, Empfangszeitpunkt)}
+        with self._lock:
+            since, self._collected_since = self._collected_since, time.time()
+            return {mac: entry[1:5] for mac, entry in self._latest.items() if entry[4] >= since}
+
+
+class _ScanDelegate(btle.DefaultDelegate):
+    def __init__(self, collector):
+        btle.DefaultDelegate.__init__(self)
+        self.collector = collector
+
+    def handleDiscovery(self, scanEntry, isNewDev, isNewData):
+        self.collector.handle(scanEntry.addr, scanEntry)
+
+
+# Hintergrund-Thread, der dauerhaft scannt und bei Fehlern des Helpers den Scan neu startet
+class AdvertisementScanner(threading.Thread):
+    def __init__(self, collector, iface=0, passive=True, window=1.0, restart_delay=5):
+        super().__init__(name="ble-scanner", daemon=True)
+        self.collector = collector
+        self.iface = iface
+        self.passive = passive # Passiv: keine Scan Requests, nur die Advertisements selbst
+        self.window = window # Sekunden pro process()-Aufruf, bestimmt die Reaktionszeit auf stop()
+        self.restart_delay = restart_delay
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            scanner = btle.Scanner(self.iface).withDelegate(_ScanDelegate(self.collector))
+            try:
+                scanner.start(passive=self.passive)
+                logger.info(f"Started {'passive' if self.passive else 'active'} BLE scan on hci{self.iface}.")
+                while not self._stop_event.is_set():
+                    scanner.process(self.window)
+                    # bluepy merkt sich jedes gesehene Gerät; regelmäßig leeren, damit fremde Geräte keinen Speicher binden
+                    scanner.clear()
+            except btle.BTLEException as e:
+                logger.error(f"BLE scan on hci{self.iface} failed: {e}. Restarting in {self.restart_delay} seconds.")
+                metrics.inc("ble_scan_restarts_total")
+                self._stop_event.wait(self.restart_delay)
+            finally:
+                try:
+                    scanner.stop()
+                except Exception:
+                    pass
+
+    def stop(self, timeout=None):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout if timeout is not None else self.window + 5)
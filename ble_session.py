@@ -0,0 +1,276 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid as uuid_module
+from collections import OrderedDict
+from bluepy import btle
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+# Persistenter Cache der GATT-Handles
+# Speichert pro MAC die Value-Handles der Charakteristiken in einer kleinen JSON-Datei, damit ein neuer Prozess
+# (z.B. ein Cron-Lauf mit --once) ohne Service-Discovery direkt per Handle lesen kann. Einträge gelten nur für
+# denselben Service und dieselben Charakteristiken und verfallen nach max_age Sekunden.
+# Mehrere Prozesse dürfen dieselbe Datei nutzen: beim Speichern werden nur die eigenen Änderungen eingemischt.
+class HandleCache:
+    def __init__(self, path, max_age=7 * 86400):
+        self.path = path
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._entries = None # MAC -> {"service", "handles", "discovered_at"}, erst bei Bedarf geladen
+
+    def _read_file(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable GATT handle cache {self.path}: {e}")
+            return {}
+
+    def _load(self):
+        if self._entries is None:
+            self._entries = self._read_file()
+        return self._entries
+
+    def get(self, mac, service_uuid, characteristic_uuids):
+        with self._lock:
+            entry = self._load().get(mac)
+        if entry is None or entry.get("service") != str(service_uuid):
+            return None
+        handles = entry.get("handles", {})
+        if set(handles) != {str(uuid) for uuid in characteristic_uuids}:
+            return None
+        if time.time() - entry.get("discovered_at", 0) > self.max_age:
+            return None
+        return dict(handles)
+
+    def put(self, mac, service_uuid, handles):
+        self._save(mac, {"service": str(service_uuid), "handles": dict(handles), "discovered_at": int(time.time())})
+
+    def invalidate(self, mac):
+        with self._lock:
+            known = mac in self._load()
+        if known:
+            self._save(mac, None)
+
+    def _save(self, mac, entry):
+        with self._lock:
+            entries = self._load()
+            if entry is None:
+                entries.pop(mac, None)
+            else:
+                entries[mac] = entry
+            # Änderungen anderer Prozesse übernehmen, nur der eigene Eintrag wird überschrieben
+            merged = self._read_file()
+            if entry is None:
+                merged.pop(mac, None)
+            else:
+                merged[mac] = entry
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(merged, f, indent=1, sort_keys=True)
+                os.replace(tmp_path, self.path) # atomar, Leser sehen nie eine halb geschriebene Datei
+            except OSError as e:
+                logger.warning(f"Could not write GATT handle cache {self.path}: {e}")
+
+
+def _declaration_matches(declaration, value_handle, uuid):
+    # Characteristic Declaration: Properties (1 Byte), Value-Handle (2 Byte LE), UUID (2 oder 16 Byte LE)
+    if len(declaration) not in (5, 19) or int.from_bytes(declaration[1:3], "little") != value_handle:
+        return False
+    expected = uuid_module.UUID(str(uuid)).bytes[::-1]
+    if len(declaration) == 5:
+        expected = expected[12:14] # 16-Bit-UUID innerhalb der Bluetooth-Basis-UUID
+    return bytes(declaration[3:]) == expected
+
+
+# Begrenzung der gehaltenen Verbindungen pro Adapter
+# LE-Controller akzeptieren nur etwa 5-7 gleichzeitige Verbindungen, jede gehaltene Session belegt eine davon
+# (und einen bluepy-helper-Prozess). Alle Session Manager eines Adapters teilen sich ein SessionLimit; über
+# max_sessions hinaus wird die am längsten nicht benutzte Verbindung getrennt (LRU). Die Handles bleiben
+# gespeichert, ein verdrängter Sensor wird beim nächsten Mal also nur verbunden, per Handle gelesen und wieder
+# verdrängt.
+class SessionLimit:
+    def __init__(self, max_sessions):
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict() # (Session Manager, MAC) -> None, älteste zuerst
+
+    def used(self, manager, mac):
+        # Markiert die Session als zuletzt benutzt und gibt die zu verdrängenden Sessions zurück
+        with self._lock:
+            self._sessions[(manager, mac)] = None
+            self._sessions.move_to_end((manager, mac))
+            excess = len(self._sessions) - self.max_sessions
+            return list(self._sessions)[:max(0, excess)]
+
+    def released(self, manager, mac):
+        with self._lock:
+            self._sessions.pop((manager, mac), None)
+
+
+# BLE Session Manager
+# Hält die Verbindung zu jedem Sensor über mehrere Zyklen offen und merkt sich die Handles der
+# Charakteristiken pro MAC. Gelesen wird direkt per Handle (readCharacteristic), die Service-Discovery
+# läuft nur beim ersten Kontakt bzw. nach einem GATT-Fehler erneut. Mit einem HandleCache entfällt sie auch
+# beim ersten Kontakt eines neuen Prozesses, solange die gespeicherten Handles noch passen.
+# Mit einem SessionLimit werden höchstens dessen max_sessions Verbindungen gehalten (siehe oben).
+class BleSessionManager:
+    def __init__(self, service_uuid, characteristic_uuids, iface=None, handle_cache=None, session_limit=None):
+        self.service_uuid = btle.UUID(service_uuid)
+        self.characteristic_uuids = [btle.UUID(uuid) for uuid in characteristic_uuids]
+        self.iface = iface # z.B. 0 für hci0, None = Standardadapter
+        self.handle_cache = handle_cache
+        self.session_limit = session_limit
+        self._peripherals = {} # MAC -> btle.Peripheral
+        self._handles = {} # MAC -> {UUID-String: Value-Handle}
+        self._lock = threading.Lock()
+        self._mac_locks = {} # Pro Sensor nur ein gleichzeitiger Zugriff
+
+    def _mac_lock(self, mac):
+        with self._lock:
+            return self._mac_locks.setdefault(mac, threading.Lock())
+
+    def _connect(self, mac):
+        logger.info(f"Connecting to BTLE sensor {mac}", extra={"rate_key": "ble_connecting"})
+        with metrics.timer("ble_connect_seconds", mac=mac):
+            if self.iface is None:
+                peripheral = btle.Peripheral(mac)
+            else:
+                peripheral = btle.Peripheral(mac, iface=self.iface)
+        metrics.inc("ble_connects_total", mac=mac)
+        logger.info(f"Connected to BTLE sensor {mac}", extra={"rate_key": "ble_connected"})
+        self._peripherals[mac] = peripheral
+        return peripheral
+
+    def _discover(self, mac, peripheral):
+        with metrics.timer("ble_discovery_seconds", mac=mac):
+            service = peripheral.getServiceByUUID(self.service_uuid)
+            # Ein einziger Discovery-Aufruf für alle Charakteristiken des Service
+            by_uuid = {str(char.uuid): char.getHandle() for char in service.getCharacteristics()}
+        handles = {}
+        for uuid in self.characteristic_uuids:
+            if str(uuid) not in by_uuid:
+                raise btle.BTLEGattError(f"Characteristic {uuid} not found on sensor {mac}")
+            handles[str(uuid)] = by_uuid[str(uuid)]
+        logger.info(f"Discovered characteristic handles for {mac}: {handles}")
+        self._handles[mac] = handles
+        if self.handle_cache is not None:
+            self.handle_cache.put(mac, self.service_uuid, handles)
+        return handles
+
+    def _cached_handles(self, mac, peripheral):
+        # Gespeicherte Handles prüfen: die Declaration vor dem höchsten Value-Handle muss auf genau diese
+        # Charakteristik zeigen. Verschieben sich die Handles (Firmware-Update), passt sie nicht mehr.
+        handles = self.handle_cache.get(mac, self.service_uuid, self.characteristic_uuids)
+        if not handles:
+            return None
+        uuid, handle = max(handles.items(), key=lambda item: item[1])
+        try:
+            valid = _declaration_matches(peripheral.readCharacteristic(handle - 1), handle, uuid)
+        except btle.BTLEGattError:
+            valid = False
+        if not valid:
+            logger.info(f"Cached GATT handles of {mac} are stale. Rediscovering.")
+            metrics.inc("ble_handle_cache_total", mac=mac, result="stale")
+            self.handle_cache.invalidate(mac)
+            return None
+        metrics.inc("ble_handle_cache_total", mac=mac, result="hit")
+        self._handles[mac] = handles
+        return handles
+
+    def _read_handles(self, mac):
+        peripheral = self._peripherals.get(mac) or self._connect(mac)
+        handles = self._handles.get(mac)
+        if handles is None and self.handle_cache is not None:
+            handles = self._cached_handles(mac, peripheral)
+        if handles is None:
+            handles = self._discover(mac, peripheral)
+        readings = {}
+        for uuid, handle in handles.items():
+            with metrics.timer("ble_read_seconds", mac=mac, characteristic=uuid):
+                readings[uuid] = peripheral.readCharacteristic(handle)
+        return readings
+
+    def read(self, mac):
+        # Gibt {UUID-String: Rohdaten (bytes)} zurück. Fehler werden nach dem Aufräumen weitergereicht,
+        # damit get_sensor_data() seine Retry-Logik anwenden kann.
+        with self._mac_lock(mac):
+            readings = self._read_locked(mac)
+            session_limit = self.session_limit if mac in self._peripherals else None
+        if session_limit is not None:
+            for manager, victim in session_limit.used(self, mac):
+                manager._evict(victim)
+        return readings
+
+    def _evict(self, mac):
+        # Sensoren, die gerade gelesen werden, bleiben verbunden; sie kommen beim nächsten Überlauf wieder dran
+        lock = self._mac_lock(mac)
+        if not lock.acquire(blocking=False):
+            return
+        try:
+            if mac in self._peripherals:
+                logger.debug(f"Releasing idle link to BTLE sensor {mac} (session limit reached).")
+                metrics.inc("ble_session_evictions_total")
+                self._drop(mac)
+        finally:
+            lock.release()
+
+    def _read_locked(self, mac):
+        # Muss unter dem Lock des Sensors laufen (siehe read)
+        reused = mac in self._peripherals
+        try:
+            return self._read_handles(mac)
+        except btle.BTLEDisconnectError:
+            metrics.inc("ble_errors_total", mac=mac, error="disconnect")
+            self._drop(mac)
+            if not reused:
+                raise
+            # Die gehaltene Verbindung war abgerissen: einmal sofort neu verbinden statt auf den Retry zu warten
+            logger.info(f"Cached link to BTLE sensor {mac} was lost. Reconnecting.")
+            metrics.inc("ble_reconnects_total", mac=mac)
+            try:
+                return self._read_handles(mac)
+            except btle.BTLEException:
+                self._drop(mac)
+                raise
+        except btle.BTLEGattError:
+            # Handles sind möglicherweise veraltet (z.B. Firmware-Update am Sensor)
+            metrics.inc("ble_errors_total", mac=mac, error="gatt")
+            self._handles.pop(mac, None)
+            if self.handle_cache is not None:
+                self.handle_cache.invalidate(mac)
+            self._drop(mac)
+            raise
+        except Exception:
+            metrics.inc("ble_errors_total", mac=mac, error="other")
+            self._drop(mac)
+            raise
+
+    def _drop(self, mac):
+        peripheral = self._peripherals.pop(mac, None)
+        if self.session_limit is not None:
+            self.session_limit.released(self, mac)
+        if peripheral is None:
+            return
+        try:
+            peripheral.disconnect()
+            logger.info(f"Disconnected from BTLE sensor {mac}")
+        except Exception as e:
+            logger.error(f"Error disconnecting from sensor {mac}: {e}", exc_info=True)
+
+    def disconnect(self, mac):
+        with self._mac_lock(mac):
+            self._drop(mac)
+
+    def close_all(self):
+        for mac in list(self._peripherals):
+            self.disconnect(mac)
@@ -0,0 +1,147 @@
+import logging
+import struct
+
+np = None # Optional: vektorisierte Batch-Dekodierung; erst beim ersten Batch geladen (NumPy-Import ist langsam)
+
+def _numpy():
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            numpy = False
+        np = numpy
+    return np or None
+
+logger = logging.getLogger(__name__)
+
+# struct-Formatzeichen -> NumPy-Typ (ohne Byte-Order)
+_NUMPY_TYPES = {"b": "i1", "B": "u1", "h": "i2", "H": "u2", "i": "i4", "I": "u4",
+                "q": "i8", "Q": "u8", "e": "f2", "f": "f4", "d": "f8"}
+
+
+# Decoder für eine BLE-Charakteristik
+# Das Rohformat wird deklarativ als struct-Layout angegeben und einmalig vorkompiliert. Der Wert ergibt
+# sich als gewichtete Summe der Felder (weights) mal scale plus offset, optional gerundet (digits).
+# divisors teilt einzelne Felder exakt statt mit einem Kehrwert zu multiplizieren (x / 1000.0 ist nicht immer
+# gleich x * 0.001), z.B. Temperatur: "<HH" mit divisors [1, 1000] -> Ganzzahl-Anteil + Tausendstel.
+# pad=True: kürzere Puffer werden rechts mit Nullen aufgefüllt (entspricht int.from_bytes little-endian).
+class CharacteristicDecoder:
+    def __init__(self, uuid, name, field, unit, format="<I", weights=None, scale=1, offset=0, digits=None, pad=False,
+                 divisors=None):
+        self.uuid = str(uuid)
+        self.name = name # Metrikname für MQTT, z.B. co2_ppm
+        self.field = field # Spaltenname im Mess-Dict/CSV, z.B. CO2_ppm
+        self.unit = unit
+        self.layout = struct.Struct(format)
+        field_count = len(self.layout.unpack(bytes(self.layout.size)))
+        self.weights = list(weights) if weights is not None else [1] * field_count
+        self.divisors = list(divisors) if divisors is not None else [1] * field_count
+        self.scale = scale
+        self.offset = offset
+        self.digits = digits
+        self.pad = pad
+        # Reine Ganzzahl ohne Umrechnung bleibt int (wie bisher bei CO2 und Druck)
+        self._integer = (all(isinstance(w, int) for w in self.weights) and all(d == 1 for d in self.divisors)
+                         and isinstance(scale, int)
+                         and isinstance(offset, int) and format.lstrip("<>!=@")[-1:] in "bBhHiIqQ")
+        self._numpy_dtype = False # False = noch nicht ermittelt, None = nicht mit NumPy dekodierbar
+
+    def _get_numpy_dtype(self):
+        if self._numpy_dtype is False:
+            self._numpy_dtype = None
+            format = self.layout.format
+            codes = [c for c in format.lstrip("<>!=@")]
+            if _numpy() is not None and all(c in _NUMPY_TYPES for c in codes):
+                byte_order = "<" if format[:1] in "<=@" else ">"
+                self._numpy_dtype = np.dtype([(f"f{i}", byte_order + _NUMPY_TYPES[c]) for i, c in enumerate(codes)])
+        return self._numpy_dtype
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config["uuid"], config["name"], config["field"], config.get("unit", ""),
+                   format=config.get("format", "<I"), weights=config.get("weights"), scale=config.get("scale", 1),
+                   offset=config.get("offset", 0), digits=config.get("digits"), pad=config.get("pad", False),
+                   divisors=config.get("divisors"))
+
+    def _combine(self, fields):
+        return sum(w * f / d if d != 1 else w * f for w, d, f in zip(self.weights, self.divisors, fields))
+
+    def _finish(self, value):
+        value = value * self.scale + self.offset
+        if self._integer:
+            return int(value)
+        return round(value, self.digits) if self.digits is not None else value
+
+    def _prepare(self, raw):
+        if self.pad and len(raw) < self.layout.size:
+            return bytes(raw) + bytes(self.layout.size - len(raw))
+        return raw
+
+    def decode(self, raw):
+        fields = self.layout.unpack_from(self._prepare(raw))
+        return self._finish(self._combine(fields))
+
+    def decode_batch(self, buffers):
+        # Dekodiert viele Rohpuffer auf einmal. Mit NumPy vektorisiert, sonst über struct.iter_unpack.
+        buffers = [self._prepare(raw)[:self.layout.size] for raw in buffers]
+        if any(len(raw) != self.layout.size for raw in buffers):
+            return [self.decode(raw) for raw in buffers] # Löst für zu kurze Puffer den passenden Fehler aus
+        joined = b"".join(buffers)
+        numpy_dtype = self._get_numpy_dtype()
+        if numpy_dtype is not None and buffers:
+            records = np.frombuffer(joined, dtype=numpy_dtype)
+            columns = [records[f"f{i}"].astype("f8") for i in range(len(self.weights))]
+            values = sum(w * c / d if d != 1 else w * c for w, d, c in zip(self.weights, self.divisors, columns))
+            values = values * self.scale + self.offset
+            if self._integer:
+                return values.astype("i8").tolist()
+            if self.digits is None:
+                return values.tolist()
+            # Pythons round() statt np.round(): dieses skaliert mit 10**digits und rundet z.B. 0.015 auf 0.02
+            return [round(value, self.digits) for value in values.tolist()]
+        return [self._finish(self._combine(fields)) for fields in self.layout.iter_unpack(joined)]
+
+
+# Decoder Registry
+# Alle Charakteristiken eines Sensortyps, adressiert über die UUID.
+class DecoderRegistry:
+    def __init__(self, decoders=()):
+        self._decoders = {}
+        for decoder in decoders:
+            self.register(decoder)
+
+    @classmethod
+    def from_config(cls, characteristics):
+        return cls(CharacteristicDecoder.from_config(config) for config in characteristics)
+
+    def register(self, decoder):
+        self._decoders[decoder.uuid] = decoder
+
+    def uuids(self):
+        return list(self._decoders)
+
+    def __getitem__(self, uuid):
+        return self._decoders[str(uuid)]
+
+    def empty_measurement(self):
+        return {decoder.field: None for decoder in self._decoders.values()}
+
+    def decode(self, readings):
+        # readings: {UUID: Rohdaten}. Gibt (data_list für MQTT, measurement für CSV) zurück.
+        data_list = []
+        measurement = {}
+        for uuid, decoder in self._decoders.items():
+            raw = readings[uuid]
+            value = decoder.decode(raw)
+            logger.debug(f"{decoder.name} raw bytes: {raw.hex()}, Value: {value} {decoder.unit}")
+            data_list.append({"name": decoder.name, "unit": decoder.unit, "value": value})
+            measurement[decoder.field] = value
+        return data_list, measurement
+
+    def decode_many(self, readings_list):
+        # Batch-Pfad für Replay/Backfill: Liste von {UUID: Rohdaten} -> Liste von measurement-Dicts
+        columns = {uuid: decoder.decode_batch([readings[uuid] for readings in readings_list])
+                   for uuid, decoder in self._decoders.items()}
+        return [{decoder.field: columns[uuid][i] for uuid, decoder in self._decoders.items()}
+                for i in range(len(readings_list))]
@@ -0,0 +1,116 @@
+import time
+from collections import deque
+
+
+# Gleitendes Zeitfenster mit inkrementell gepflegten Kennzahlen
+# Summe für den Mittelwert, monotone Deques für Minimum und Maximum: jeder Wert wird genau einmal
+# eingefügt und höchstens einmal entfernt (amortisiert O(1) pro Messung).
+class RollingWindow:
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self._samples = deque() # (t, Wert)
+        self._min = deque() # aufsteigende Werte
+        self._max = deque() # absteigende Werte
+        self._total = 0.0
+        self.last = None
+
+    def add(self, t, value):
+        self._samples.append((t, value))
+        self._total += value
+        while self._min and self._min[-1][1] >= value:
+            self._min.pop()
+        self._min.append((t, value))
+        while self._max and self._max[-1][1] <= value:
+            self._max.pop()
+        self._max.append((t, value))
+        self.last = value
+        self.evict(t)
+
+    def evict(self, now):
+        cutoff = now - self.seconds
+        while self._samples and self._samples[0][0] <= cutoff:
+            self._total -= self._samples.popleft()[1]
+        while self._min and self._min[0][0] <= cutoff:
+            self._min.popleft()
+        while self._max and self._max[0][0] <= cutoff:
+            self._max.popleft()
+        if not self._samples:
+            self._total = 0.0 # Rundungsfehler der laufenden Summe nicht mitschleppen
+
+    def __len__(self):
+        return len(self._samples)
+
+    def stats(self):
+        if not self._samples:
+            return None
+        return {
+            "min": self._min[0][1],
+            "max": self._max[0][1],
+            "mean": round(self._total / len(self._samples), 2),
+            "last": self.last,
+            "n": len(self._samples),
+        }
+
+
+# Edge Stage
+# Sitzt zwischen get_sensor_data() und dem MQTT-Publish:
+# - Deadband: Ein Messwert wird nur gesendet, wenn er sich um mindestens den Schwellwert der Metrik
+#   gegenüber dem zuletzt gesendeten Wert geändert hat oder max_silence Sekunden nichts gesendet wurde.
+#   Metriken ohne Schwellwert werden immer gesendet.
+# - Rolling Aggregates: min/max/mean/last je Metrik über die konfigurierten Fenster; jedes Fenster wird
+#   höchstens einmal pro Fensterlänge ausgegeben.
+class EdgeStage:
+    def __init__(self, deadbands=None, max_silence=300, windows=()):
+        self.deadbands = deadbands or {}
+        self.max_silence = max_silence
+        self.windows = list(windows)
+        self._last_sent = {} # (Sensor, Metrik) -> (Wert, Zeitpunkt)
+        self._rolling = {} # (Sensor, Metrik, Fenster) -> RollingWindow
+        self._last_aggregate = {} # (Sensor, Fenster) -> Zeitpunkt der letzten Ausgabe
+
+    def _passes_deadband(self, sensor_id, name, value, now):
+        threshold = self.deadbands.get(name)
+        if threshold is None:
+            return True
+        last = self._last_sent.get((sensor_id, name))
+        if last is None or abs(value - last[0]) >= threshold or now - last[1] >= self.max_silence:
+            self._last_sent[(sensor_id, name)] = (value, now)
+            return True
+        return False
+
+    def process(self, sensor_id, data_list, now=None):
+        # Gibt (zu sendende Einträge aus data_list, fällige Aggregate [(Metrik, Fenster, Kennzahlen)]) zurück
+        now = time.time() if now is None else now
+        to_publish = []
+        for data_item in data_list:
+            value = data_item["value"]
+            if value is None:
+                continue
+            for window in self.windows:
+                key = (sensor_id, data_item["name"], window)
+                rolling = self._rolling.get(key)
+                if rolling is None:
+                    rolling = self._rolling[key] = RollingWindow(window)
+                rolling.add(now, value)
+            if self._passes_deadband(sensor_id, data_item["name"], value, now):
+                to_publish.append(data_item)
+
+        aggregates = []
+        for window in self.windows:
+            last = self._last_aggregate.get((sensor_id, window))
+            if last is None:
+                # Erstes Fenster erst ausgeben, wenn es einmal voll gelaufen ist
+                self._last_aggregate[(sensor_id, window)] = now
+                continue
+            if now - last < window:
+                continue
+            self._last_aggregate[(sensor_id, window)] = now
+            for data_item in data_list:
+                rolling = self._rolling.get((sensor_id, data_item["name"], window))
+                if rolling is None:
+                    continue
+                rolling.evict(now)
+                stats = rolling.stats()
+                if stats is not None:
+                    aggregates.append((data_item["name"], window, stats))
+        return to_publish, aggregates
@@ -0,0 +1,276 @@
+import argparse
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import paho.mqtt.client as paho
+from log_setup import configure_logging
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Zentraler Ingest-Dienst
+# Abonniert bus/# als Shared Subscription ($share/<Gruppe>/bus/#), sodass sich mehrere Instanzen den Strom
+# aller Gateways teilen, und schreibt die Messwerte gebündelt in eine lokale SQLite-Datenbank.
+# Der MQTT-Thread legt Nachrichten nur in eine begrenzte Queue; ein Writer-Thread zerlegt die Topics und fügt
+# pro Batch in einer Transaktion ein. Ist die Queue voll, blockiert der MQTT-Thread (Rückstau zum Broker).
+# Topics (siehe MqttClientHandler.publish_measurement und process_measurement in main.py):
+#   bus/<Room>/<MAC>/<Metrik>                     Einzelwert als Text
+#   bus/<Room>/<MAC>/reading                      kompaktes JSON {"ts": ..., "<Metrik>": Wert, ...}
+#   bus/<Room>/<MAC>/<Metrik>/agg/<Fenster>s      JSON {"min", "max", "mean", "last", "n"}
+# Aufruf z.B.: python ingest.py --broker 158.180.44.197 --db ingest.db
+
+READING, COMBINED, AGGREGATE = 0, 1, 2
+
+
+# Zerlegt Topics ohne reguläre Ausdrücke. Das Ergebnis wird pro Topic zwischengespeichert, da sich die
+# Topics (Raum, Sensor, Metrik) ständig wiederholen.
+class TopicParser:
+    def __init__(self, prefix="bus", max_cache=100000):
+        self.prefix = prefix
+        self.max_cache = max_cache
+        self._cache = {}
+
+    def parse(self, topic):
+        # Gibt (Art, Raum, Sensor, Metrik, Fenster in Sekunden) oder None für fremde Topics zurück
+        parsed = self._cache.get(topic)
+        if parsed is not None:
+            return parsed
+        parts = topic.split("/")
+        parsed = None
+        if len(parts) >= 4 and parts[0] == self.prefix:
+            room, sensor, metric = parts[1], parts[2], parts[3]
+            if len(parts) == 4:
+                parsed = (COMBINED if metric == "reading" else READING, room, sensor, metric, None)
+            elif len(parts) == 6 and parts[4] == "agg" and parts[5].endswith("s") and parts[5][:-1].isdigit():
+                parsed = (AGGREGATE, room, sensor, metric, int(parts[5][:-1]))
+        if parsed is None:
+            return None
+        if len(self._cache) >= self.max_cache:
+            self._cache.clear()
+        self._cache[topic] = parsed
+        return parsed
+
+
+# Lokaler Zeitreihenspeicher
+# readings ist eine WITHOUT-ROWID-Tabelle mit dem Primärschlüssel (room, sensor, ts, metric): Die Zeilen liegen
+# nach (Raum, Sensor, Zeit) sortiert, Bereichsabfragen lesen zusammenhängende Seiten. Doppelt zugestellte
+# Nachrichten (QoS 1, Outbox-Replay) überschreiben sich selbst.
+class IngestStore:
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS readings ("
+            " room TEXT NOT NULL, sensor TEXT NOT NULL, ts INTEGER NOT NULL, metric TEXT NOT NULL, value REAL,"
+            " PRIMARY KEY (room, sensor, ts, metric)) WITHOUT ROWID"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS aggregates ("
+            " room TEXT NOT NULL, sensor TEXT NOT NULL, ts INTEGER NOT NULL, metric TEXT NOT NULL,"
+            " window INTEGER NOT NULL, min REAL, max REAL, mean REAL, last REAL, n INTEGER,"
+            " PRIMARY KEY (room, sensor, ts, metric, window)) WITHOUT ROWID"
+        )
+        self._lock = threading.Lock()
+
+    def insert(self, readings, aggregates=()):
+        # readings: [(room, sensor, ts, metric, value)], aggregates: [(room, sensor, ts, metric, window, min, max, mean, last, n)]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                if readings:
+                    self._conn.executemany("INSERT OR REPLACE INTO readings VALUES (?, ?, ?, ?, ?)", readings)
+                if aggregates:
+                    self._conn.executemany("INSERT OR REPLACE INTO aggregates VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", aggregates)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def query(self, room, start=0, end=None, sensor=None, metric=None):
+        # Liefert [(sensor, ts, metric, value)] nach Sensor und Zeit sortiert
+        end = 2 ** 62 if end is None else end
+        sql = "SELECT sensor, ts, metric, value FROM readings WHERE room = ?"
+        params = [room]
+        if sensor is not None:
+            sql += " AND sensor = ?"
+            params.append(sensor)
+        sql += " AND ts BETWEEN ? AND ?"
+        params += [start, end]
+        if metric is not None:
+            sql += " AND metric = ?"
+            params.append(metric)
+        with self._lock:
+            return self._conn.execute(sql + " ORDER BY sensor, ts", params).fetchall()
+
+    def count(self, table="readings"):
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class IngestDaemon:
+    def __init__(self, store, broker, port=1883, username=None, password=None, client_id="ingest", group="ingest",
+                 topic_filter="bus/#", batch_size=2000, flush_interval=1.0, max_buffer=50000):
+        self.store = store
+        self.broker = broker
+        self.port = port
+        self.topic = f"$share/{group}/{topic_filter}" if group else topic_filter
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval # Sekunden, spätestens dann wird ein angefangener Batch geschrieben
+        self.parser = TopicParser(prefix=topic_filter.split("/", 1)[0])
+        self.messages = 0
+        self.rows = 0
+        self._buffer = queue.Queue(max_buffer)
+        self._stop_event = threading.Event()
+        self._writer = threading.Thread(target=self._run_writer, name="ingest-writer", daemon=True)
+        self.client = paho.Client(client_id=client_id, protocol=paho.MQTTv5)
+        if username:
+            self.client.username_pw_set(username, password)
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
+        self.client.on_disconnect = self.on_disconnect
+        self.client.reconnect_delay_set(min_delay=1, max_delay=60)
+
+    def on_connect(self, client, userdata, flags, rc, properties=None):
+        if rc == 0:
+            logger.info(f"Connected to MQTT Broker {self.broker}:{self.port}. Subscribing to {self.topic}.")
+            client.subscribe(self.topic, qos=1)
+        else:
+            logger.error(f"Failed to connect to MQTT Broker {self.broker}:{self.port}, return code {rc}")
+
+    def on_disconnect(self, client, userdata, rc, properties=None):
+        if rc != 0:
+            logger.warning(f"Unexpected disconnection from MQTT Broker (rc={rc}). paho reconnects automatically.")
+
+    def on_message(self, client, userdata, message):
+        # Läuft im Netzwerk-Thread von paho: nur puffern, alles Weitere im Writer-Thread
+        timestamp = None
+        properties = getattr(message, "properties", None)
+        for key, value in getattr(properties, "UserProperty", None) or ():
+            if key == "timestamp_utc":
+                timestamp = value
+        self._buffer.put((message.topic, message.payload, timestamp, time.time()))
+
+    def _parse(self, batch):
+        readings = []
+        aggregates = []
+        for topic, payload, timestamp, received_at in batch:
+            parsed = self.parser.parse(topic)
+            if parsed is None:
+                continue
+            kind, room, sensor, metric, window = parsed
+            try:
+                # Der Messzeitpunkt kommt als User Property (auch bei nachgesendeten Nachrichten), sonst gilt der Empfang
+                ts = int(float(timestamp)) if timestamp is not None else int(received_at)
+                if kind == READING:
+                    readings.append((room, sensor, ts, metric, float(payload)))
+                elif kind == COMBINED:
+                    values = json.loads(payload)
+                    ts = int(values.pop("ts", None) or ts)
+                    readings.extend((room, sensor, ts, name, value) for name, value in values.items())
+                else:
+                    stats = json.loads(payload)
+                    aggregates.append((room, sensor, ts, metric, window, stats.get("min"), stats.get("max"),
+                                       stats.get("mean"), stats.get("last"), stats.get("n")))
+            except (ValueError, TypeError, AttributeError) as e:
+                logger.warning(f"Could not parse message on {topic}: {e}", extra={"rate_key": "ingest_parse_error"})
+                metrics.inc("ingest_parse_errors_total")
+        return readings, aggregates
+
+    def _next_batch(self):
+        try:
+            batch = [self._buffer.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._buffer.get_nowait())
+            except queue.Empty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._buffer.get(timeout=remaining))
+                except queue.Empty:
+                    break
+        return batch
+
+    def _run_writer(self):
+        while not (self._stop_event.is_set() and self._buffer.empty()):
+            batch = self._next_batch()
+            if not batch:
+                continue
+            start = time.perf_counter()
+            readings, aggregates = self._parse(batch)
+            try:
+                self.store.insert(readings, aggregates)
+            except sqlite3.Error as e:
+                logger.error(f"Failed to write batch of {len(batch)} messages: {e}", exc_info=True)
+                metrics.inc("ingest_write_errors_total")
+                continue
+            self.messages += len(batch)
+            self.rows += len(readings) + len(aggregates)
+            metrics.observe("ingest_batch_seconds", time.perf_counter() - start)
+            metrics.inc("ingest_messages_total", len(batch))
+            metrics.inc("ingest_rows_total", len(readings) + len(aggregates))
+            logger.debug(f"Wrote {len(readings)} readings and {len(aggregates)} aggregates from {len(batch)} messages.")
+
+    def start(self):
+        self._writer.start()
+        self.client.connect_async(self.broker, self.port, keepalive=60)
+        self.client.loop_start()
+        return self
+
+    def stop(self, timeout=10):
+        # Erst den Empfang beenden, dann den Puffer vollständig schreiben
+        self.client.disconnect()
+        self.client.loop_stop()
+        self._stop_event.set()
+        self._writer.join(timeout)
+        logger.info(f"Ingest stopped after {self.messages} messages ({self.rows} rows).")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Subscribe to bus/# and batch-write all readings into a local SQLite store.")
+    parser.add_argument("--broker", default="158.180.44.197")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--user")
+    parser.add_argument("--password")
+    parser.add_argument("--client-id", default=f"ingest_{os.getpid()}")
+    parser.add_argument("--group", default="ingest", help="Shared subscription group ('' for a normal subscription)")
+    parser.add_argument("--topic", default="bus/#")
+    parser.add_argument("--db", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "ingest.db"))
+    parser.add_argument("--batch-size", type=int, default=2000)
+    parser.add_argument("--flush-interval", type=float, default=1.0)
+    parser.add_argument("--log-file", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "ingest.log"))
+    args = parser.parse_args(argv)
+
+    configure_logging(args.log_file)
+    store = IngestStore(args.db)
+    daemon = IngestDaemon(store, args.broker, port=args.port, username=args.user, password=args.password,
+                          client_id=args.client_id, group=args.group, topic_filter=args.topic,
+                          batch_size=args.batch_size, flush_interval=args.flush_interval).start()
+    try:
+        while True:
+            time.sleep(60)
+            logger.info(f"Ingested {daemon.messages} messages ({daemon.rows} rows) so far.")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.stop()
+        store.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import multiprocessing
+import queue
+import time
+
+# Logging-Pipeline
+# Die Threads der Polling Engine und des MQTT-Clients legen Log-Einträge nur in eine Queue (QueueHandler).
+# Ein Hintergrund-Thread (QueueListener) schreibt sie in eine Datei, die nach Größe und Zeit rotiert wird.
+# Wiederkehrende Meldungen pro Messung werden über einen Schlüssel (extra={"rate_key": ...}) gedrosselt,
+# damit das Log-Volumen bei vielen Sensoren nicht mitwächst.
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+# Rotation ab einer Dateigröße und zusätzlich nach einem festen Zeitraster (z.B. täglich)
+class SizeAndTimeRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    def __init__(self, filename, max_bytes=0, rotate_seconds=0, backup_count=0, encoding="utf-8"):
+        super().__init__(filename, mode="a", maxBytes=max_bytes, backupCount=backup_count, encoding=encoding, delay=True)
+        self.rotate_seconds = rotate_seconds
+        self._next_rotation = self._compute_next_rotation(time.time())
+
+    def _compute_next_rotation(self, now):
+        if not self.rotate_seconds:
+            return None
+        # Am lokalen Zeitraster ausrichten, damit z.B. bei 86400 Sekunden um Mitternacht rotiert wird
+        offset = time.localtime(now).tm_gmtoff
+        return (int((now + offset) // self.rotate_seconds) + 1) * self.rotate_seconds - offset
+
+    def shouldRollover(self, record):
+        if self._next_rotation is not None and record.created >= self._next_rotation:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        if self.backupCount > 0:
+            super().doRollover()
+        else:
+            # Ohne Backups würde RotatingFileHandler nur weiter anhängen; Datei stattdessen neu beginnen
+            if self.stream:
+                self.stream.close()
+                self.stream = None
+            self.mode = "w"
+            self.stream = self._open()
+            self.mode = "a"
+        self._next_rotation = self._compute_next_rotation(time.time())
+
+
+# Kompaktes, maschinenlesbares Format: eine JSON-Zeile pro Eintrag
+class CompactJsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "t": round(record.created, 3),
+            "lvl": record.levelname[0],
+            "log": record.name,
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        return json.dumps(entry, ensure_ascii=False, separators=(",", ":"))
+
+
+# Drosselt Einträge mit gleichem rate_key auf einen pro Intervall. Die Anzahl der unterdrückten Einträge
+# wird an den nächsten durchgelassenen Eintrag angehängt. Warnungen und Fehler werden nie gedrosselt.
+class RateLimitFilter(logging.Filter):
+    def __init__(self, interval=60, max_level=logging.INFO):
+        super().__init__()
+        self.interval = interval
+        self.max_level = max_level
+        self._last_emitted = {} # rate_key -> Zeitpunkt
+        self._suppressed = {} # rate_key -> Anzahl seit dem letzten Eintrag
+
+    def filter(self, record):
+        key = getattr(record, "rate_key", None)
+        if key is None or record.levelno > self.max_level or not self.interval:
+            return True
+        # dict-Operationen sind unter dem GIL atomar; eine gelegentlich doppelt durchgelassene Zeile ist unkritisch
+        last = self._last_emitted.get(key)
+        if last is not None and record.created - last < self.interval:
+            self._suppressed[key] = self._suppressed.get(key, 0) + 1
+            return False
+        self._last_emitted[key] = record.created
+        suppressed = self._suppressed.pop(key, 0)
+        if suppressed:
+            record.suppressed = suppressed
+            record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+        return True
+
+
+# QueueHandler, der den Eintrag nur minimal vorbereitet. Die Formatierung (inkl. Traceback) übernimmt
+# der Listener-Thread, nicht der aufrufende Thread. Ist die Queue voll, wird verworfen statt blockiert.
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+_listener = None
+
+
+def configure_logging(path, level=logging.INFO, max_bytes=5 * 1024 * 1024, rotate_seconds=86400, backup_count=7,
+                      structured=False, rate_limit_interval=60, queue_size=10000):
+    # Ersetzt logging.basicConfig: wie dort passiert nichts, wenn der Root-Logger bereits Handler hat
+    # (z.B. weil benchmark.py das Logging vor dem Import von main konfiguriert).
+    # In Worker-Prozessen (adapter_shards.py) gehen die Einträge über eine Queue an den Hauptprozess.
+    global _listener
+    root = logging.getLogger()
+    if root.handlers or multiprocessing.parent_process() is not None:
+        return None
+    file_handler = SizeAndTimeRotatingFileHandler(path, max_bytes=max_bytes, rotate_seconds=rotate_seconds,
+                                                  backup_count=backup_count)
+    file_handler.setFormatter(CompactJsonFormatter() if structured else logging.Formatter(TEXT_FORMAT))
+    log_queue = queue.Queue(queue_size)
+    queue_handler = _DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter(rate_limit_interval))
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    _listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+    _listener.start()
+    # Beim Beenden die Queue leeren, damit keine Einträge verloren gehen
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
@@ -1,62 +1,203 @@
 import logging
 import time
-import csv
 import os
-import paho.mqtt.client as paho
-from paho import mqtt # Obwohl mqtt.client.ssl.PROTOCOL_TLS nicht direkt verwendet wird, behalte ich den Import für den Fall, dass TLS später benötigt wird.
+import sys
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait as futures_wait, FIRST_COMPLETED, TimeoutError as FuturesTimeoutError
 from bluepy import btle
+from ble_session import BleSessionManager, HandleCache, SessionLimit
+from decoders import DecoderRegistry
+from metrics import metrics, MetricsServer
+from mqtt_outbox import MqttOutbox, OutboxForwarder
+from archive import CsvArchiveWriter
+from tsarchive import BinaryArchiveWriter
+from edge import EdgeStage
+from log_setup import configure_logging
 import traceback # Importiert, aber implizit durch exc_info=True in logging verwendet
 
+# paho sowie die Module der einzelnen Betriebsarten (Scan, Scheduler, Adapter-Shards) werden erst bei Bedarf
+# importiert. Das verkürzt den Start, vor allem im Cron-Modus (--once), in dem die BLE-Lesevorgänge schon
+# laufen, während paho noch geladen wird.
+paho = Properties = PacketTypes = None
+
+def _import_paho():
+    global paho, Properties, PacketTypes
+    if paho is None:
+        import paho.mqtt.client as paho_client
+        from paho.mqtt.properties import Properties as paho_properties
+        from paho.mqtt.packettypes import PacketTypes as paho_packet_types
+        # Für TLS steht danach paho.ssl.PROTOCOL_TLS zur Verfügung (siehe MqttClientHandler)
+        paho, Properties, PacketTypes = paho_client, paho_properties, paho_packet_types
+
 # Configure logging
 # Stelle sicher, dass der Benutzer, der das Skript ausführt, Schreibrechte für diese Datei hat.
 # Für einen Cronjob ist es oft besser, absolute Pfade zu verwenden.
+# Geschrieben wird asynchron über einen Hintergrund-Thread (siehe log_setup.py).
 LOG_FILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sensor_mqtt.log')
-logging.basicConfig(
-    filename=LOG_FILE_PATH,
-    filemode='a',
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO # Ändere dies zu logging.DEBUG, um detailliertere BTLE-Ausgaben zu sehen
-)
+LOG_LEVEL = logging.INFO # Ändere dies zu logging.DEBUG, um detailliertere BTLE-Ausgaben zu sehen
+LOG_MAX_BYTES = 5 * 1024 * 1024 # Rotation ab dieser Dateigröße ...
+LOG_ROTATE_SECONDS = 86400 # ... und zusätzlich täglich um Mitternacht
+LOG_BACKUP_COUNT = 7 # Anzahl aufbewahrter rotierter Dateien (sensor_mqtt.log.1, .2, ...)
+LOG_STRUCTURED = False # True: kompakte JSON-Zeilen statt Textformat
+LOG_RATE_LIMIT_INTERVAL = 60 # Sekunden, wiederkehrende INFO-Meldungen pro Messung höchstens einmal je Intervall
+configure_logging(LOG_FILE_PATH, level=LOG_LEVEL, max_bytes=LOG_MAX_BYTES, rotate_seconds=LOG_ROTATE_SECONDS,
+                  backup_count=LOG_BACKUP_COUNT, structured=LOG_STRUCTURED, rate_limit_interval=LOG_RATE_LIMIT_INTERVAL)
 logger = logging.getLogger(__name__)
 
 # Configuration
 ROOM_NAME = "4C313"
 MEASUREMENT_INTERVAL = 30  # seconds
+MAX_WORKERS = 8  # Maximale Anzahl gleichzeitig gelesener BLE-Sensoren
+SENSOR_TIMEOUT = 20  # seconds, Deadline pro Sensor innerhalb eines Zyklus (muss < MEASUREMENT_INTERVAL sein)
+SENSOR_READ_RETRIES = 3 # Versuche pro Lesevorgang
+SENSOR_RETRY_DELAY = 5 # seconds zwischen zwei Versuchen
+# Zeitplanung: "priority" plant jeden Sensor einzeln (eigenes "Interval"/"Jitter" in SENSORS, Backoff und
+# Circuit Breaker für ausgefallene Sensoren), "grid" liest alle Sensoren gemeinsam im MEASUREMENT_INTERVAL-Raster.
+# Bei mehreren Adaptern (BLE_ADAPTERS) und im Scan-Modus wird immer im Raster gelesen.
+SCHEDULING = "priority"
+SENSOR_JITTER = 2 # seconds, Standard für den zufälligen Versatz pro Messung
+BACKOFF_MAX = 600 # seconds, längste Pause zwischen zwei Versuchen bei einem fehlerhaften Sensor
+BREAKER_THRESHOLD = 5 # Fehlschläge in Folge, nach denen der Circuit Breaker öffnet
+BREAKER_PROBE_INTERVAL = 900 # seconds zwischen zwei Prüfversuchen bei offenem Circuit Breaker
 SENSORS = [
     {
         "BT_TARGET_ADDRESSES": "B8:27:EB:76:18:5E", # Beispiel MAC-Adresse, ersetzen durch echte Sensor-MAC
         "Room": ROOM_NAME,
-        "Sensor_Position": "1.5m"
+        "Sensor_Position": "1.5m",
+        # Optional: "Interval": 60, "Jitter": 5 (seconds), sonst MEASUREMENT_INTERVAL bzw. SENSOR_JITTER
     }
     # Hier können weitere Sensoren hinzugefügt werden
 ]
+# Bluetooth-Adapter (hci-Index). Bei mehr als einem Adapter läuft pro Adapter ein eigener Worker-Prozess und
+# die Sensoren werden automatisch auf die Adapter verteilt (mehr USB-Dongles = mehr parallele Verbindungen).
+BLE_ADAPTERS = [0] # z.B. [0, 1, 2] für hci0, hci1, hci2
+ADAPTER_MAX_CONNECTIONS = 4 # gleichzeitige Verbindungen pro Adapter (die meisten Controller schaffen 4-7)
+# Über Zyklen gehaltene Verbindungen pro Adapter. Darüber hinaus wird die am längsten nicht gelesene getrennt und
+# beim nächsten Mal per gespeicherter Handles neu verbunden (None = alle Verbindungen halten).
+BLE_MAX_SESSIONS = 5
+ADAPTER_FAILOVER_AFTER = 3 # Fehlversuche in Folge, nach denen ein Sensor auf einen anderen Adapter wechselt
+ADAPTER_RETRY_INTERVAL = 300 # Sekunden, die ein ausgefallener Adapter ungenutzt bleibt
+# Erfassungsmodus: "connect" liest jeden Sensor per GATT-Verbindung, "scan" wertet nur die Advertisements aus,
+# die die Sensoren ohnehin senden (keine Verbindung nötig, ein Gateway reicht für Hunderte Sensoren).
+# Für "scan" muss der Sensortyp einen Eintrag "advertisement" haben, der zur Firmware des Sensors passt.
+COLLECTION_MODE = "connect"
+SCAN_IFACE = 0 # hci0
+SCAN_PASSIVE = True
 MQTT_BROKER = '158.180.44.197'
 MQTT_PORT = 1883 # Standard MQTT Port (unverschlüsselt)
 # MQTT_PORT = 8883 # Standard MQTT Port (verschlüsselt)
 MQTT_USER = "bobm"
 MQTT_PASSWORD = "letmein"
 MQTT_CLIENT_ID = f"Sensor_Client_{ROOM_NAME}" # Eindeutigerer Client-ID
+MQTT_MAX_INFLIGHT = 100 # Maximale Anzahl QoS-1-Nachrichten, die gleichzeitig auf ein PUBACK warten
+MQTT_PUBLISH_TIMEOUT = 5 # Sekunden, maximale Wartezeit auf PUBACKs (flush) bzw. auf einen freien Platz beim Nachsenden
+MQTT_COMBINED_PAYLOAD = False # True: ein kompakter JSON-Payload pro Messung auf bus/<Room>/<MAC>/reading
+MQTT_CONNECT_TIMEOUT = 15 # Sekunden, nur für den ersten Verbindungsaufbau beim Start
+
+# Store-and-Forward: Nachrichten, die bei Verbindungsabbruch nicht gesendet werden können, landen hier
+OUTBOX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mqtt_outbox.db')
+OUTBOX_MAX_BYTES = 50 * 1024 * 1024 # Begrenzung des Plattenplatzes, älteste Nachrichten werden zuerst verworfen
+OUTBOX_REPLAY_RATE = 50 # Nachrichten pro Sekunde beim Nachsenden nach einem Reconnect
+ONCE_OUTBOX_DRAIN_TIMEOUT = 30 # Sekunden, die --once höchstens auf das Nachsenden der Outbox wartet
+
+# GATT-Handles der Sensoren werden hier gespeichert, damit neue Prozesse (Cron, --once) ohne Discovery lesen können
+HANDLE_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gatt_handles.json') # None = aus
+HANDLE_CACHE_MAX_AGE = 7 * 86400 # Sekunden, danach wird trotz gültiger Handles neu gesucht
+
+# Instrumentierung: Prometheus-Endpunkt (http://<host>:<port>/metrics) und periodische Health-Nachrichten
+METRICS_HOST = "127.0.0.1" # Nur lokal erreichbar; "0.0.0.0" für Zugriff aus dem Netz
+METRICS_PORT = 9108 # None = Endpunkt aus
+HEALTH_TOPIC = f"gateway/{MQTT_CLIENT_ID}/health"
+HEALTH_INTERVAL = 300 # Sekunden zwischen Health-Nachrichten, None = aus
+
+# Lokales CSV-Archiv
+CSV_BASE_PATH = os.path.join(os.path.expanduser("~"), "infineon_co2_sensor", "server") # z.B. /home/pi/infineon_co2_sensor/server/
+ARCHIVE_FLUSH_ROWS = 20 # Zeilen puffern, bevor flush + fsync erfolgt
+ARCHIVE_FLUSH_INTERVAL = 60 # Sekunden, spätestens dann wird geschrieben
+ARCHIVE_MAX_BYTES = 10 * 1024 * 1024 # Rotation pro Raum täglich und zusätzlich ab dieser Dateigröße
+ARCHIVE_COMPRESS = True # Abgeschlossene Segmente mit gzip komprimieren
+BINARY_ARCHIVE_PATH = os.path.join(CSV_BASE_PATH, "tsb") # Binäres Archiv für schnelle Abfragen (python tsarchive.py --help), None = aus
+
+# Edge-Verarbeitung vor dem MQTT-Publish (lokal werden weiterhin alle Messungen archiviert)
+# Deadband: Mindeständerung pro Metrik, bevor erneut gesendet wird ({} = immer alles senden)
+EDGE_DEADBANDS = {
+    "co2_ppm": 10,
+    "pressure_Pa": 5,
+    "temperature_celsius": 0.1,
+    "humidity_percent": 0.5,
+}
+EDGE_MAX_SILENCE = 300 # Sekunden, danach wird ein Wert auch ohne Änderung gesendet (Heartbeat)
+EDGE_AGGREGATE_WINDOWS = [300, 3600] # Sekunden, min/max/mean/last auf bus/<Room>/<MAC>/<Metrik>/agg/<Fenster>s
+
+# BLE UUIDs (diese müssen exakt zu deinem Sensor passen)
+MEASUREMENTS_SERVICE_UUID = "2a13dada-295d-f7af-064f-28eac027639f"
+CO2_UUID = "4ef31e63-93b4-eca8-3846-84684719c484"
+PRESS_UUID = "0b4f4b0c-0795-1fab-a44d-ab5297a9d33b"
+TEMP_UUID = "7eb330af-8c43-f0ab-8e41-dc2adb4a3ce4"
+HUM_UUID = "421da449-112f-44b6-4743-5c5a7e9c9a1f"
+
+# Sensortypen: Service und Charakteristiken mit Rohformat (struct), Gewichtung und Einheit.
+# Weitere Sensortypen können hier ergänzt und in SENSORS über "Sensor_Type" ausgewählt werden.
+SENSOR_TYPES = {
+    "infineon_co2": {
+        "service_uuid": MEASUREMENTS_SERVICE_UUID,
+        "characteristics": [
+            {"uuid": CO2_UUID, "name": "co2_ppm", "field": "CO2_ppm", "unit": "ppm", "format": "<I", "pad": True},
+            # Einheit korrigiert und Name angepasst
+            {"uuid": PRESS_UUID, "name": "pressure_Pa", "field": "Pressure_Pa", "unit": "Pa", "format": "<I", "pad": True},
+            # Ganzzahl-Anteil (uint16) + Tausendstel (uint16). Dies ist unüblich für Temp/Hum,
+            # überprüfe die Datenblatt-Spezifikation deines Sensors genau.
+            {"uuid": TEMP_UUID, "name": "temperature_celsius", "field": "Temperature_Celsius", "unit": "°C",
+             "format": "<HH", "divisors": [1, 1000], "digits": 2},
+            {"uuid": HUM_UUID, "name": "humidity_percent", "field": "Humidity_Percent", "unit": "%rH",
+             "format": "<HH", "divisors": [1, 1000], "digits": 2},
+        ],
+        # Nur für COLLECTION_MODE = "scan": Layout der Messwerte in den Manufacturer Data des Advertisements.
+        # 0xFFFF ist die Company ID für Tests/Entwicklung; an die tatsächliche Firmware des Sensors anpassen.
+        # position = Byte-Offset nach der Company ID
+        "advertisement": {
+            "source": "manufacturer",
+            "company_id": 0xFFFF,
+            "fields": [
+                {"name": "co2_ppm", "field": "CO2_ppm", "unit": "ppm", "format": "<H", "position": 0},
+                {"name": "pressure_Pa", "field": "Pressure_Pa", "unit": "Pa", "format": "<I", "position": 2},
+                {"name": "temperature_celsius", "field": "Temperature_Celsius", "unit": "°C", "format": "<h",
+                 "scale": 0.01, "digits": 2, "position": 6},
+                {"name": "humidity_percent", "field": "Humidity_Percent", "unit": "%rH", "format": "<H",
+                 "scale": 0.01, "digits": 2, "position": 8},
+            ],
+        },
+    },
+}
+DEFAULT_SENSOR_TYPE = "infineon_co2"
 
 # MQTT Client Handler
 class MqttClientHandler:
-    def __init__(self, client_id, broker, port, username, password):
+    def __init__(self, client_id, broker, port, username, password, max_inflight=MQTT_MAX_INFLIGHT, outbox=None):
         self.broker = broker
         self.port = port
         self.username = username
         self.password = password
+        self.max_inflight = max_inflight
+        self.outbox = outbox # Optionale MqttOutbox für Nachrichten, die nicht gesendet werden können
+        self.forwarder = OutboxForwarder(self, outbox, replay_rate=OUTBOX_REPLAY_RATE) if outbox is not None else None
+        self._loop_started = False
+        _import_paho()
         self.client = paho.Client(client_id=client_id, protocol=paho.MQTTv5)
+        self.client.max_inflight_messages_set(max_inflight)
         
         # TLS-Konfiguration:
         # Wenn dein Broker TLS erfordert (z.B. auf Port 8883), entkommentiere und konfiguriere dies.
         # Für Port 1883 ist TLS unüblich.
         # if self.port == 8883: # Beispielbedingung für TLS
         # try:
-        # self.client.tls_set(tls_version=mqtt.client.ssl.PROTOCOL_TLS)
+        # self.client.tls_set(tls_version=paho.ssl.PROTOCOL_TLS)
         # # Optional: Pfade zu Zertifikaten, wenn benötigt
         # # self.client.tls_set(ca_certs="path/to/ca.crt",
         # # certfile="path/to/client.crt",
         # # keyfile="path/to/client.key",
-        # # tls_version=mqtt.client.ssl.PROTOCOL_TLS)
+        # # tls_version=paho.ssl.PROTOCOL_TLS)
         # logger.info("TLS is configured for MQTT connection.")
         # except ImportError:
         # logger.error("ssl module not found, TLS cannot be configured. Install paho-mqtt[ssl].")
@@ -67,168 +208,348 @@ class MqttClientHandler:
         self.client.username_pw_set(username, password)
         self.client.on_connect = self.on_connect
         self.client.on_disconnect = self.on_disconnect
+        self.client.on_publish = self.on_publish
+        self.client.reconnect_delay_set(min_delay=1, max_delay=60) # paho verbindet im Hintergrund selbst neu
         self._is_connected_flag = False
+        self._connected_event = threading.Event()
+
+        # Pipelining: Nachrichten werden nicht einzeln bestätigt abgewartet, sondern bis zu max_inflight
+        # Nachrichten sind gleichzeitig unterwegs. Die PUBACKs werden asynchron in on_publish eingesammelt.
+        self._inflight_window = threading.BoundedSemaphore(max_inflight)
+        self._publish_lock = threading.Lock() # Serialisiert Alias-Vergabe und client.publish()
+        self._pending_lock = threading.Lock() # Schützt _pending; wird auch im Netzwerk-Thread von paho genommen
+        self._pending_cond = threading.Condition(self._pending_lock)
+        self._pending = {} # mid -> (Topic, Sendezeitpunkt, on_ack, (Payload, timestamp_utc) bzw. None bei Replays)
+        self._early_acks = set() # PUBACKs, die vor der Registrierung der mid eingetroffen sind
+
+        # MQTTv5 Topic Aliases: Der Broker teilt im CONNACK mit, wie viele Aliase er erlaubt (0 = keine)
+        self._topic_alias_maximum = 0
+        self._topic_aliases = {} # Topic -> Alias
+        # _reset_topic_aliases() muss in die Nachrichten-Queue von paho eingreifen (interne Attribute, geprüft mit
+        # paho-mqtt 2.1). Fehlen diese in einer anderen Version, werden keine Aliase verwendet.
+        self._aliases_supported = (hasattr(self.client, "_out_message_mutex") and hasattr(self.client, "_out_messages")
+                                   and hasattr(paho.MQTTMessage(), "_topic"))
+        if not self._aliases_supported:
+            logger.warning("Unsupported paho-mqtt version for topic alias recovery. Topic aliases are disabled.")
 
     def on_connect(self, client, userdata, flags, reasonCode, properties=None):
         # Beachte: Paho MQTT v1.x verwendet 'reasonCode', v2.x verwendet 'reason_code'.
         # Passe dies ggf. an deine Paho-Version an.
         if reasonCode == 0:
             logger.info(f"Successfully connected to MQTT Broker {self.broker}:{self.port}")
+            metrics.inc("mqtt_connects_total")
+            with self._publish_lock:
+                # Aliase gelten nur für eine Netzwerkverbindung
+                self._topic_aliases = {}
+                if properties and self._aliases_supported:
+                    self._topic_alias_maximum = getattr(properties, "TopicAliasMaximum", 0)
+                else:
+                    self._topic_alias_maximum = 0
+            logger.debug(f"Broker allows {self._topic_alias_maximum} topic aliases.")
             self._is_connected_flag = True
+            self._connected_event.set()
+            if self.forwarder is not None:
+                self.forwarder.notify() # Outbox nach dem Reconnect abarbeiten
         else:
             logger.error(f"Failed to connect to MQTT Broker. Reason code: {reasonCode}")
             self._is_connected_flag = False
 
     def on_disconnect(self, client, userdata, reasonCode, properties=None):
         logger.warning(f"Disconnected from MQTT Broker. Reason code: {reasonCode}")
+        metrics.inc("mqtt_disconnects_total")
         self._is_connected_flag = False
+        self._connected_event.clear()
+        self._reset_topic_aliases()
         # Hier könnte eine Logik für automatische Wiederverbindungsversuche implementiert werden,
         # obwohl die Hauptschleife bereits Wiederverbindungsversuche unternimmt.
 
-    def connect(self):
+    def connect_async(self):
+        # Startet Verbindungsaufbau und Netzwerk-Thread, ohne auf das CONNACK zu warten
+        if not self._loop_started:
+            logger.info(f"Attempting to connect to MQTT Broker: {self.broker}:{self.port}")
+            self.client.connect_async(self.broker, self.port, keepalive=120)
+            self.client.loop_start() # Startet einen Thread für Netzwerk-Traffic, Callbacks und automatische Reconnects
+            self._loop_started = True
+            if self.forwarder is not None and not self.forwarder.is_alive():
+                self.forwarder.start()
+
+    def connect(self, timeout=MQTT_CONNECT_TIMEOUT):
         if self._is_connected_flag:
             logger.info("Already connected to MQTT Broker.")
             return True
         try:
-            logger.info(f"Attempting to connect to MQTT Broker: {self.broker}:{self.port}")
-            self.client.connect_async(self.broker, self.port, keepalive=120)
-            self.client.loop_start() # Startet einen Thread für Netzwerk-Traffic und Callbacks
-            
-            timeout = time.time() + 15  # 15 Sekunden Timeout für die Verbindung
-            while not self._is_connected_flag and time.time() < timeout:
-                time.sleep(0.2)
-            
+            self.connect_async()
+            self._connected_event.wait(timeout)
+
             if not self._is_connected_flag:
-                logger.error("Failed to connect to MQTT Broker within timeout period.")
-                self.client.loop_stop() # Stoppe den Loop, wenn die Verbindung fehlschlägt
+                # Der Netzwerk-Thread läuft weiter und versucht die Verbindung selbstständig wieder aufzubauen
+                logger.error("Failed to connect to MQTT Broker within timeout period. Retrying in the background.")
                 return False
             
             logger.info("MQTT connection established and loop started.")
             return True
         except Exception as e:
             logger.error(f"MQTT connection error: {str(e)}", exc_info=True)
-            if self.client.is_connected(): # Sicherstellen, dass der Loop gestoppt wird, falls connect_async teilweise erfolgreich war
-                 self.client.loop_stop(force=True)
             return False
 
-    def publish(self, topic, payload, retain=False):
-        if self._is_connected_flag:
-            try:
-                result = self.client.publish(topic, payload, qos=1, retain=retain) # QoS 1 für "mindestens einmal"
-                result.wait_for_publish(timeout=5) # Warte auf Bestätigung (für QoS > 0)
-                if result.rc == paho.MQTT_ERR_SUCCESS:
-                    logger.info(f"Successfully published to {topic}: {payload}")
-                else:
-                    logger.error(f"Failed to publish to {topic}. MQTT Error Code: {result.rc}")
-            except Exception as e:
-                logger.error(f"Exception during publish to {topic}: {e}", exc_info=True)
+    def on_publish(self, client, userdata, mid):
+        # Wird von paho mit gehaltenem _out_message_mutex aufgerufen: hier nur _pending_lock nehmen
+        with self._pending_cond:
+            entry = self._pending.pop(mid, None)
+            if entry is None:
+                self._early_acks.add(mid)
+                return
+            self._release_pending()
+        topic, sent_at, on_ack, _ = entry
+        ack_seconds = time.monotonic() - sent_at
+        metrics.observe("mqtt_ack_seconds", ack_seconds)
+        logger.debug(f"PUBACK for {topic} after {ack_seconds * 1000:.1f} ms")
+        if on_ack is not None:
+            on_ack()
+
+    def _release_pending(self):
+        # Muss unter _pending_lock laufen
+        self._inflight_window.release()
+        if not self._pending:
+            self._pending_cond.notify_all()
+
+    def _register_pending(self, mid, topic, on_ack=None, stored=None):
+        with self._pending_cond:
+            if mid in self._early_acks:
+                self._early_acks.discard(mid)
+                self._release_pending()
+                early = True
+            else:
+                self._pending[mid] = (topic, time.monotonic(), on_ack, stored)
+                early = False
+        if early and on_ack is not None:
+            on_ack()
+
+    def _topic_alias_for(self, topic):
+        # Gibt (Topic auf der Leitung, Properties, neuer Alias) zurück. Beim ersten Senden wird das volle Topic mit
+        # neuem Alias übertragen, danach nur noch der Alias mit leerem Topic. Ein neuer Alias wird erst nach
+        # erfolgreichem client.publish() eingetragen (siehe publish). Muss unter _publish_lock laufen.
+        if self._topic_alias_maximum <= 0:
+            return topic, None, None
+        properties = Properties(PacketTypes.PUBLISH)
+        alias = self._topic_aliases.get(topic)
+        if alias is not None:
+            properties.TopicAlias = alias
+            return "", properties, None
+        if len(self._topic_aliases) >= self._topic_alias_maximum:
+            return topic, None, None
+        alias = len(self._topic_aliases) + 1
+        properties.TopicAlias = alias
+        return topic, properties, alias
+
+    def _reset_topic_aliases(self):
+        with self._publish_lock:
+            self._topic_aliases = {}
+            self._topic_alias_maximum = 0
+            if not self._aliases_supported:
+                return
+            with self._pending_lock:
+                pending_topics = {mid: entry[0] for mid, entry in self._pending.items()}
+            # Unbestätigte Nachrichten schickt paho nach dem Reconnect erneut. Aliase gelten dann nicht mehr,
+            # deshalb das volle Topic wiederherstellen und den Alias entfernen. Die übrigen Properties (User Property
+            # timestamp_utc) bleiben erhalten.
+            with self.client._out_message_mutex:
+                for message in self.client._out_messages.values():
+                    if message.mid in pending_topics:
+                        message._topic = pending_topics[message.mid].encode("utf-8")
+                        message.properties = self._without_topic_alias(message.properties)
+
+    @staticmethod
+    def _without_topic_alias(properties):
+        user_properties = getattr(properties, "UserProperty", None)
+        if not user_properties:
+            return None
+        stripped = Properties(PacketTypes.PUBLISH)
+        stripped.UserProperty = list(user_properties)
+        return stripped
+
+    def publish(self, topic, payload, retain=False, timestamp_utc=None, on_ack=None, replay=False):
+        # Nicht blockierend: Die Nachricht wird in die Pipeline gestellt, das PUBACK kommt asynchron.
+        # Kann nicht gesendet werden, landet die Nachricht mit timestamp_utc in der Outbox (falls vorhanden).
+        # timestamp_utc wird als User Property mitgesendet, damit Empfänger (ingest.py) den Messzeitpunkt statt
+        # des Empfangszeitpunkts speichern. replay=True: Nachricht kommt aus der Outbox.
+        # Gibt True zurück, wenn die Nachricht an den Client oder die Outbox übergeben wurde.
+        store_on_failure = not replay
+        if not self._is_connected_flag:
+            return self._store(topic, payload, timestamp_utc, store_on_failure, "MQTT not connected")
+        # Live-Nachrichten warten nicht auf ein freies Fenster, sondern gehen direkt in die Outbox; die Rate der
+        # Nachsendung regelt der OutboxForwarder, der hier als einziger wartet
+        if replay:
+            acquired = self._inflight_window.acquire(timeout=MQTT_PUBLISH_TIMEOUT)
         else:
-            logger.warning(f"Cannot publish to {topic}: MQTT not connected.")
+            acquired = self._inflight_window.acquire(blocking=False)
+        if not acquired:
+            return self._store(topic, payload, timestamp_utc, store_on_failure,
+                               f"{self.max_inflight} messages still awaiting PUBACK")
+        publish_start = time.perf_counter()
+        try:
+            with self._publish_lock:
+                wire_topic, properties, new_alias = self._topic_alias_for(topic)
+                if timestamp_utc is not None:
+                    # Messzeitpunkt als User Property, bei nachgesendeten Nachrichten der ursprüngliche
+                    properties = properties or Properties(PacketTypes.PUBLISH)
+                    properties.UserProperty = ("timestamp_utc", str(timestamp_utc))
+                result = self.client.publish(wire_topic, payload, qos=1, retain=retain, properties=properties) # QoS 1 für "mindestens einmal"
+                if result.rc not in (paho.MQTT_ERR_SUCCESS, paho.MQTT_ERR_NO_CONN):
+                    self._inflight_window.release()
+                    metrics.inc("mqtt_publish_failures_total")
+                    logger.error(f"Failed to publish to {topic}. MQTT Error Code: {result.rc}")
+                    return self._store(topic, payload, timestamp_utc, store_on_failure, f"MQTT Error Code {result.rc}")
+                if new_alias is not None and result.rc == paho.MQTT_ERR_SUCCESS:
+                    # Erst jetzt kennt der Broker den Alias; bei einem Fehler wird er beim nächsten Mal neu vergeben
+                    self._topic_aliases[topic] = new_alias
+                # Bei MQTT_ERR_NO_CONN hat paho die QoS-1-Nachricht bereits gespeichert und sendet sie nach dem Reconnect
+                # Live-Nachrichten behalten Payload und Zeitstempel, bis das PUBACK da ist (siehe _store_unacked)
+                self._register_pending(result.mid, topic, on_ack, None if replay else (payload, timestamp_utc))
+            metrics.observe("mqtt_publish_seconds", time.perf_counter() - publish_start)
+            metrics.inc("mqtt_messages_published_total", replay="true" if replay else "false")
+            logger.debug(f"Queued publish to {topic}: {payload}")
+            return True
+        except Exception as e:
+            self._inflight_window.release()
+            logger.error(f"Exception during publish to {topic}: {e}", exc_info=True)
+            return False
+
+    def _store(self, topic, payload, timestamp_utc, store_on_failure, reason):
+        if not store_on_failure or self.outbox is None:
+            logger.warning(f"Cannot publish to {topic}: {reason}.")
+            return False
+        try:
+            self.outbox.put(topic, payload, timestamp_utc)
+            metrics.inc("mqtt_messages_stored_total")
+            logger.debug(f"Stored message for {topic} in outbox: {reason}.")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to store message for {topic} in outbox: {e}", exc_info=True)
+            return False
+
+    def publish_measurement(self, full_measurement_data, data_list, combined=None):
+        combined = MQTT_COMBINED_PAYLOAD if combined is None else combined
+        # Topic-Struktur: bus/ROOM_NAME/SENSOR_MAC/METRIC_NAME
+        topic_prefix = f"bus/{full_measurement_data['Room']}/{full_measurement_data['Sensor_ID_MAC'].replace(':', '')}"
+        if combined:
+            payload = {"ts": full_measurement_data.get("timestamp_utc")}
+            payload.update({item["name"]: item["value"] for item in data_list if item["value"] is not None})
+            return self.publish(f"{topic_prefix}/reading", json.dumps(payload, separators=(",", ":")),
+                                timestamp_utc=full_measurement_data.get("timestamp_utc"))
+
+        published = True
+        for data_item in data_list:
+            if data_item["value"] is not None: # Sende nur, wenn ein Wert vorhanden ist
+                published = self.publish(f"{topic_prefix}/{data_item['name']}", str(data_item["value"]),
+                                         timestamp_utc=full_measurement_data.get("timestamp_utc")) and published
+            else:
+                logger.debug(f"Skipping MQTT publish for {data_item['name']} from {topic_prefix} due to None value.")
+        return published
+
+    def pending_count(self):
+        with self._pending_lock:
+            return len(self._pending)
+
+    def flush(self, timeout=MQTT_PUBLISH_TIMEOUT):
+        # Wartet, bis alle ausstehenden PUBACKs eingetroffen sind
+        with self._pending_cond:
+            if not self._pending_cond.wait_for(lambda: not self._pending, timeout=timeout):
+                logger.warning(f"{len(self._pending)} MQTT messages still unacknowledged after {timeout} seconds.")
+                return False
+        return True
 
     def disconnect(self):
+        if self.forwarder is not None and self.forwarder.is_alive():
+            self.forwarder.stop() # Keine weiteren Nachsendungen aus der Outbox
         if self._is_connected_flag or self.client.is_connected():
              logger.info("Disconnecting from MQTT Broker.")
-             self.client.loop_stop() # Stoppt den Netzwerk-Thread sauber
+             self.flush()
              self.client.disconnect()
              logger.info("MQTT client disconnected.")
+        if self._loop_started:
+            self.client.loop_stop() # Stoppt den Netzwerk-Thread sauber
+            self._loop_started = False
         self._is_connected_flag = False
+        if self.forwarder is not None:
+            # PUBACKs nachgesendeter Nachrichten, die erst während flush() eingetroffen sind
+            self.forwarder.delete_acked()
+        self._store_unacked()
+
+    def _store_unacked(self):
+        # Live-Nachrichten ohne PUBACK gingen mit dem Prozess verloren: in die Outbox für den nächsten Start.
+        # Nachgesendete Nachrichten ohne PUBACK liegen ohnehin noch in der Outbox.
+        with self._pending_cond:
+            unacked = [(entry[0], *entry[3]) for entry in self._pending.values() if entry[3] is not None]
+            for _ in range(len(self._pending)):
+                self._inflight_window.release()
+            self._pending.clear()
+            self._pending_cond.notify_all()
+        if not unacked:
+            return
+        if self.outbox is None:
+            logger.warning(f"Dropping {len(unacked)} unacknowledged MQTT messages (no outbox).")
+            return
+        for topic, payload, timestamp_utc in unacked:
+            self._store(topic, payload, timestamp_utc, True, "no PUBACK before disconnect")
+        logger.warning(f"Stored {len(unacked)} unacknowledged MQTT messages in the outbox.")
 
 
 # Sensor Data Collection
-def get_sensor_data(sensor_mac_address):
-    peripheral = None
-    retries = 3
-    retry_delay = 5 # Sekunden
+# Pro Sensortyp eine Decoder-Registry und ein Session-Manager; Verbindungen und GATT-Handles bleiben über
+# Zyklen hinweg erhalten.
+# Hier könnte eine spezifischere Interface-Auswahl nötig sein, z.B. BleSessionManager(..., iface=0) für hci0
+decoder_registries = {name: DecoderRegistry.from_config(t["characteristics"]) for name, t in SENSOR_TYPES.items()}
+ble_sessions_by_type = {name: BleSessionManager(t["service_uuid"], decoder_registries[name].uuids())
+                        for name, t in SENSOR_TYPES.items()}
+ble_sessions = ble_sessions_by_type[DEFAULT_SENSOR_TYPE]
+SENSOR_TYPE_BY_MAC = {s["BT_TARGET_ADDRESSES"]: s.get("Sensor_Type", DEFAULT_SENSOR_TYPE) for s in SENSORS}
+
+def setup_ble_sessions():
+    # Erst beim Start aus HANDLE_CACHE_PATH und BLE_MAX_SESSIONS erzeugen (nicht beim Import), damit die
+    # Konfiguration bis dahin geändert werden kann; None schaltet Cache bzw. Limit ab
+    handle_cache = HandleCache(HANDLE_CACHE_PATH, max_age=HANDLE_CACHE_MAX_AGE) if HANDLE_CACHE_PATH else None
+    session_limit = SessionLimit(BLE_MAX_SESSIONS) if BLE_MAX_SESSIONS else None # ein Limit für alle Sensortypen
+    for sessions in ble_sessions_by_type.values():
+        sessions.handle_cache = handle_cache
+        sessions.session_limit = session_limit
+    return handle_cache
+
+def get_sensor_data(sensor_mac_address, deadline=None, sessions=None, sensor_type=None, retries=None):
+    # deadline: optionaler Zeitpunkt (time.monotonic()), nach dem keine weiteren Versuche mehr gestartet werden
+    sensor_type = sensor_type or SENSOR_TYPE_BY_MAC.get(sensor_mac_address, DEFAULT_SENSOR_TYPE)
+    registry = decoder_registries[sensor_type]
+    sessions = sessions or ble_sessions_by_type[sensor_type]
+    retries = retries or SENSOR_READ_RETRIES
+    retry_delay = SENSOR_RETRY_DELAY
 
     for attempt in range(retries):
         try:
-            logger.info(f"Attempting to connect to BTLE sensor {sensor_mac_address} (Attempt {attempt + 1}/{retries})")
-            # Hier könnte eine spezifischere Interface-Auswahl nötig sein, z.B. peripheral = btle.Peripheral(sensor_mac_address, "hci0")
-            peripheral = btle.Peripheral(sensor_mac_address)
-            logger.info(f"Connected to BTLE sensor {sensor_mac_address}")
-
-            # BLE UUIDs (diese müssen exakt zu deinem Sensor passen)
-            MEASUREMENTS_SERVICE_UUID = btle.UUID("2a13dada-295d-f7af-064f-28eac027639f")
-            CO2_UUID = btle.UUID("4ef31e63-93b4-eca8-3846-84684719c484")
-            PRESS_UUID = btle.UUID("0b4f4b0c-0795-1fab-a44d-ab5297a9d33b")
-            TEMP_UUID = btle.UUID("7eb330af-8c43-f0ab-8e41-dc2adb4a3ce4")
-            HUM_UUID = btle.UUID("421da449-112f-44b6-4743-5c5a7e9c9a1f")
-
-            service = peripheral.getServiceByUUID(MEASUREMENTS_SERVICE_UUID)
-
-            # Read characteristics
-            co2_char = service.getCharacteristics(CO2_UUID)[0]
-            press_char = service.getCharacteristics(PRESS_UUID)[0]
-            temp_char = service.getCharacteristics(TEMP_UUID)[0]
-            hum_char = service.getCharacteristics(HUM_UUID)[0]
-
-            # CO2
-            co2_reading = co2_char.read()
-            co2_raw = int.from_bytes(co2_reading, byteorder='little', signed=False) # Sicherere Konvertierung
-            logger.debug(f"CO2 raw bytes: {co2_reading.hex()}, Value: {co2_raw} ppm")
-            co2 = {"name": "co2_ppm", "unit": "ppm", "value": co2_raw}
-
-            # Pressure
-            press_reading = press_char.read()
-            press_raw = int.from_bytes(press_reading, byteorder='little', signed=False) # Sicherere Konvertierung
-            logger.debug(f"Pressure raw bytes: {press_reading.hex()}, Value: {press_raw} Pa")
-            # Einheit korrigiert und Name angepasst
-            pressure = {"name": "pressure_Pa", "unit": "Pa", "value": press_raw} 
-
-            # Temperature
-            temp_reading = temp_char.read()
-            # Annahme: Wert ist signed int16, geteilt durch 100 für °C
-            # Beispiel: temp_value_raw = int.from_bytes(temp_reading, byteorder='little', signed=True)
-            # temp_celsius = temp_value_raw / 100.0
-            # Die ursprüngliche Logik für Temperatur und Feuchtigkeit war komplex.
-            # Überprüfe die Datenblatt-Spezifikation deines Sensors genau.
-            # Hier ist die ursprüngliche Logik, ggf. anpassen:
-            temp_raw_high = (temp_reading[1] << 8) + temp_reading[0]
-            temp_raw_low = (temp_reading[3] << 8) + temp_reading[2] # Dies ist unüblich für Temp/Hum
-            temp_raw = temp_raw_high + (temp_raw_low / 1000.0) # Division durch float sicherstellen
-            logger.debug(f"Temperature raw bytes: {temp_reading.hex()}, Value: {temp_raw} °C")
-            temp = {"name": "temperature_celsius", "unit": "°C", "value": round(temp_raw, 2)}
-
-            # Humidity
-            hum_reading = hum_char.read()
-            # Ähnlich wie Temperatur, genaue Byte-Interpretation prüfen.
-            # Hier ist die ursprüngliche Logik, ggf. anpassen:
-            hum_raw_high = (hum_reading[1] << 8) + hum_reading[0]
-            hum_raw_low = (hum_reading[3] << 8) + hum_reading[2] # Dies ist unüblich für Temp/Hum
-            hum_raw = hum_raw_high + (hum_raw_low / 1000.0) # Division durch float sicherstellen
-            logger.debug(f"Humidity raw bytes: {hum_reading.hex()}, Value: {hum_raw} %rH")
-            hum = {"name": "humidity_percent", "unit": "%rH", "value": round(hum_raw, 2)}
-            
-            data_list = [co2, pressure, temp, hum]
-            measurement = {
-                "CO2_ppm": co2_raw,
-                "Pressure_Pa": press_raw,
-                "Temperature_Celsius": round(temp_raw, 2),
-                "Humidity_Percent": round(hum_raw, 2)
-            }
-            return data_list, measurement
+            logger.debug(f"Reading BTLE sensor {sensor_mac_address} (Attempt {attempt + 1}/{retries})")
+            # Liest alle Charakteristiken per gecachtem Handle über die gehaltene Verbindung
+            readings = sessions.read(sensor_mac_address)
+            # data_list enthält einzelne Metriken für MQTT, measurement die Werte für CSV
+            with metrics.timer("decode_seconds", mac=sensor_mac_address):
+                return registry.decode(readings)
 
         except btle.BTLEDisconnectError as e:
             logger.error(f"BTLEDisconnectError for sensor {sensor_mac_address} (Attempt {attempt + 1}): {str(e)}", exc_info=False) # exc_info=False, da es erwartet werden kann
+            if deadline is not None and time.monotonic() + retry_delay >= deadline:
+                logger.error(f"Deadline for sensor {sensor_mac_address} reached after {attempt + 1} attempt(s). Giving up for this cycle.")
+                return [], registry.empty_measurement()
             if attempt < retries - 1:
                 logger.info(f"Retrying in {retry_delay} seconds...")
                 time.sleep(retry_delay)
             else:
                 logger.error(f"Failed to connect to sensor {sensor_mac_address} after {retries} attempts.")
-                return [], {"CO2_ppm": None, "Pressure_Pa": None, "Temperature_Celsius": None, "Humidity_Percent": None}
+                return [], registry.empty_measurement()
         except Exception as e:
             logger.error(f"Failed to read sensor {sensor_mac_address}: {str(e)}", exc_info=True)
-            return [], {"CO2_ppm": None, "Pressure_Pa": None, "Temperature_Celsius": None, "Humidity_Percent": None}
-        finally:
-            if peripheral:
-                try:
-                    peripheral.disconnect()
-                    logger.info(f"Disconnected from BTLE sensor {sensor_mac_address}")
-                except Exception as e_disconnect:
-                    logger.error(f"Error disconnecting from sensor {sensor_mac_address}: {e_disconnect}", exc_info=True)
+            return [], registry.empty_measurement()
 
 # Data Transformation
-def add_meta_information(sensor_config, measurement_data):
+def add_meta_information(sensor_config, measurement_data, timestamp=None):
+    # timestamp: Messzeitpunkt (Unix-Zeit), falls er nicht jetzt ist (z.B. Empfang eines Advertisements)
     # Stellt sicher, dass measurement_data nicht None ist und ein Wörterbuch ist
     if not isinstance(measurement_data, dict):
         logger.error("Invalid measurement_data for meta information: not a dictionary.")
@@ -240,27 +561,42 @@ def add_meta_information(sensor_config, measurement_data):
     transformed_measurement["Room"] = sensor_config.get("Room", "UnknownRoom")
     transformed_measurement["Position"] = sensor_config.get("Sensor_Position", "UnknownPosition")
     transformed_measurement["Sensor_ID_MAC"] = sensor_config.get("BT_TARGET_ADDRESSES", "UnknownMAC")
-    transformed_measurement["timestamp_utc"] = int(time.time()) # Unix-Timestamp (Sekunden seit Epoche)
-    transformed_measurement["datetime_utc"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()) # ISO 8601 Format
+    timestamp = time.time() if timestamp is None else timestamp
+    transformed_measurement["timestamp_utc"] = int(timestamp) # Unix-Timestamp (Sekunden seit Epoche)
+    transformed_measurement["datetime_utc"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(timestamp)) # ISO 8601 Format
 
     return transformed_measurement
 
 # Write to CSV
+# Pro Basispfad ein CsvArchiveWriter, der Dateien offen hält, Zeilen puffert und rotiert
+_archive_writers = {}
+
+def get_archive_writer(base_path):
+    writer = _archive_writers.get(base_path)
+    if writer is None:
+        writer = CsvArchiveWriter(base_path, flush_rows=ARCHIVE_FLUSH_ROWS, flush_interval=ARCHIVE_FLUSH_INTERVAL,
+                                  max_bytes=ARCHIVE_MAX_BYTES, compress=ARCHIVE_COMPRESS)
+        _archive_writers[base_path] = writer
+    return writer
+
+def get_binary_archive_writer(base_path):
+    key = ("binary", base_path)
+    writer = _archive_writers.get(key)
+    if writer is None:
+        writer = BinaryArchiveWriter(base_path, flush_rows=ARCHIVE_FLUSH_ROWS, flush_interval=ARCHIVE_FLUSH_INTERVAL)
+        _archive_writers[key] = writer
+    return writer
+
+def close_archive_writers():
+    for writer in _archive_writers.values():
+        writer.close()
+    _archive_writers.clear()
+
 def write_to_csv(measurement_data, base_path="/home/pi/infineon_co2_sensor/server/"):
     if not measurement_data or not measurement_data.get("Room"):
         logger.error("Cannot write to CSV: measurement data is invalid or Room is missing.")
         return
 
-    # Erstelle den Zielordner, falls er nicht existiert
-    try:
-        # Stelle sicher, dass der Basispfad existiert
-        os.makedirs(base_path, exist_ok=True)
-    except OSError as e:
-        logger.error(f"Error creating directory {base_path}: {e}")
-        return # Beende, wenn das Verzeichnis nicht erstellt werden kann
-
-    csv_file_path = os.path.join(base_path, f"{measurement_data['Room']}.csv")
-    
     # Überprüfe, ob alle Werte None sind (passiert, wenn Sensor nicht gelesen werden konnte)
     # In diesem Fall wollen wir vielleicht keine Zeile schreiben oder eine Zeile mit leeren Werten.
     # Hier entscheiden wir uns, keine Zeile zu schreiben, wenn alle Kernmesswerte None sind.
@@ -271,93 +607,473 @@ def write_to_csv(measurement_data, base_path="/home/pi/infineon_co2_sensor/serve
         measurement_data.get("Humidity_Percent")
     ]
     if all(v is None for v in core_values):
-        logger.info(f"Skipping CSV write for {measurement_data.get('Sensor_ID_MAC')} as all sensor values are None.")
+        logger.info(f"Skipping CSV write for {measurement_data.get('Sensor_ID_MAC')} as all sensor values are None.", extra={"rate_key": "skip_csv"})
         return
 
-    file_exists = os.path.exists(csv_file_path)
-    
     try:
-        with open(csv_file_path, mode='a', newline='', encoding='utf-8') as csvfile:
-            # Definiere die Feldnamen basierend auf den Schlüsseln in measurement_data
-            # Es ist gut, eine konsistente Reihenfolge zu haben.
-            fieldnames = [
-                "datetime_utc", "timestamp_utc", "Room", "Position", "Sensor_ID_MAC",
-                "CO2_ppm", "Temperature_Celsius", "Humidity_Percent", "Pressure_Pa"
-            ]
-            # Stelle sicher, dass alle Schlüssel aus measurement_data in fieldnames sind,
-            # oder füge sie dynamisch hinzu (kann zu inkonsistenten Spalten führen, wenn sich Daten ändern)
-            # Für Konsistenz ist es besser, fieldnames explizit zu definieren.
-            
-            # Filtere measurement_data, um nur die in fieldnames definierten Spalten zu schreiben
-            filtered_measurement_data = {key: measurement_data.get(key) for key in fieldnames}
-
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            if not file_exists:
-                writer.writeheader()
-            writer.writerow(filtered_measurement_data)
-        logger.info(f"Successfully wrote data to {csv_file_path}")
+        writer = get_archive_writer(base_path)
+    except OSError as e:
+        logger.error(f"Error creating directory {base_path}: {e}")
+        return # Beende, wenn das Verzeichnis nicht erstellt werden kann
+
+    try:
+        with metrics.timer("archive_write_seconds", format="csv"):
+            writer.write(measurement_data)
+        logger.debug(f"Buffered CSV row for {measurement_data.get('Sensor_ID_MAC')} in {base_path}")
     except IOError as e:
-        logger.error(f"CSV write error to {csv_file_path}: {str(e)}", exc_info=True)
+        logger.error(f"CSV write error to {base_path}: {str(e)}", exc_info=True)
+    except Exception as e:
+        logger.error(f"An unexpected error occurred during CSV writing to {base_path}: {str(e)}", exc_info=True)
+
+# Write to binary archive
+def write_to_binary_archive(measurement_data, base_path=BINARY_ARCHIVE_PATH):
+    if not base_path or not measurement_data or not measurement_data.get("Room"):
+        return
+    try:
+        with metrics.timer("archive_write_seconds", format="binary"):
+            get_binary_archive_writer(base_path).write(measurement_data)
     except Exception as e:
-        logger.error(f"An unexpected error occurred during CSV writing to {csv_file_path}: {str(e)}", exc_info=True)
+        logger.error(f"Binary archive write error to {base_path}: {str(e)}", exc_info=True)
 
 
+# Verarbeitung eines einzelnen Messergebnisses (CSV + MQTT)
+edge_stage = EdgeStage(EDGE_DEADBANDS, max_silence=EDGE_MAX_SILENCE, windows=EDGE_AGGREGATE_WINDOWS)
+
+def process_measurement(mqtt_handler, sensor_config, data_list_for_mqtt, base_measurement_for_csv, timestamp=None):
+    sensor_mac = sensor_config["BT_TARGET_ADDRESSES"]
+
+    if not base_measurement_for_csv or all(v is None for v in base_measurement_for_csv.values()):
+        logger.warning(f"No valid data received from sensor {sensor_mac}. Skipping MQTT and CSV for this cycle.")
+        return
+
+    # Metadaten hinzufügen (für CSV und ggf. für einen aggregierten MQTT-Payload)
+    full_measurement_data = add_meta_information(sensor_config, base_measurement_for_csv, timestamp=timestamp)
+
+    # Daten in CSV schreiben
+    # Stelle sicher, dass der Pfad für den Cronjob korrekt ist (z.B. /home/pi/...)
+    write_to_csv(full_measurement_data, base_path=CSV_BASE_PATH)
+    write_to_binary_archive(full_measurement_data)
+
+    # Daten an MQTT senden (PUBACKs kommen asynchron). Ist der Broker nicht erreichbar, landen die Daten in der
+    # Outbox und werden nach dem automatischen Reconnect von paho im Hintergrund nachgesendet.
+    if data_list_for_mqtt:
+        # Unveränderte Werte unterdrücken, gleitende Aggregate auf eigenen Topics senden
+        changed_items, aggregates = edge_stage.process(sensor_mac, data_list_for_mqtt, now=full_measurement_data["timestamp_utc"])
+        if changed_items:
+            mqtt_handler.publish_measurement(full_measurement_data, changed_items)
+        else:
+            logger.debug(f"No metric of sensor {sensor_mac} changed beyond its deadband. Nothing to publish.")
+        topic_prefix = f"bus/{full_measurement_data['Room']}/{sensor_mac.replace(':', '')}"
+        for metric_name, window, stats in aggregates:
+            mqtt_handler.publish(f"{topic_prefix}/{metric_name}/agg/{window}s", json.dumps(stats, separators=(",", ":")),
+                                 timestamp_utc=full_measurement_data["timestamp_utc"])
+    else:
+         logger.warning(f"No data in data_list_for_mqtt for sensor {sensor_mac} to publish via MQTT.")
+
+
+# Polling Engine
+# Liest alle Sensoren eines Zyklus parallel in einem begrenzten Thread-Pool (bluepy ist blockierend).
+# Jeder Sensor hat eine eigene Deadline; die Zyklusstarts liegen auf einem festen Raster der Wall-Clock
+# (Vielfache von interval), damit sich die Lesezeit nicht auf die Periode aufaddiert.
+class SensorPollingEngine:
+    def __init__(self, sensors, interval=MEASUREMENT_INTERVAL, max_workers=MAX_WORKERS,
+                 sensor_timeout=SENSOR_TIMEOUT, read_func=None):
+        self.sensors = sensors
+        self.interval = interval
+        self.sensor_timeout = min(sensor_timeout, interval)
+        self.read_func = read_func or get_sensor_data
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ble-worker")
+        self._in_flight = {} # MAC -> Future, verhindert parallele Zugriffe auf denselben Sensor
+
+    def run_cycle(self, handle_result):
+        cycle_start = time.monotonic()
+        deadline = cycle_start + self.sensor_timeout
+        futures = {}
+
+        for sensor_config in self.sensors:
+            sensor_mac = sensor_config["BT_TARGET_ADDRESSES"]
+            pending = self._in_flight.get(sensor_mac)
+            if pending is not None and not pending.done():
+                # Ein hängender bluepy-Aufruf lässt sich nicht abbrechen; Sensor in diesem Zyklus auslassen
+                logger.warning(f"Sensor {sensor_mac} is still busy from a previous cycle. Skipping it this cycle.")
+                metrics.inc("sensor_busy_skips_total", mac=sensor_mac)
+                continue
+            logger.info(f"Processing sensor: {sensor_mac} in Room: {sensor_config['Room']}", extra={"rate_key": "processing_sensor"})
+            future = self.executor.submit(self._timed_read, sensor_mac, deadline)
+            self._in_flight[sensor_mac] = future
+            futures[future] = sensor_config
+
+        try:
+            # Ergebnisse in der Reihenfolge ihres Eintreffens verarbeiten
+            for future in as_completed(futures, timeout=max(0.0, deadline - time.monotonic())):
+                sensor_config = futures[future]
+                try:
+                    data_list_for_mqtt, base_measurement_for_csv = future.result()
+                except Exception as e:
+                    logger.error(f"Unhandled error while reading sensor {sensor_config['BT_TARGET_ADDRESSES']}: {e}", exc_info=True)
+                    continue
+                try:
+                    handle_result(sensor_config, data_list_for_mqtt, base_measurement_for_csv)
+                except Exception as e:
+                    logger.error(f"Error while processing data of sensor {sensor_config['BT_TARGET_ADDRESSES']}: {e}", exc_info=True)
+        except FuturesTimeoutError:
+            for future, sensor_config in futures.items():
+                if not future.done():
+                    logger.warning(f"Sensor {sensor_config['BT_TARGET_ADDRESSES']} missed its deadline of {self.sensor_timeout} seconds.")
+                    metrics.inc("sensor_deadline_misses_total", mac=sensor_config['BT_TARGET_ADDRESSES'])
+
+        cycle_seconds = time.monotonic() - cycle_start
+        metrics.observe("cycle_seconds", cycle_seconds)
+        metrics.set_gauge("cycle_sensors", len(futures))
+        logger.info(f"Cycle finished in {cycle_seconds:.2f} seconds for {len(futures)} sensor(s).")
+
+    def _timed_read(self, sensor_mac, deadline, retries=None):
+        start = time.perf_counter()
+        data_list, measurement = self.read_func(sensor_mac, deadline, retries=retries)
+        metrics.observe("sensor_read_seconds", time.perf_counter() - start, mac=sensor_mac)
+        if not data_list:
+            metrics.inc("sensor_read_failures_total", mac=sensor_mac)
+        return data_list, measurement
+
+    def next_cycle_start(self, now=None):
+        # Nächster Rasterpunkt auf der Wall-Clock; verpasste Slots werden übersprungen statt nachgeholt
+        now = time.time() if now is None else now
+        return (int(now // self.interval) + 1) * self.interval
+
+    def run_forever(self, handle_result, on_cycle_end=None, max_cycles=None):
+        # max_cycles: optionale Begrenzung der Zyklenzahl (z.B. für Benchmarks)
+        cycles = 0
+        while True:
+            self.run_cycle(handle_result)
+            if on_cycle_end is not None:
+                on_cycle_end()
+            cycles += 1
+            if max_cycles is not None and cycles >= max_cycles:
+                return
+            next_start = self.next_cycle_start()
+            wait_time = next_start - time.time()
+            logger.info(f"All sensors processed. Waiting {wait_time:.2f} seconds until next cycle.")
+            time.sleep(max(0.0, wait_time))
+
+    def shutdown(self):
+        # Nicht auf hängende BLE-Aufrufe warten
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Scheduled Polling Engine
+# Statt gemeinsamer Zyklen liest diese Engine jeden Sensor, sobald er laut SensorScheduler fällig ist, mit
+# höchstens max_workers gleichzeitigen Lesevorgängen. on_cycle_end() (Flush, Health) läuft weiterhin alle
+# interval Sekunden; max_cycles zählt diese Takte. Jeder Sensor bildet hier seinen eigenen Zyklus: cycle_seconds
+# misst die Zeit von seiner Fälligkeit bis zur verarbeiteten Messung (inkl. Wartezeit auf einen freien Worker).
+class ScheduledPollingEngine(SensorPollingEngine):
+    def __init__(self, sensors, interval=MEASUREMENT_INTERVAL, max_workers=MAX_WORKERS, sensor_timeout=SENSOR_TIMEOUT,
+                 read_func=None, jitter=SENSOR_JITTER, backoff_max=BACKOFF_MAX, breaker_threshold=BREAKER_THRESHOLD,
+                 probe_interval=BREAKER_PROBE_INTERVAL):
+        super().__init__(sensors, interval=interval, max_workers=max_workers, sensor_timeout=sensor_timeout, read_func=read_func)
+        self.max_workers = max_workers
+        from scheduler import SensorScheduler
+        self.scheduler = SensorScheduler(sensors, default_interval=interval, default_jitter=jitter, backoff_max=backoff_max,
+                                         breaker_threshold=breaker_threshold, probe_interval=probe_interval)
+        self._configs = {s["BT_TARGET_ADDRESSES"]: s for s in sensors}
+        self._running = {} # Future -> (MAC, Deadline, Fälligkeit)
+
+    def _submit_due(self):
+        for sensor_mac in self.scheduler.pop_due(limit=self.max_workers - len(self._running)):
+            # Die Deadline gilt ab dem Start des Lesevorgangs, nicht ab einem Zyklusbeginn
+            deadline = time.monotonic() + self.sensor_timeout
+            retries = self.scheduler.attempts(sensor_mac, SENSOR_READ_RETRIES)
+            if self.scheduler.is_open(sensor_mac):
+                logger.info(f"Probing sensor {sensor_mac} (circuit breaker open).")
+            else:
+                logger.info(f"Processing sensor: {sensor_mac} in Room: {self._configs[sensor_mac]['Room']}",
+                            extra={"rate_key": "processing_sensor"})
+            future = self.executor.submit(self._timed_read, sensor_mac, deadline, retries)
+            self._running[future] = (sensor_mac, deadline, self.scheduler.ready_since(sensor_mac))
+
+    def _collect_done(self, handle_result):
+        for future in [f for f in self._running if f.done()]:
+            sensor_mac, deadline, ready_at = self._running.pop(future)
+            try:
+                data_list_for_mqtt, base_measurement_for_csv = future.result()
+            except Exception as e:
+                logger.error(f"Unhandled error while reading sensor {sensor_mac}: {e}", exc_info=True)
+                self.scheduler.record(sensor_mac, False)
+                self._record_cycle(sensor_mac, time.monotonic() - ready_at)
+                continue
+            if time.monotonic() > deadline:
+                logger.warning(f"Sensor {sensor_mac} missed its deadline of {self.sensor_timeout} seconds.")
+                metrics.inc("sensor_deadline_misses_total", mac=sensor_mac)
+            self.scheduler.record(sensor_mac, bool(data_list_for_mqtt))
+            try:
+                handle_result(self._configs[sensor_mac], data_list_for_mqtt, base_measurement_for_csv)
+            except Exception as e:
+                logger.error(f"Error while processing data of sensor {sensor_mac}: {e}", exc_info=True)
+            self._record_cycle(sensor_mac, time.monotonic() - ready_at)
+
+    def _record_cycle(self, sensor_mac, cycle_seconds):
+        metrics.observe("cycle_seconds", cycle_seconds)
+
+    def run_forever(self, handle_result, on_cycle_end=None, max_cycles=None):
+        ticks = 0
+        next_tick = time.monotonic() + self.interval
+        while True:
+            self._collect_done(handle_result)
+            self._submit_due()
+            now = time.monotonic()
+            if now >= next_tick:
+                metrics.set_gauge("cycle_sensors", len(self._running))
+                if on_cycle_end is not None:
+                    on_cycle_end()
+                ticks += 1
+                if max_cycles is not None and ticks >= max_cycles:
+                    return
+                next_tick += self.interval * ((now - next_tick) // self.interval + 1)
+            # Schlafen bis zum nächsten fälligen Sensor, Takt oder abgeschlossenen Lesevorgang
+            wake = next_tick
+            next_due = self.scheduler.next_due()
+            if next_due is not None and len(self._running) < self.max_workers:
+                wake = min(wake, next_due)
+            timeout = max(0.0, wake - time.monotonic())
+            if self._running:
+                futures_wait(self._running, timeout=timeout, return_when=FIRST_COMPLETED)
+            else:
+                time.sleep(timeout)
+
+
+# Sharded Polling Engine
+# Wie die Polling Engine, aber die Sensoren werden über ShardPlacement auf mehrere Adapter verteilt und in
+# je einem Worker-Prozess pro Adapter gelesen (siehe adapter_shards.py). Archivierung und MQTT bleiben im
+# Hauptprozess. Hinweis: BLE-Metriken (ble_*) der Worker-Prozesse erscheinen nicht im Metrics-Endpunkt.
+class ShardedPollingEngine(SensorPollingEngine):
+    def __init__(self, sensors, adapters=BLE_ADAPTERS, interval=MEASUREMENT_INTERVAL, sensor_timeout=SENSOR_TIMEOUT,
+                 max_connections=ADAPTER_MAX_CONNECTIONS, failover_after=ADAPTER_FAILOVER_AFTER,
+                 retry_interval=ADAPTER_RETRY_INTERVAL, handle_cache_path=None, handle_cache_max_age=HANDLE_CACHE_MAX_AGE,
+                 max_sessions=BLE_MAX_SESSIONS, worker_init=None):
+        self.sensors = sensors
+        self.interval = interval
+        self.sensor_timeout = min(sensor_timeout, interval)
+        from adapter_shards import AdapterWorker, ShardPlacement, start_log_forwarding, new_result_queue
+        self.placement = ShardPlacement(adapters, failover_after=failover_after, retry_interval=retry_interval)
+        self._log_queue, self._log_listener = start_log_forwarding()
+        self._results = new_result_queue()
+        self.workers = {iface: AdapterWorker(iface, self._results, self._log_queue, max_connections=max_connections,
+                                             handle_cache_path=handle_cache_path, handle_cache_max_age=handle_cache_max_age,
+                                             max_sessions=max_sessions, worker_init=worker_init).start()
+                        for iface in adapters}
+        self._dead = set() # Adapter, deren Worker-Prozess beendet ist und auf einen Neustart wartet
+        self._placed = {} # MAC -> Adapter im letzten Zyklus
+        self._in_flight = {} # MAC -> Adapter, Ergebnis steht noch aus
+        self._cycle_id = 0
+
+    def _check_workers(self):
+        healthy = self.placement.healthy_adapters()
+        for iface, worker in self.workers.items():
+            if worker.is_alive():
+                continue
+            if iface not in self._dead:
+                self._dead.add(iface)
+                self.placement.mark_down(iface, "worker process exited")
+                self._in_flight = {mac: a for mac, a in self._in_flight.items() if a != iface}
+            elif iface in healthy:
+                logger.info(f"Restarting adapter worker for hci{iface}.")
+                worker.stop()
+                worker.start()
+                self._dead.discard(iface)
+
+    def run_cycle(self, handle_result):
+        cycle_start = time.monotonic()
+        deadline = cycle_start + self.sensor_timeout
+        self._cycle_id += 1
+        self._check_workers()
+
+        configs = {s["BT_TARGET_ADDRESSES"]: s for s in self.sensors}
+        placement = self.placement.place(list(configs))
+        if not placement:
+            logger.error("No healthy Bluetooth adapter available. Skipping this cycle.")
+            return
+        for mac, iface in placement.items():
+            previous = self._placed.get(mac)
+            if previous is not None and previous != iface and self.workers[previous].is_alive():
+                # Gehaltene Verbindung auf dem alten Adapter lösen, sonst ist der Sensor für den neuen blockiert
+                self.workers[previous].release(mac, SENSOR_TYPE_BY_MAC.get(mac, DEFAULT_SENSOR_TYPE))
+        self._placed = placement
+
+        expected = set()
+        for mac, iface in placement.items():
+            if mac in self._in_flight:
+                logger.warning(f"Sensor {mac} is still busy from a previous cycle. Skipping it this cycle.")
+                metrics.inc("sensor_busy_skips_total", mac=mac)
+                continue
+            self.workers[iface].submit(self._cycle_id, mac, SENSOR_TYPE_BY_MAC.get(mac, DEFAULT_SENSOR_TYPE), deadline)
+            self._in_flight[mac] = iface
+            expected.add(mac)
+
+        from adapter_shards import drain
+        outcomes = {} # Adapter -> [Erfolge, Fehlschläge] in diesem Zyklus
+        while expected:
+            result = drain(self._results, deadline - time.monotonic())
+            if result is None:
+                break
+            iface, cycle_id, mac, data_list_for_mqtt, base_measurement_for_csv, seconds = result
+            self._in_flight.pop(mac, None)
+            ok = bool(data_list_for_mqtt)
+            self.placement.record(mac, iface, ok, seconds)
+            metrics.observe("sensor_read_seconds", seconds, mac=mac)
+            if not ok:
+                metrics.inc("sensor_read_failures_total", mac=mac)
+            if cycle_id != self._cycle_id:
+                logger.debug(f"Dropping late result of sensor {mac} from cycle {cycle_id}.")
+                continue
+            outcomes.setdefault(iface, [0, 0])[0 if ok else 1] += 1
+            expected.discard(mac)
+            try:
+                handle_result(configs[mac], data_list_for_mqtt, base_measurement_for_csv)
+            except Exception as e:
+                logger.error(f"Error while processing data of sensor {mac}: {e}", exc_info=True)
+        for mac in expected:
+            logger.warning(f"Sensor {mac} missed its deadline of {self.sensor_timeout} seconds on hci{placement[mac]}.")
+            metrics.inc("sensor_deadline_misses_total", mac=mac)
+
+        # Ein Adapter, auf dem alles scheitert, während andere lesen können, gilt als ausgefallen
+        if any(successes for successes, _ in outcomes.values()):
+            for iface, (successes, failures) in outcomes.items():
+                if not successes and failures >= 2:
+                    self.placement.mark_down(iface, f"all {failures} reads failed")
+
+        cycle_seconds = time.monotonic() - cycle_start
+        metrics.observe("cycle_seconds", cycle_seconds)
+        metrics.set_gauge("cycle_sensors", len(placement))
+        for iface in self.workers:
+            metrics.set_gauge("adapter_sensors", sum(1 for a in placement.values() if a == iface), adapter=f"hci{iface}")
+        logger.info(f"Cycle finished in {cycle_seconds:.2f} seconds for {len(placement)} sensor(s) on "
+                    f"{len(set(placement.values()))} adapter(s).")
+
+    def shutdown(self):
+        for worker in self.workers.values():
+            worker.stop()
+        self._log_listener.stop()
+
+
+# Scan Engine
+# Alternative zur Polling Engine für COLLECTION_MODE = "scan": Ein Hintergrund-Thread sammelt Advertisements,
+# am Rasterpunkt jedes Zyklus wird die neueste Messung jedes Sensors durch dieselbe Pipeline geschickt.
+class SensorScanEngine(SensorPollingEngine):
+    def __init__(self, sensors, interval=MEASUREMENT_INTERVAL, iface=SCAN_IFACE, passive=SCAN_PASSIVE):
+        self.sensors = sensors
+        self.interval = interval
+        self._config_by_mac = {s["BT_TARGET_ADDRESSES"].lower(): s for s in sensors}
+        from ble_scan import AdvertisementDecoder, AdvertisementCollector, AdvertisementScanner
+        decoders = {}
+        for sensor_config in sensors:
+            sensor_type = SENSOR_TYPES[sensor_config.get("Sensor_Type", DEFAULT_SENSOR_TYPE)]
+            if "advertisement" not in sensor_type:
+                logger.error(f"Sensor type of {sensor_config['BT_TARGET_ADDRESSES']} has no advertisement layout. Ignoring it in scan mode.")
+                continue
+            decoders[sensor_config["BT_TARGET_ADDRESSES"]] = AdvertisementDecoder.from_config(sensor_type["advertisement"])
+        self.collector = AdvertisementCollector(decoders)
+        self.scanner = AdvertisementScanner(self.collector, iface=iface, passive=passive)
+        self.scanner.start()
+        self._scan_started = time.time()
+
+    def run_cycle(self, handle_result):
+        cycle_start = time.monotonic()
+        readings = self.collector.drain()
+        for mac, (data_list_for_mqtt, base_measurement_for_csv, rssi, received_at) in readings.items():
+            sensor_config = self._config_by_mac[mac]
+            metrics.set_gauge("ble_rssi_dbm", rssi, mac=sensor_config["BT_TARGET_ADDRESSES"])
+            try:
+                # Messzeitpunkt ist der Empfang des Advertisements, nicht das Ende des Zyklus
+                handle_result(sensor_config, data_list_for_mqtt, base_measurement_for_csv, timestamp=received_at)
+            except Exception as e:
+                logger.error(f"Error while processing data of sensor {sensor_config['BT_TARGET_ADDRESSES']}: {e}", exc_info=True)
+        silent = len(self.collector.decoders_by_mac) - len(readings)
+        if silent:
+            logger.info(f"No advertisement from {silent} sensor(s) during the last cycle.")
+        cycle_seconds = time.monotonic() - cycle_start
+        metrics.observe("cycle_seconds", cycle_seconds)
+        metrics.set_gauge("cycle_sensors", len(readings))
+        logger.info(f"Cycle finished in {cycle_seconds:.2f} seconds for {len(readings)} sensor(s) seen via advertisements.")
+
+    def run_forever(self, handle_result, on_cycle_end=None, max_cycles=None):
+        # Direkt nach dem Start wurde noch nichts empfangen: erst ein Intervall lang sammeln, sonst ist der erste
+        # Zyklus immer leer
+        wait_time = self._scan_started + self.interval - time.time()
+        logger.info(f"Collecting advertisements for {wait_time:.2f} seconds before the first cycle.")
+        time.sleep(max(0.0, wait_time))
+        super().run_forever(handle_result, on_cycle_end=on_cycle_end, max_cycles=max_cycles)
+
+    def shutdown(self):
+        self.scanner.stop()
+
+
+# Health-Nachrichten und Gauges am Ende jedes Zyklus
+class HealthReporter:
+    def __init__(self, mqtt_handler, topic=HEALTH_TOPIC, interval=HEALTH_INTERVAL):
+        self.mqtt_handler = mqtt_handler
+        self.topic = topic
+        self.interval = interval
+        self._last_report = time.monotonic()
+
+    def on_cycle_end(self):
+        metrics.set_gauge("mqtt_inflight_messages", self.mqtt_handler.pending_count())
+        metrics.set_gauge("mqtt_connected", 1 if self.mqtt_handler._is_connected_flag else 0)
+        if self.mqtt_handler.outbox is not None:
+            metrics.set_gauge("mqtt_outbox_messages", len(self.mqtt_handler.outbox))
+        if self.interval and time.monotonic() - self._last_report >= self.interval:
+            self._last_report = time.monotonic()
+            # Health-Nachrichten werden bei Verbindungsabbruch nicht in der Outbox gespeichert
+            if self.mqtt_handler._is_connected_flag:
+                self.mqtt_handler.publish(self.topic, metrics.health_json())
+
+
+# Auswahl der Engine nach COLLECTION_MODE, BLE_ADAPTERS und SCHEDULING (run_once liest immer im Raster)
+def create_engine(scheduling=None):
+    scheduling = scheduling or SCHEDULING
+    if COLLECTION_MODE == "scan":
+        return SensorScanEngine(SENSORS, interval=MEASUREMENT_INTERVAL, iface=SCAN_IFACE, passive=SCAN_PASSIVE)
+    if len(BLE_ADAPTERS) > 1:
+        return ShardedPollingEngine(SENSORS, adapters=BLE_ADAPTERS, interval=MEASUREMENT_INTERVAL, sensor_timeout=SENSOR_TIMEOUT,
+                                    max_connections=ADAPTER_MAX_CONNECTIONS, failover_after=ADAPTER_FAILOVER_AFTER,
+                                    retry_interval=ADAPTER_RETRY_INTERVAL, handle_cache_path=HANDLE_CACHE_PATH,
+                                    handle_cache_max_age=HANDLE_CACHE_MAX_AGE, max_sessions=BLE_MAX_SESSIONS)
+    if scheduling == "priority":
+        return ScheduledPollingEngine(SENSORS, interval=MEASUREMENT_INTERVAL, max_workers=MAX_WORKERS, sensor_timeout=SENSOR_TIMEOUT,
+                                      jitter=SENSOR_JITTER, backoff_max=BACKOFF_MAX, breaker_threshold=BREAKER_THRESHOLD,
+                                      probe_interval=BREAKER_PROBE_INTERVAL)
+    return SensorPollingEngine(SENSORS, interval=MEASUREMENT_INTERVAL, max_workers=MAX_WORKERS, sensor_timeout=SENSOR_TIMEOUT)
+
 # Main Loop
-def main():
+def main(max_cycles=None):
     logger.info("Starting sensor data collection script.")
-    mqtt_handler = MqttClientHandler(MQTT_CLIENT_ID, MQTT_BROKER, MQTT_PORT, MQTT_USER, MQTT_PASSWORD)
+    setup_ble_sessions()
+    outbox = MqttOutbox(OUTBOX_PATH, max_bytes=OUTBOX_MAX_BYTES)
+    mqtt_handler = MqttClientHandler(MQTT_CLIENT_ID, MQTT_BROKER, MQTT_PORT, MQTT_USER, MQTT_PASSWORD,
+                                     max_inflight=MQTT_MAX_INFLIGHT, outbox=outbox)
+    engine = create_engine()
+    health_reporter = HealthReporter(mqtt_handler, topic=HEALTH_TOPIC, interval=HEALTH_INTERVAL)
+    metrics_server = None
+    if METRICS_PORT:
+        try:
+            metrics_server = MetricsServer(metrics, host=METRICS_HOST, port=METRICS_PORT).start()
+        except OSError as e:
+            logger.error(f"Could not start metrics endpoint on {METRICS_HOST}:{METRICS_PORT}: {e}")
+
+    def on_cycle_end():
+        for writer in _archive_writers.values():
+            writer.flush_if_due()
+        health_reporter.on_cycle_end()
     
     # Erster Verbindungsversuch beim Start
     if not mqtt_handler.connect():
-        logger.warning("Initial MQTT connection failed. Will retry in the loop.")
+        logger.warning("Initial MQTT connection failed. Readings are stored in the outbox until the broker is reachable.")
 
     try:
-        while True:
-            for sensor_config in SENSORS:
-                sensor_mac = sensor_config["BT_TARGET_ADDRESSES"]
-                logger.info(f"Processing sensor: {sensor_mac} in Room: {sensor_config['Room']}")
-                
-                # Daten vom Sensor abrufen
-                # data_list enthält einzelne Metriken für MQTT, base_measurement enthält Rohdaten für CSV
-                data_list_for_mqtt, base_measurement_for_csv = get_sensor_data(sensor_mac)
-
-                if not base_measurement_for_csv or all(v is None for v in base_measurement_for_csv.values()):
-                    logger.warning(f"No valid data received from sensor {sensor_mac}. Skipping MQTT and CSV for this cycle.")
-                    # Optional: Wartezeit erhöhen oder spezifische Fehlerbehandlung
-                    time.sleep(5) # Kurze Pause, bevor der nächste Sensor oder Zyklus beginnt
-                    continue
-
-                # Metadaten hinzufügen (für CSV und ggf. für einen aggregierten MQTT-Payload)
-                full_measurement_data = add_meta_information(sensor_config, base_measurement_for_csv)
-
-                # Daten in CSV schreiben
-                # Stelle sicher, dass der Pfad für den Cronjob korrekt ist (z.B. /home/pi/...)
-                # Der Pfad wird jetzt in write_to_csv selbst gehandhabt
-                csv_base_path = os.path.join(os.path.expanduser("~"), "infineon_co2_sensor", "server") # z.B. /home/pi/infineon_co2_sensor/server/
-                write_to_csv(full_measurement_data, base_path=csv_base_path)
-
-                # Überprüfe MQTT-Verbindung und verbinde ggf. neu
-                if not mqtt_handler._is_connected_flag: # Zugriff auf internes Flag für schnelle Prüfung
-                    logger.info("MQTT disconnected. Attempting to reconnect...")
-                    mqtt_handler.connect() # connect() hat bereits Logik für "already connected"
-
-                # Daten an MQTT senden, wenn verbunden und Daten vorhanden sind
-                if mqtt_handler._is_connected_flag and data_list_for_mqtt:
-                    for data_item in data_list_for_mqtt:
-                        if data_item["value"] is not None: # Sende nur, wenn ein Wert vorhanden ist
-                            # Topic-Struktur: bus/ROOM_NAME/SENSOR_MAC/METRIC_NAME
-                            topic = f"bus/{full_measurement_data['Room']}/{sensor_mac.replace(':', '')}/{data_item['name']}"
-                            payload = str(data_item["value"])
-                            mqtt_handler.publish(topic, payload)
-                        else:
-                            logger.debug(f"Skipping MQTT publish for {data_item['name']} from sensor {sensor_mac} due to None value.")
-                elif not data_list_for_mqtt:
-                     logger.warning(f"No data in data_list_for_mqtt for sensor {sensor_mac} to publish via MQTT.")
-                else: # Nicht verbunden
-                    logger.warning(f"Cannot send data for sensor {sensor_mac} via MQTT: Not connected.")
-            
-            logger.info(f"All sensors processed. Waiting for {MEASUREMENT_INTERVAL} seconds before next cycle.")
-            time.sleep(MEASUREMENT_INTERVAL)
+        engine.run_forever(
+            lambda sensor_config, data_list, measurement, timestamp=None: process_measurement(
+                mqtt_handler, sensor_config, data_list, measurement, timestamp=timestamp),
+            on_cycle_end=on_cycle_end,
+            max_cycles=max_cycles,
+        )
 
     except KeyboardInterrupt:
         logger.info("Script terminated by user (KeyboardInterrupt).")
@@ -365,15 +1081,89 @@ def main():
         logger.error(f"Unhandled script error in main loop: {str(e)}", exc_info=True)
     finally:
         logger.info("Shutting down script.")
+        engine.shutdown()
+        for sessions in ble_sessions_by_type.values():
+            sessions.close_all()
         if 'mqtt_handler' in locals() and mqtt_handler:
             mqtt_handler.disconnect()
+        outbox.close()
+        close_archive_writers()
+        if metrics_server is not None:
+            metrics_server.stop()
         logger.info("Script shutdown complete.")
 
+# Cron-Modus: genau eine Messung aller Sensoren, danach beenden
+# Gelesen wird mit derselben Engine wie im Dauerbetrieb (COLLECTION_MODE, BLE_ADAPTERS), aber nur ein Zyklus;
+# im Scan-Modus wird gelauscht, bis jeder Sensor gesendet hat (höchstens SENSOR_TIMEOUT Sekunden).
+# Die BLE-Lesevorgänge starten sofort in einem eigenen Thread; währenddessen werden paho geladen und die
+# MQTT-Verbindung aufgebaut. Veröffentlicht wird, sobald beides fertig ist. Danach wird die Outbox aus früheren
+# Läufen nachgesendet (höchstens ONCE_OUTBOX_DRAIN_TIMEOUT Sekunden) und auf die PUBACKs gewartet; was bis
+# MQTT_PUBLISH_TIMEOUT nicht bestätigt ist, landet in der Outbox für den nächsten Lauf.
+# Rückgabewert: 0, wenn alle Sensoren gelesen wurden, sonst 1.
+def run_once():
+    global edge_stage
+    start = time.monotonic()
+    logger.info("Starting one-shot measurement.")
+    setup_ble_sessions()
+    results = []
+
+    def read_all():
+        engine = None
+        try:
+            engine = create_engine(scheduling="grid")
+            if COLLECTION_MODE == "scan":
+                deadline = start + SENSOR_TIMEOUT
+                while engine.collector.pending() < len(engine.collector.decoders_by_mac) and time.monotonic() < deadline:
+                    time.sleep(0.1)
+            # Messzeitpunkt beim Eintreffen des Ergebnisses festhalten, nicht erst nach dem MQTT-Verbindungsaufbau
+            engine.run_cycle(lambda sensor_config, data_list, measurement, timestamp=None: results.append(
+                (sensor_config, data_list, measurement, time.time() if timestamp is None else timestamp)))
+        except Exception as e:
+            logger.error(f"Unhandled error while reading sensors: {e}", exc_info=True)
+        finally:
+            if engine is not None:
+                engine.shutdown()
+
+    reader = threading.Thread(target=read_all, name="once-reader")
+    reader.start()
+
+    # Deadband und Aggregate brauchen Verlauf, der zwischen zwei Läufen nicht erhalten bleibt: alles senden
+    edge_stage = EdgeStage()
+    outbox = MqttOutbox(OUTBOX_PATH, max_bytes=OUTBOX_MAX_BYTES)
+    mqtt_handler = MqttClientHandler(MQTT_CLIENT_ID, MQTT_BROKER, MQTT_PORT, MQTT_USER, MQTT_PASSWORD,
+                                     max_inflight=MQTT_MAX_INFLIGHT, outbox=outbox)
+    mqtt_handler.connect_async()
+    reader.join()
+    read_seconds = time.monotonic() - start
+
+    # Die Verbindung wurde parallel zu den Lesevorgängen aufgebaut; ohne Verbindung landet alles in der Outbox
+    if not mqtt_handler.connect(timeout=max(0.0, start + MQTT_CONNECT_TIMEOUT - time.monotonic())):
+        logger.warning("MQTT broker not reachable. Readings are kept in the outbox for the next run.")
+    succeeded = 0
+    for sensor_config, data_list_for_mqtt, base_measurement_for_csv, timestamp in results:
+        try:
+            process_measurement(mqtt_handler, sensor_config, data_list_for_mqtt, base_measurement_for_csv, timestamp=timestamp)
+            succeeded += 1 if data_list_for_mqtt else 0
+        except Exception as e:
+            logger.error(f"Error while processing data of sensor {sensor_config['BT_TARGET_ADDRESSES']}: {e}", exc_info=True)
+
+    for sessions in ble_sessions_by_type.values():
+        sessions.close_all()
+    if mqtt_handler._is_connected_flag and len(outbox):
+        if not mqtt_handler.forwarder.drain(ONCE_OUTBOX_DRAIN_TIMEOUT):
+            logger.info(f"{len(outbox)} queued MQTT messages remain in the outbox for the next run.")
+    mqtt_handler.disconnect() # wartet auf ausstehende PUBACKs
+    outbox.close()
+    close_archive_writers()
+    logger.info(f"One-shot measurement finished: {succeeded}/{len(SENSORS)} sensor(s) read in {read_seconds:.2f} seconds, "
+                f"{time.monotonic() - start:.2f} seconds in total.")
+    return 0 if succeeded == len(SENSORS) else 1
+
 if __name__ == "__main__":
     # Wichtig für Cronjobs: Stelle sicher, dass das Skript mit dem richtigen Python-Interpreter
     # und im richtigen Arbeitsverzeichnis ausgeführt wird, oder verwende absolute Pfade für alles.
-    # Beispiel für Cronjob-Eintrag:
-    # */5 * * * * /usr/bin/python3 /pfad/zum/skript/dein_skript.py >> /pfad/zum/skript/cron.log 2>&1
+    # Beispiel für Cronjob-Eintrag (--once: eine Messung, danach beenden):
+    # */5 * * * * /usr/bin/python3 /pfad/zum/skript/dein_skript.py --once >> /pfad/zum/skript/cron.log 2>&1
     #
     # Für bluepy unter Linux ohne root:
     # 1. sudo apt-get install libglib2.0-dev
@@ -381,4 +1171,6 @@ if __name__ == "__main__":
     #    (oder spezifischer für den Python-Interpreter, den du verwendest)
     # Dies muss nach jedem Python-Update wiederholt werden.
     # Alternativ: Udev-Regeln für den BT-Adapter.
+    if "--once" in sys.argv[1:]:
+        sys.exit(run_once())
     main()
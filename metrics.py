@@ -0,0 +1,199 @@
+import bisect
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Instrumentierung des Hot Paths
+# Latenz-Histogramme und Zähler pro Stufe (BLE-Verbindung, Discovery, Lesen, Dekodieren, Archiv, MQTT),
+# mit Labels wie der Sensor-MAC. Ausgabe im Prometheus-Textformat über einen lokalen HTTP-Endpunkt
+# und optional als periodische MQTT-Health-Nachricht.
+
+METRIC_PREFIX = "co2_gateway_"
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(label_key, extra=()):
+    items = list(label_key) + list(extra)
+    if not items:
+        return ""
+    escaped = (f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in items)
+    return "{" + ",".join(escaped) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # letzter Eintrag = +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, fraction):
+        # Näherung über die Bucket-Obergrenzen (wie histogram_quantile ohne Interpolation)
+        if not self.count:
+            return None
+        target = fraction * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return float("inf")
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {} # Name -> {Label-Key: Histogram}
+        self._counters = {} # Name -> {Label-Key: Wert}
+        self._gauges = {} # Name -> {Label-Key: Wert}
+        self._help = {}
+        self.started_at = time.time()
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def observe(self, name, seconds, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(seconds)
+
+    def inc(self, name, value=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self._gauges.setdefault(name, {})[_label_key(labels)] = value
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def render_prometheus(self):
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                full = METRIC_PREFIX + name
+                if name in self._help:
+                    lines.append(f"# HELP {full} {self._help[name]}")
+                lines.append(f"# TYPE {full} counter")
+                for key, value in sorted(series.items()):
+                    lines.append(f"{full}{_format_labels(key)} {value}")
+            for name, series in sorted(self._gauges.items()):
+                full = METRIC_PREFIX + name
+                if name in self._help:
+                    lines.append(f"# HELP {full} {self._help[name]}")
+                lines.append(f"# TYPE {full} gauge")
+                for key, value in sorted(series.items()):
+                    lines.append(f"{full}{_format_labels(key)} {value}")
+            for name, series in sorted(self._histograms.items()):
+                full = METRIC_PREFIX + name
+                if name in self._help:
+                    lines.append(f"# HELP {full} {self._help[name]}")
+                lines.append(f"# TYPE {full} histogram")
+                for key, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f"{full}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+                    lines.append(f"{full}_bucket{_format_labels(key, [('le', '+Inf')])} {histogram.count}")
+                    lines.append(f"{full}_sum{_format_labels(key)} {histogram.sum}")
+                    lines.append(f"{full}_count{_format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def health_summary(self):
+        # Kompakte Zusammenfassung für MQTT: Zähler und p50/p95 je Histogramm (über alle Labels)
+        with self._lock:
+            summary = {"uptime_s": int(time.time() - self.started_at), "counters": {}, "latency_ms": {}}
+            for name, series in self._counters.items():
+                summary["counters"][name] = sum(series.values())
+            for name, series in self._gauges.items():
+                summary["counters"][name] = sum(series.values())
+            for name, series in self._histograms.items():
+                merged = Histogram()
+                for histogram in series.values():
+                    merged.counts = [a + b for a, b in zip(merged.counts, histogram.counts)]
+                    merged.count += histogram.count
+                    merged.sum += histogram.sum
+                p50, p95 = merged.quantile(0.5), merged.quantile(0.95)
+                summary["latency_ms"][name] = {
+                    "count": merged.count,
+                    "mean": round(merged.sum / merged.count * 1000, 1) if merged.count else None,
+                    "p50": p50 * 1000 if p50 not in (None, float("inf")) else None,
+                    "p95": p95 * 1000 if p95 not in (None, float("inf")) else None,
+                }
+            # Langsamste Sensoren nach mittlerer Lesezeit
+            reads = self._histograms.get("sensor_read_seconds", {})
+            slowest = sorted(((h.sum / h.count, dict(k).get("mac")) for k, h in reads.items() if h.count), reverse=True)[:5]
+            summary["slowest_sensors"] = [{"mac": mac, "mean_ms": round(mean * 1000, 1)} for mean, mac in slowest]
+        return summary
+
+    def health_json(self):
+        return json.dumps(self.health_summary(), separators=(",", ":"))
+
+
+# Gemeinsame Registry für den ganzen Prozess (analog zu logging.getLogger)
+metrics = MetricsRegistry()
+
+
+def _make_request_handler():
+    # http.server zieht http.client, email und ssl nach sich; erst laden, wenn der Endpunkt gestartet wird
+    from http.server import BaseHTTPRequestHandler
+
+    class _MetricsRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = self.server.registry.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(f"Metrics request from {self.client_address[0]}: {format % args}")
+
+    return _MetricsRequestHandler
+
+
+class MetricsServer:
+    def __init__(self, registry=metrics, host="127.0.0.1", port=9108):
+        from http.server import ThreadingHTTPServer
+        self._server = ThreadingHTTPServer((host, port), _make_request_handler())
+        self._server.daemon_threads = True
+        self._server.registry = registry
+        self.host, self.port = self._server.server_address[:2]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        logger.info(f"Metrics endpoint listening on http://{self.host}:{self.port}/metrics")
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,169 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+# Store-and-Forward Queue
+# Append-only Warteschlange in SQLite (WAL-Modus) für Nachrichten, die nicht direkt an den Broker gehen
+# konnten. Der Platz auf der Platte ist begrenzt; bei Überlauf werden die ältesten Nachrichten verworfen.
+class MqttOutbox:
+    def __init__(self, path, max_bytes=50 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL") # Im WAL-Modus trotzdem absturzsicher, aber weniger fsyncs
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " topic TEXT NOT NULL,"
+            " payload BLOB NOT NULL,"
+            " timestamp_utc NUMERIC NOT NULL,"
+            " size INTEGER NOT NULL)"
+        )
+        self._bytes, self._count = self._conn.execute("SELECT COALESCE(SUM(size), 0), COUNT(*) FROM outbox").fetchone()
+        if self._count:
+            logger.info(f"MQTT outbox {path} contains {self._count} queued messages ({self._bytes} bytes).")
+
+    def __len__(self):
+        return self._count
+
+    def put(self, topic, payload, timestamp_utc=None):
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        timestamp_utc = time.time() if timestamp_utc is None else timestamp_utc
+        size = len(topic) + len(payload)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO outbox (topic, payload, timestamp_utc, size) VALUES (?, ?, ?, ?)",
+                (topic, payload, timestamp_utc, size),
+            )
+            self._bytes += size
+            self._count += 1
+            if self._bytes > self.max_bytes:
+                self._evict_oldest()
+
+    def _evict_oldest(self):
+        # Muss unter _lock laufen. Verwirft die ältesten Nachrichten, bis das Limit wieder eingehalten ist.
+        excess = self._bytes - self.max_bytes
+        freed = evicted = 0
+        last_id = None
+        for row_id, size in self._conn.execute("SELECT id, size FROM outbox ORDER BY id"):
+            freed += size
+            evicted += 1
+            last_id = row_id
+            if freed >= excess:
+                break
+        if last_id is None:
+            return
+        self._conn.execute("DELETE FROM outbox WHERE id <= ?", (last_id,))
+        self._bytes -= freed
+        self._count -= evicted
+        logger.warning(f"MQTT outbox full ({self.max_bytes} bytes). Dropped {evicted} oldest messages.")
+
+    def fetch(self, after_id=0, limit=100):
+        # Älteste Nachrichten zuerst: [(id, topic, payload, timestamp_utc), ...]
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, topic, payload, timestamp_utc FROM outbox WHERE id > ? ORDER BY id LIMIT ?",
+                (after_id, limit),
+            ).fetchall()
+
+    def delete(self, ids):
+        ids = list(ids)
+        with self._lock:
+            for start in range(0, len(ids), 500): # SQLite-Limit für Parameter pro Statement beachten
+                chunk = ids[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                size, count = self._conn.execute(
+                    f"SELECT COALESCE(SUM(size), 0), COUNT(*) FROM outbox WHERE id IN ({placeholders})", chunk
+                ).fetchone()
+                self._conn.execute(f"DELETE FROM outbox WHERE id IN ({placeholders})", chunk)
+                self._bytes -= size
+                self._count -= count
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# Hintergrund-Thread, der die Outbox nach einem Reconnect mit begrenzter Rate abarbeitet.
+# Eine Nachricht wird erst gelöscht, wenn ihr PUBACK eingetroffen ist (at-least-once).
+class OutboxForwarder(threading.Thread):
+    def __init__(self, mqtt_handler, outbox, replay_rate=50, batch_size=100):
+        super().__init__(name="mqtt-outbox", daemon=True)
+        self.mqtt_handler = mqtt_handler
+        self.outbox = outbox
+        self.replay_rate = replay_rate # Nachrichten pro Sekunde
+        self.batch_size = batch_size
+        self._acked = deque() # IDs mit eingetroffenem PUBACK; wird im Netzwerk-Thread von paho befüllt
+        self._last_sent_id = 0 # IDs > _last_sent_id wurden in diesem Prozess noch nicht gesendet
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+
+    def notify(self):
+        self._wakeup.set()
+
+    def stop(self, timeout=5):
+        self._stop_event.set()
+        self._wakeup.set()
+        self.join(timeout)
+        self.delete_acked()
+
+    def drain(self, timeout):
+        # Für kurzlebige Prozesse (--once): wartet, bis die Outbox nachgesendet und bestätigt ist.
+        # Gibt True zurück, wenn die Outbox leer ist.
+        deadline = time.monotonic() + timeout
+        self.notify()
+        while True:
+            self.delete_acked()
+            if not len(self.outbox):
+                return True
+            if not self.mqtt_handler._is_connected_flag or time.monotonic() >= deadline:
+                return False
+            if not self.outbox.fetch(self._last_sent_id, 1) and not self.mqtt_handler.pending_count():
+                return False # Alles gesendet, der Rest blieb ohne PUBACK
+            time.sleep(0.05)
+
+    def delete_acked(self):
+        # Auch nach stop() aufrufen, wenn danach noch PUBACKs eintreffen können (siehe MqttClientHandler.disconnect)
+        ids = []
+        while self._acked:
+            ids.append(self._acked.popleft())
+        self.outbox.delete(ids)
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.delete_acked()
+            if not self.mqtt_handler._is_connected_flag:
+                self._wakeup.wait(1)
+                self._wakeup.clear()
+                continue
+            rows = self.outbox.fetch(self._last_sent_id, self.batch_size)
+            if not rows:
+                self._wakeup.wait(1)
+                self._wakeup.clear()
+                continue
+            logger.info(f"Replaying {len(rows)} queued MQTT messages ({len(self.outbox)} in outbox).")
+            next_send = time.monotonic()
+            for row_id, topic, payload, timestamp_utc in rows:
+                if self._stop_event.is_set() or not self.mqtt_handler._is_connected_flag:
+                    break
+                delay = next_send - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                next_send = max(next_send, time.monotonic() - 1) + 1.0 / self.replay_rate
+                sent = self.mqtt_handler.publish(
+                    topic, payload, timestamp_utc=timestamp_utc,
+                    on_ack=lambda row_id=row_id: self._acked.append(row_id), replay=True,
+                )
+                if not sent:
+                    break
+                self._last_sent_id = row_id
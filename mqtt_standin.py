@@ -0,0 +1,360 @@
+import heapq
+import itertools
+import logging
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Lokaler MQTT-Broker-Ersatz für Benchmarks und Tests ohne den echten Broker
+# Unterstützt MQTT 3.1.1 und 5.0 soweit von diesem Projekt benötigt: CONNECT, PUBLISH (QoS 0/1, Topic
+# Aliases), SUBSCRIBE inkl. Wildcards und Shared Subscriptions ($share/<Gruppe>/<Filter>), PINGREQ und
+# DISCONNECT. Keine Persistenz, kein Retain, keine Authentifizierung. An Abonnenten wird mit QoS 0 verteilt.
+
+CONNECT, CONNACK, PUBLISH, PUBACK, SUBSCRIBE, SUBACK, PINGREQ, PINGRESP, DISCONNECT = 1, 2, 3, 4, 8, 9, 12, 13, 14
+
+# MQTTv5 Property-IDs -> Kodierung (für PUBLISH-Properties)
+_PROPERTY_TYPES = {
+    0x01: "byte", 0x02: "int4", 0x03: "str", 0x08: "str", 0x09: "bin", 0x0B: "varint",
+    0x23: "int2", 0x26: "pair",
+}
+PROPERTY_TOPIC_ALIAS_MAXIMUM = 0x22
+PROPERTY_TOPIC_ALIAS = 0x23
+PROPERTY_USER = 0x26
+
+
+def encode_varint(value):
+    out = bytearray()
+    while True:
+        byte, value = value % 128, value // 128
+        out.append(byte | (0x80 if value else 0))
+        if not value:
+            return bytes(out)
+
+def decode_varint(data, pos):
+    value, shift = 0, 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value += (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+def _read_str(data, pos):
+    length = struct.unpack_from("!H", data, pos)[0]
+    return data[pos + 2:pos + 2 + length], pos + 2 + length
+
+def parse_properties(data, pos):
+    # Gibt ({ID: Wert oder Liste bei User Properties}, neue Position) zurück
+    length, pos = decode_varint(data, pos)
+    end = pos + length
+    properties = {}
+    while pos < end:
+        prop_id, pos = decode_varint(data, pos)
+        kind = _PROPERTY_TYPES.get(prop_id)
+        if kind == "byte":
+            value, pos = data[pos], pos + 1
+        elif kind == "int2":
+            value, pos = struct.unpack_from("!H", data, pos)[0], pos + 2
+        elif kind == "int4":
+            value, pos = struct.unpack_from("!I", data, pos)[0], pos + 4
+        elif kind == "varint":
+            value, pos = decode_varint(data, pos)
+        elif kind in ("str", "bin"):
+            value, pos = _read_str(data, pos)
+        elif kind == "pair":
+            key, pos = _read_str(data, pos)
+            value, pos = _read_str(data, pos)
+            properties.setdefault(prop_id, []).append((key.decode(), value.decode()))
+            continue
+        else:
+            # Unbekannte Property: Rest des Blocks überspringen
+            pos = end
+            break
+        properties[prop_id] = value
+    return properties, end
+
+def encode_properties(properties, skip=()):
+    # Gegenstück zu parse_properties; IDs in skip werden nicht kodiert (z.B. verbindungsbezogene Topic Aliases)
+    out = bytearray()
+    for prop_id, value in properties.items():
+        kind = _PROPERTY_TYPES.get(prop_id)
+        if kind is None or prop_id in skip:
+            continue
+        if kind == "pair":
+            for key, pair_value in value:
+                key, pair_value = key.encode(), pair_value.encode()
+                out += encode_varint(prop_id) + struct.pack("!H", len(key)) + key + struct.pack("!H", len(pair_value)) + pair_value
+            continue
+        out += encode_varint(prop_id)
+        if kind == "byte":
+            out.append(value)
+        elif kind == "int2":
+            out += struct.pack("!H", value)
+        elif kind == "int4":
+            out += struct.pack("!I", value)
+        elif kind == "varint":
+            out += encode_varint(value)
+        else:
+            out += struct.pack("!H", len(value)) + value
+    return encode_varint(len(out)) + bytes(out)
+
+def topic_matches(topic_filter, topic):
+    filter_parts = topic_filter.split("/")
+    topic_parts = topic.split("/")
+    for i, part in enumerate(filter_parts):
+        if part == "#":
+            return True
+        if i >= len(topic_parts) or (part != "+" and part != topic_parts[i]):
+            return False
+    return len(filter_parts) == len(topic_parts)
+
+
+class StandinMessage:
+    __slots__ = ("topic", "payload", "qos", "properties", "received_at", "client_id")
+
+    def __init__(self, topic, payload, qos, properties, client_id):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.properties = properties
+        self.received_at = time.monotonic()
+        self.client_id = client_id
+
+
+class _ClientHandler(socketserver.BaseRequestHandler):
+    def setup(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.protocol = 4
+        self.client_id = ""
+        self.aliases = {}
+        self.send_lock = threading.Lock()
+        self.buffer = b""
+
+    def send(self, data):
+        with self.send_lock:
+            self.request.sendall(data)
+
+    def _recv_packet(self):
+        # Liest ein vollständiges MQTT-Paket: (Typ, Flags, Inhalt) oder None bei Verbindungsende
+        while True:
+            if len(self.buffer) >= 2:
+                try:
+                    length, pos = decode_varint(self.buffer, 1)
+                except IndexError:
+                    length = None
+                if length is not None and len(self.buffer) >= pos + length:
+                    header = self.buffer[0]
+                    body = self.buffer[pos:pos + length]
+                    self.buffer = self.buffer[pos + length:]
+                    return header >> 4, header & 0x0F, body
+            chunk = self.request.recv(65536)
+            if not chunk:
+                return None
+            self.buffer += chunk
+
+    def handle(self):
+        broker = self.server.broker
+        try:
+            while True:
+                packet = self._recv_packet()
+                if packet is None:
+                    break
+                packet_type, flags, body = packet
+                broker.bytes_received += len(body) + 2
+                if packet_type == CONNECT:
+                    self._handle_connect(body)
+                elif packet_type == PUBLISH:
+                    self._handle_publish(flags, body)
+                elif packet_type == SUBSCRIBE:
+                    self._handle_subscribe(body)
+                elif packet_type == PINGREQ:
+                    self.send(bytes([PINGRESP << 4, 0]))
+                elif packet_type == DISCONNECT:
+                    break
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            broker._remove_client(self)
+
+    def _handle_connect(self, body):
+        _, pos = _read_str(body, 0) # Protokollname
+        self.protocol = body[pos]
+        connect_flags = body[pos + 1]
+        pos += 4 # Level, Flags, Keepalive
+        if self.protocol == 5:
+            _, pos = parse_properties(body, pos)
+        client_id, pos = _read_str(body, pos)
+        self.client_id = client_id.decode()
+        if connect_flags & 0x04: # Will-Nachricht wird ignoriert
+            if self.protocol == 5:
+                _, pos = parse_properties(body, pos)
+            _, pos = _read_str(body, pos)
+            _, pos = _read_str(body, pos)
+        broker = self.server.broker
+        broker.connections += 1
+        if self.protocol == 5:
+            properties = b""
+            if broker.topic_alias_maximum:
+                properties = bytes([PROPERTY_TOPIC_ALIAS_MAXIMUM]) + struct.pack("!H", broker.topic_alias_maximum) # 0x22
+            variable = bytes([0, 0]) + encode_varint(len(properties)) + properties
+        else:
+            variable = bytes([0, 0])
+        self.send(bytes([CONNACK << 4]) + encode_varint(len(variable)) + variable)
+
+    def _handle_publish(self, flags, body):
+        broker = self.server.broker
+        qos = (flags >> 1) & 0x03
+        topic, pos = _read_str(body, 0)
+        topic = topic.decode()
+        packet_id = None
+        if qos:
+            packet_id = struct.unpack_from("!H", body, pos)[0]
+            pos += 2
+        properties = {}
+        if self.protocol == 5:
+            properties, pos = parse_properties(body, pos)
+            alias = properties.get(PROPERTY_TOPIC_ALIAS)
+            if alias is not None:
+                if topic:
+                    self.aliases[alias] = topic
+                else:
+                    topic = self.aliases.get(alias, "")
+        if not topic:
+            logger.error(f"Client {self.client_id} used unknown topic alias. Closing connection.")
+            raise ConnectionError("unknown topic alias")
+        message = StandinMessage(topic, bytes(body[pos:]), qos, properties, self.client_id)
+        if qos == 1:
+            puback = bytes([PUBACK << 4, 2]) + struct.pack("!H", packet_id)
+            if broker.ack_delay:
+                # Verzögert senden, ohne das Lesen weiterer Pakete aufzuhalten (wie eine echte Netzwerklatenz)
+                broker._delayed_sender.schedule(broker.ack_delay, self.send, puback)
+            else:
+                self.send(puback)
+        broker._dispatch(message)
+
+    def _handle_subscribe(self, body):
+        packet_id = struct.unpack_from("!H", body, 0)[0]
+        pos = 2
+        if self.protocol == 5:
+            _, pos = parse_properties(body, pos)
+        granted = bytearray()
+        while pos < len(body):
+            topic_filter, pos = _read_str(body, pos)
+            pos += 1 # Subscription Options
+            self.server.broker._subscribe(self, topic_filter.decode())
+            granted.append(0)
+        variable = struct.pack("!H", packet_id) + (b"\0" if self.protocol == 5 else b"") + bytes(granted)
+        self.send(bytes([SUBACK << 4]) + encode_varint(len(variable)) + variable)
+
+    def deliver(self, message):
+        topic = message.topic.encode()
+        # Properties des Absenders (z.B. User Properties) weitergeben; Topic Alias und Subscription Identifier
+        # gelten nur für die Verbindung des Absenders
+        properties = encode_properties(message.properties, skip=(PROPERTY_TOPIC_ALIAS, 0x0B)) if self.protocol == 5 else b""
+        variable = struct.pack("!H", len(topic)) + topic + properties
+        data = variable + message.payload
+        self.send(bytes([PUBLISH << 4]) + encode_varint(len(data)) + data)
+
+
+# Ein Thread, der Pakete nach einer festen Verzögerung versendet
+class _DelayedSender(threading.Thread):
+    def __init__(self):
+        super().__init__(name="mqtt-standin-delay", daemon=True)
+        self._queue = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+
+    def schedule(self, delay, send, data):
+        with self._cond:
+            heapq.heappush(self._queue, (time.monotonic() + delay, next(self._counter), send, data))
+            self._cond.notify()
+
+    def run(self):
+        while True:
+            with self._cond:
+                while not self._queue or self._queue[0][0] > time.monotonic():
+                    self._cond.wait(self._queue[0][0] - time.monotonic() if self._queue else None)
+                _, _, send, data = heapq.heappop(self._queue)
+            try:
+                send(data)
+            except OSError:
+                pass
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class MqttStandinBroker:
+    def __init__(self, host="127.0.0.1", port=0, topic_alias_maximum=64, ack_delay=0.0):
+        self.topic_alias_maximum = topic_alias_maximum
+        self.ack_delay = ack_delay # Sekunden, simuliert die Round-Trip-Zeit zum echten Broker
+        self.on_message = None # Optionaler Callback(StandinMessage), z.B. für Benchmarks
+        self.messages_received = 0
+        self.bytes_received = 0
+        self.connections = 0
+        self._subscriptions = [] # (Filter, Gruppe oder None, Handler)
+        self._share_counters = {}
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), _ClientHandler)
+        self._server.broker = self
+        self.host, self.port = self._server.server_address
+        self._thread = None
+        self._delayed_sender = _DelayedSender()
+
+    def start(self):
+        self._delayed_sender.start()
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mqtt-standin", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _subscribe(self, handler, topic_filter):
+        group = None
+        if topic_filter.startswith("$share/"):
+            _, group, topic_filter = topic_filter.split("/", 2)
+        with self._lock:
+            self._subscriptions.append((topic_filter, group, handler))
+
+    def _remove_client(self, handler):
+        with self._lock:
+            self._subscriptions = [s for s in self._subscriptions if s[2] is not handler]
+
+    def _dispatch(self, message):
+        with self._lock:
+            self.messages_received += 1
+            targets = []
+            groups = {}
+            for topic_filter, group, handler in self._subscriptions:
+                if not topic_matches(topic_filter, message.topic):
+                    continue
+                if group is None:
+                    targets.append(handler)
+                else:
+                    groups.setdefault((group, topic_filter), []).append(handler)
+            # Shared Subscriptions: Round-Robin innerhalb der Gruppe
+            for key, members in groups.items():
+                counter = self._share_counters.setdefault(key, itertools.count())
+                targets.append(members[next(counter) % len(members)])
+        if self.on_message is not None:
+            self.on_message(message)
+        for handler in targets:
+            try:
+                handler.deliver(message)
+            except OSError:
+                pass
@@ -0,0 +1,122 @@
+import heapq
+import itertools
+import logging
+import random
+import time
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Scheduler pro Sensor
+# Jeder Sensor hat ein eigenes Intervall (SENSORS[...]["Interval"]) und einen zufälligen Versatz (Jitter), damit
+# nicht alle Sensoren gleichzeitig fällig werden. Die Fälligkeiten liegen in einem Heap. Schlägt ein Sensor fehl,
+# wird der nächste Versuch exponentiell verzögert; nach breaker_threshold Fehlschlägen in Folge ist der
+# Circuit Breaker offen und der Sensor wird nur noch alle probe_interval Sekunden mit einem einzigen Versuch
+# geprüft. Sind mehrere Sensoren gleichzeitig fällig, kommen die zuletzt gesunden zuerst dran.
+
+CLOSED, OPEN = "closed", "open"
+
+
+class _SensorState:
+    __slots__ = ("mac", "interval", "jitter", "failures", "breaker", "due", "ready_at", "last_success")
+
+    def __init__(self, mac, interval, jitter):
+        self.mac = mac
+        self.interval = interval
+        self.jitter = jitter
+        self.failures = 0 # Fehlschläge in Folge
+        self.breaker = CLOSED
+        self.due = None # geplanter Zeitpunkt (monotonic) des nächsten Lesevorgangs
+        self.ready_at = None # tatsächliche Fälligkeit inkl. Jitter, gesetzt von pop_due()
+        self.last_success = None
+
+    def priority(self):
+        # Gesunde vor fehlerhaften, innerhalb davon zuletzt erfolgreiche zuerst
+        return (self.breaker == OPEN, self.failures, -(self.last_success or float("-inf")))
+
+
+class SensorScheduler:
+    def __init__(self, sensors, default_interval, default_jitter=0.0, backoff_max=600, breaker_threshold=5,
+                 probe_interval=900):
+        self.default_interval = default_interval
+        self.backoff_max = backoff_max
+        self.breaker_threshold = breaker_threshold
+        self.probe_interval = probe_interval
+        self._states = {}
+        self._heap = [] # (Fälligkeit, laufende Nummer, MAC)
+        self._ready = [] # fällige Sensoren, die auf einen freien Worker warten
+        self._counter = itertools.count()
+        now = time.monotonic()
+        for sensor_config in sensors:
+            mac = sensor_config["BT_TARGET_ADDRESSES"]
+            state = _SensorState(mac, sensor_config.get("Interval", default_interval),
+                                 sensor_config.get("Jitter", default_jitter))
+            self._states[mac] = state
+            # Erste Messung sofort, jeweils um einen zufälligen Jitter versetzt
+            self._push(state, now)
+
+    def _push(self, state, due):
+        # state.due bleibt ohne Jitter, damit sich der Versatz nicht über die Intervalle aufsummiert
+        state.due = due
+        heapq.heappush(self._heap, (due + random.uniform(0, state.jitter), next(self._counter), state.mac))
+
+    def next_due(self):
+        # Zeitpunkt (monotonic) der nächsten Fälligkeit; sofort, wenn schon Sensoren warten
+        if self._ready:
+            return time.monotonic()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now=None, limit=None):
+        # Gibt bis zu limit fällige MACs zurück, gesunde Sensoren zuerst
+        now = time.monotonic() if now is None else now
+        while self._heap and self._heap[0][0] <= now:
+            ready_at, _, mac = heapq.heappop(self._heap)
+            state = self._states[mac]
+            state.ready_at = ready_at
+            self._ready.append(state)
+        if not self._ready:
+            return []
+        self._ready.sort(key=_SensorState.priority)
+        count = len(self._ready) if limit is None else max(0, limit)
+        selected, self._ready = self._ready[:count], self._ready[count:]
+        return [state.mac for state in selected]
+
+    def ready_since(self, mac):
+        # Zeitpunkt (monotonic), zu dem der zuletzt von pop_due() gelieferte Lesevorgang fällig wurde
+        return self._states[mac].ready_at
+
+    def attempts(self, mac, default):
+        # Nach einem Fehlschlag übernimmt der Backoff die Wiederholungen, im Lesevorgang nur noch ein Versuch
+        return 1 if self._states[mac].failures else default
+
+    def is_open(self, mac):
+        return self._states[mac].breaker == OPEN
+
+    def record(self, mac, ok, now=None):
+        now = time.monotonic() if now is None else now
+        state = self._states[mac]
+        if ok:
+            if state.breaker == OPEN:
+                logger.info(f"Sensor {mac} is reachable again after {state.failures} failed attempt(s). Closing circuit breaker.")
+                metrics.set_gauge("sensor_breaker_open", 0, mac=mac)
+            state.failures = 0
+            state.breaker = CLOSED
+            state.last_success = now
+            # Auf dem Raster des Sensors bleiben, verpasste Termine werden übersprungen
+            due = state.due + state.interval
+            if due <= now:
+                due += ((now - due) // state.interval + 1) * state.interval
+            self._push(state, due)
+            return
+        state.failures += 1
+        if state.failures >= self.breaker_threshold:
+            if state.breaker != OPEN:
+                logger.warning(f"Sensor {mac} failed {state.failures} times in a row. Opening circuit breaker; "
+                               f"probing every {self.probe_interval} seconds.")
+                metrics.inc("sensor_breaker_trips_total", mac=mac)
+                metrics.set_gauge("sensor_breaker_open", 1, mac=mac)
+            state.breaker = OPEN
+            delay = self.probe_interval
+        else:
+            delay = min(state.interval * 2 ** (state.failures - 1), self.backoff_max)
+        self._push(state, now + delay)
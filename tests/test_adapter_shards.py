@@ -0,0 +1,125 @@
+import pytest
+
+import adapter_shards
+from adapter_shards import ShardPlacement
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # ShardPlacement liest time.monotonic() für ausgefallene Adapter
+    fake = FakeClock()
+    monkeypatch.setattr(adapter_shards, "time", fake)
+    return fake
+
+
+def macs(count):
+    return [f"AA:00:00:00:00:{i:02X}" for i in range(count)]
+
+
+def test_place_spreads_sensors_evenly_and_keeps_the_assignment(clock):
+    placement = ShardPlacement([0, 1, 2])
+    sensors = macs(6)
+    first = placement.place(sensors)
+    assert sorted(first) == sorted(sensors)
+    assert [list(first.values()).count(a) for a in (0, 1, 2)] == [2, 2, 2]
+    assert placement.place(sensors) == first
+
+
+def test_place_puts_expensive_sensors_on_separate_adapters(clock):
+    placement = ShardPlacement([0, 1])
+    slow, fast = "AA:00:00:00:00:01", "AA:00:00:00:00:02"
+    placement.record(slow, 0, True, 8.0)
+    placement.record(fast, 0, True, 1.0)
+    placement.record("AA:00:00:00:00:03", 0, True, 1.0)
+    result = placement.place([slow, fast, "AA:00:00:00:00:03"])
+    # Der teure Sensor allein, die beiden günstigen zusammen
+    assert result[fast] == result["AA:00:00:00:00:03"] != result[slow]
+    assert placement.load(result[slow]) == pytest.approx(8.0)
+
+
+def test_record_smooths_the_read_cost(clock):
+    placement = ShardPlacement([0], smoothing=0.5)
+    mac = "AA:00:00:00:00:01"
+    placement.place([mac])
+    placement.record(mac, 0, True, 2.0)
+    placement.record(mac, 0, True, 4.0)
+    assert placement.load(0) == pytest.approx(3.0)
+
+
+def test_record_moves_a_sensor_after_repeated_failures(clock):
+    placement = ShardPlacement([0, 1], failover_after=3)
+    mac = "AA:00:00:00:00:01"
+    adapter = placement.place([mac])[mac]
+    for _ in range(2):
+        placement.record(mac, adapter, False, 1.0)
+    assert placement.assignment[mac] == adapter
+    placement.record(mac, adapter, False, 1.0)
+    assert placement.assignment[mac] == 1 - adapter
+    # Auf dem neuen Adapter beginnt die Zählung von vorn
+    placement.record(mac, 1 - adapter, False, 1.0)
+    assert placement.assignment[mac] == 1 - adapter
+
+
+def test_success_resets_the_failure_count(clock):
+    placement = ShardPlacement([0, 1], failover_after=2)
+    mac = "AA:00:00:00:00:01"
+    adapter = placement.place([mac])[mac]
+    placement.record(mac, adapter, False, 1.0)
+    placement.record(mac, adapter, True, 1.0)
+    placement.record(mac, adapter, False, 1.0)
+    assert placement.assignment[mac] == adapter
+
+
+def test_no_failover_with_a_single_adapter(clock):
+    placement = ShardPlacement([0], failover_after=1)
+    mac = "AA:00:00:00:00:01"
+    placement.place([mac])
+    placement.record(mac, 0, False, 1.0)
+    assert placement.assignment[mac] == 0
+
+
+def test_mark_down_moves_sensors_until_the_retry_interval_has_passed(clock):
+    placement = ShardPlacement([0, 1], retry_interval=300)
+    sensors = macs(4)
+    placement.place(sensors)
+    placement.mark_down(0, "test")
+    assert placement.healthy_adapters() == [1]
+    assert set(placement.place(sensors).values()) == {1}
+
+    clock.now += 300
+    assert placement.healthy_adapters() == [0, 1]
+    # Rückkehr des Adapters: Last wird wieder verteilt
+    result = placement.place(sensors)
+    assert [list(result.values()).count(a) for a in (0, 1)] == [2, 2]
+
+
+def test_place_returns_nothing_without_a_healthy_adapter(clock):
+    placement = ShardPlacement([0], retry_interval=300)
+    placement.place(macs(1))
+    placement.mark_down(0, "test")
+    assert placement.place(macs(1)) == {}
+
+
+def test_rebalance_moves_sensors_only_while_it_reduces_the_imbalance(clock):
+    placement = ShardPlacement([0, 1])
+    sensors = macs(5)
+    for mac in sensors:
+        placement.assignment[mac] = 0
+        placement.record(mac, 0, True, 1.0)
+    placement.rebalance()
+    assert sorted(placement.load(a) for a in (0, 1)) == pytest.approx([2.0, 3.0])
+
+    # Ein einzelner teurer Sensor wird nicht hin- und hergeschoben
+    single = ShardPlacement([0, 1])
+    single.assignment["AA:00:00:00:00:FF"] = 0
+    single.record("AA:00:00:00:00:FF", 0, True, 5.0)
+    single.rebalance()
+    assert single.assignment["AA:00:00:00:00:FF"] == 0
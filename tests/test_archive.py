@@ -0,0 +1,100 @@
+import csv
+import gzip
+import os
+import time
+
+from archive import CSV_FIELDNAMES, CsvArchiveWriter
+
+DAY1 = 1700000000 # 2023-11-14
+DAY2 = DAY1 + 86400 # 2023-11-15
+
+
+def measurement(timestamp, room="R1", co2=600):
+    return {"Room": room, "Position": "P1", "Sensor_ID_MAC": "AA", "timestamp_utc": timestamp,
+            "datetime_utc": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(timestamp)), "CO2_ppm": co2}
+
+
+def read_rows(path):
+    if path.endswith(".gz"):
+        with gzip.open(path, "rt", encoding="utf-8", newline="") as f:
+            return list(csv.DictReader(f))
+    with open(path, encoding="utf-8", newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def test_rows_are_buffered_until_flush_rows(tmp_path):
+    writer = CsvArchiveWriter(str(tmp_path), flush_rows=3, flush_interval=3600, compress=False, fsync=False)
+    path = str(tmp_path / "R1_2023-11-14.csv")
+    writer.write(measurement(DAY1))
+    writer.write(measurement(DAY1 + 30))
+    assert read_rows(path) == []
+    writer.write(measurement(DAY1 + 60))
+    assert [row["timestamp_utc"] for row in read_rows(path)] == [str(DAY1), str(DAY1 + 30), str(DAY1 + 60)]
+    writer.close()
+
+
+def test_daily_rotation_compresses_the_previous_day(tmp_path):
+    writer = CsvArchiveWriter(str(tmp_path), flush_rows=1, fsync=False)
+    writer.write(measurement(DAY1))
+    writer.write(measurement(DAY2, co2=700))
+    writer.close() # wartet auf die Komprimierung
+    assert sorted(os.listdir(tmp_path)) == ["R1_2023-11-14.csv.gz", "R1_2023-11-15.csv"]
+    assert [row["CO2_ppm"] for row in read_rows(str(tmp_path / "R1_2023-11-14.csv.gz"))] == ["600"]
+    assert list(read_rows(str(tmp_path / "R1_2023-11-15.csv"))[0]) == CSV_FIELDNAMES
+
+
+def test_size_rotation_starts_numbered_segments(tmp_path):
+    writer = CsvArchiveWriter(str(tmp_path), flush_rows=1, max_bytes=300, compress=False, fsync=False)
+    for i in range(10):
+        writer.write(measurement(DAY1 + i, co2=600 + i))
+    writer.close()
+    names = sorted(os.listdir(tmp_path))
+    assert names[0] == "R1_2023-11-14.csv" and names[1] == "R1_2023-11-14_1.csv"
+    rows = [row for name in sorted(names, key=lambda n: (len(n), n)) for row in read_rows(str(tmp_path / name))]
+    assert [row["CO2_ppm"] for row in rows] == [str(600 + i) for i in range(10)]
+
+
+def test_rooms_get_separate_files(tmp_path):
+    writer = CsvArchiveWriter(str(tmp_path), flush_rows=1, compress=False, fsync=False)
+    writer.write(measurement(DAY1, room="R1"))
+    writer.write(measurement(DAY1, room="R2"))
+    writer.close()
+    assert sorted(os.listdir(tmp_path)) == ["R1_2023-11-14.csv", "R2_2023-11-14.csv"]
+
+
+def test_leftovers_of_an_earlier_run_are_recovered(tmp_path):
+    today = time.strftime("%Y-%m-%d", time.gmtime())
+    writer = CsvArchiveWriter(str(tmp_path), flush_rows=1, fsync=False)
+    writer.write(measurement(DAY1))
+    writer.write(measurement(time.time()))
+    writer.close()
+    # Abgeschlossenes Segment ohne Komprimierung, abgebrochenes gzip und gzip ohne gelöschtes Original
+    (tmp_path / "R1_2023-11-14.csv.gz").rename(tmp_path / "R1_2023-11-14.csv.gz.keep")
+    with gzip.open(tmp_path / "R1_2023-11-14.csv.gz.keep", "rb") as f:
+        (tmp_path / "R1_2023-11-14.csv").write_bytes(f.read())
+    os.remove(tmp_path / "R1_2023-11-14.csv.gz.keep")
+    (tmp_path / "R2_2023-11-14.csv").write_text(",".join(CSV_FIELDNAMES) + "\n", encoding="utf-8")
+    (tmp_path / "R2_2023-11-14.csv.gz.tmp").write_bytes(b"partial")
+    (tmp_path / "R3_2023-11-14.csv").write_text("stale copy\n", encoding="utf-8")
+    with gzip.open(tmp_path / "R3_2023-11-14.csv.gz", "wb") as f:
+        f.write(b"complete\n")
+
+    writer = CsvArchiveWriter(str(tmp_path), fsync=False)
+    writer.close()
+    assert sorted(os.listdir(tmp_path)) == ["R1_2023-11-14.csv.gz", f"R1_{today}.csv",
+                                           "R2_2023-11-14.csv.gz", "R3_2023-11-14.csv.gz"]
+    assert [row["CO2_ppm"] for row in read_rows(str(tmp_path / "R1_2023-11-14.csv.gz"))] == ["600"]
+    with gzip.open(tmp_path / "R3_2023-11-14.csv.gz", "rb") as f:
+        assert f.read() == b"complete\n"
+
+
+def test_a_new_writer_continues_todays_segment(tmp_path):
+    now = time.time()
+    writer = CsvArchiveWriter(str(tmp_path), flush_rows=1, fsync=False)
+    writer.write(measurement(now, co2=600))
+    writer.close()
+    writer = CsvArchiveWriter(str(tmp_path), flush_rows=1, fsync=False)
+    writer.write(measurement(now, co2=700))
+    writer.close()
+    (name,) = os.listdir(tmp_path)
+    assert [row["CO2_ppm"] for row in read_rows(str(tmp_path / name))] == ["600", "700"]
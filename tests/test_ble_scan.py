@@ -0,0 +1,108 @@
+import struct
+import time
+
+import pytest
+
+btle = pytest.importorskip("bluepy.btle")
+
+import ble_scan
+import main
+from ble_scan import AdvertisementCollector, AdvertisementDecoder
+
+MAC = "AA:BB:CC:DD:EE:01"
+
+
+class FakeClock:
+    def __init__(self, now=1700000000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class FakeScanEntry:
+    def __init__(self, payload, rssi=-60):
+        self.addr = MAC.lower()
+        self.rssi = rssi
+        self._raw = b"\xff\xff" + payload # Company ID 0xFFFF wie in SENSOR_TYPES
+
+    def getValue(self, sdid):
+        return self._raw if sdid == btle.ScanEntry.MANUFACTURER else None
+
+
+class FakeScanner:
+    def __init__(self, iface=0):
+        pass
+
+    def withDelegate(self, delegate):
+        return self
+
+    def start(self, passive=False):
+        pass
+
+    def process(self, timeout=10.0):
+        time.sleep(0.01)
+
+    def clear(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+def advert(co2=612, temperature=2150):
+    return struct.pack("<HIhH", co2, 101325, temperature, 4100)
+
+
+def make_collector():
+    advertisement = main.SENSOR_TYPES[main.DEFAULT_SENSOR_TYPE]["advertisement"]
+    return AdvertisementCollector({MAC: AdvertisementDecoder.from_config(advertisement)})
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(ble_scan, "time", fake)
+    return fake
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    monkeypatch.setattr(btle, "Scanner", FakeScanner)
+    scan_engine = main.SensorScanEngine([{"BT_TARGET_ADDRESSES": MAC, "Room": "R1"}], interval=0.3)
+    yield scan_engine
+    scan_engine.shutdown()
+
+
+def test_drain_returns_the_receive_time(clock):
+    collector = make_collector()
+    collector.handle(MAC.lower(), FakeScanEntry(advert()))
+    clock.now += 10
+    collector.handle(MAC.lower(), FakeScanEntry(advert(), rssi=-70)) # gleicher Inhalt, nur neuer Empfangszeitpunkt
+    clock.now += 10
+    (data_list, measurement, rssi, received_at), = collector.drain().values()
+    assert measurement["CO2_ppm"] == 612 and measurement["Temperature_Celsius"] == 21.5
+    assert (rssi, received_at) == (-70, 1700000010.0)
+    # Danach erst wieder nach einem neuen Advertisement
+    assert collector.drain() == {}
+
+
+def test_scan_cycle_stamps_measurements_with_the_receive_time(clock, engine):
+    engine.collector.handle(MAC.lower(), FakeScanEntry(advert()))
+    clock.now += 25
+    results = []
+    engine.run_cycle(lambda sensor_config, data_list, measurement, timestamp=None:
+                     results.append(main.add_meta_information(sensor_config, measurement, timestamp=timestamp)))
+    (measurement,) = results
+    assert measurement["timestamp_utc"] == 1700000000
+    assert measurement["datetime_utc"] == "2023-11-14T22:13:20Z"
+
+
+def test_first_scan_cycle_waits_one_interval(engine):
+    engine.collector.handle(MAC.lower(), FakeScanEntry(advert()))
+    cycle_ends = []
+    results = []
+    engine.run_forever(lambda sensor_config, data_list, measurement, timestamp=None: results.append(timestamp),
+                       on_cycle_end=lambda: cycle_ends.append(time.time()), max_cycles=1)
+    assert cycle_ends[0] - engine._scan_started >= engine.interval
+    assert len(results) == 1 and results[0] <= engine._scan_started + engine.interval
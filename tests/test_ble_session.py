@@ -0,0 +1,125 @@
+import pytest
+
+btle = pytest.importorskip("bluepy.btle")
+
+import ble_session
+from ble_session import BleSessionManager, HandleCache, SessionLimit
+
+SERVICE = "0000181a-0000-1000-8000-00805f9b34fb"
+CHARACTERISTICS = ["00002a6e-0000-1000-8000-00805f9b34fb", "00002a6f-0000-1000-8000-00805f9b34fb"]
+
+
+class FakeCharacteristic:
+    def __init__(self, uuid, handle):
+        self.uuid = btle.UUID(uuid)
+        self._handle = handle
+
+    def getHandle(self):
+        return self._handle
+
+
+class FakeService:
+    def __init__(self, characteristics):
+        self._characteristics = characteristics
+
+    def getCharacteristics(self):
+        return self._characteristics
+
+
+# Sensor mit fester GATT-Tabelle: Declaration auf handle - 1, Wert auf handle
+class FakePeripheral:
+    connected = set()
+    connects = []
+    discoveries = []
+
+    def __init__(self, mac, iface=None):
+        self.addr = mac
+        self._values = {}
+        self._declarations = {}
+        for index, uuid in enumerate(CHARACTERISTICS):
+            handle = 0x11 + 2 * index
+            self._values[handle] = bytes([index])
+            self._declarations[handle - 1] = (bytes([0x02]) + handle.to_bytes(2, "little")
+                                              + ble_session.uuid_module.UUID(uuid).bytes[::-1])
+        FakePeripheral.connected.add(mac)
+        FakePeripheral.connects.append(mac)
+
+    def getServiceByUUID(self, uuid):
+        FakePeripheral.discoveries.append(self.addr)
+        return FakeService([FakeCharacteristic(uuid, handle) for uuid, handle in zip(CHARACTERISTICS, self._values)])
+
+    def readCharacteristic(self, handle):
+        if self.addr not in FakePeripheral.connected:
+            raise btle.BTLEDisconnectError(f"{self.addr} not connected")
+        if handle in self._declarations:
+            return self._declarations[handle]
+        return self._values[handle]
+
+    def disconnect(self):
+        FakePeripheral.connected.discard(self.addr)
+
+
+@pytest.fixture(autouse=True)
+def fake_peripheral(monkeypatch):
+    FakePeripheral.connected = set()
+    FakePeripheral.connects = []
+    FakePeripheral.discoveries = []
+    monkeypatch.setattr(btle, "Peripheral", FakePeripheral)
+
+
+def macs(count):
+    return [f"AA:00:00:00:00:{i:02X}" for i in range(count)]
+
+
+def test_read_keeps_the_link_without_limit():
+    sessions = BleSessionManager(SERVICE, CHARACTERISTICS)
+    for _ in range(3):
+        for mac in macs(4):
+            assert sessions.read(mac) == {CHARACTERISTICS[0]: b"\x00", CHARACTERISTICS[1]: b"\x01"}
+    assert len(FakePeripheral.connects) == 4
+    assert len(FakePeripheral.discoveries) == 4
+
+
+def test_session_limit_evicts_the_least_recently_used_link():
+    sessions = BleSessionManager(SERVICE, CHARACTERISTICS, session_limit=SessionLimit(2))
+    a, b, c = macs(3)
+    sessions.read(a)
+    sessions.read(b)
+    sessions.read(a) # a ist jetzt der zuletzt benutzte Sensor
+    sessions.read(c)
+    assert FakePeripheral.connected == {a, c}
+
+
+def test_session_limit_is_shared_between_managers():
+    limit = SessionLimit(3)
+    managers = [BleSessionManager(SERVICE, CHARACTERISTICS, session_limit=limit) for _ in range(2)]
+    for index, mac in enumerate(macs(6)):
+        managers[index % 2].read(mac)
+        assert len(FakePeripheral.connected) <= 3
+    assert FakePeripheral.connected == set(macs(6)[3:])
+
+
+def test_evicted_sensor_is_read_by_handle_without_rediscovery(tmp_path):
+    sessions = BleSessionManager(SERVICE, CHARACTERISTICS, handle_cache=HandleCache(str(tmp_path / "handles.json")),
+                                 session_limit=SessionLimit(1))
+    a, b = macs(2)
+    for _ in range(3):
+        assert sessions.read(a)[CHARACTERISTICS[1]] == b"\x01"
+        assert sessions.read(b)[CHARACTERISTICS[1]] == b"\x01"
+    # Jeder Lesevorgang verbindet neu, die Service-Discovery läuft aber nur beim ersten Kontakt
+    assert FakePeripheral.connects == [a, b] * 3
+    assert FakePeripheral.discoveries == [a, b]
+    assert FakePeripheral.connected == {b}
+
+
+def test_eviction_skips_a_sensor_that_is_being_read():
+    limit = SessionLimit(1)
+    sessions = BleSessionManager(SERVICE, CHARACTERISTICS, session_limit=limit)
+    a, b = macs(2)
+    sessions.read(a)
+    with sessions._mac_lock(a):
+        sessions.read(b)
+        assert FakePeripheral.connected == {a, b}
+    # Beim nächsten Überlauf ist a wieder dran
+    sessions.read(b)
+    assert FakePeripheral.connected == {b}
@@ -0,0 +1,75 @@
+import struct
+
+import pytest
+
+import decoders
+from decoders import CharacteristicDecoder, DecoderRegistry
+
+CO2_UUID = "0000aa01-0000-1000-8000-00805f9b34fb"
+TEMP_UUID = "0000aa02-0000-1000-8000-00805f9b34fb"
+CHARACTERISTICS = [
+    {"uuid": CO2_UUID, "name": "co2_ppm", "field": "CO2_ppm", "unit": "ppm", "format": "<I", "pad": True},
+    {"uuid": TEMP_UUID, "name": "temperature_celsius", "field": "Temperature_Celsius", "unit": "°C",
+     "format": "<HH", "divisors": [1, 1000], "digits": 2},
+]
+
+
+def baseline_temperature(raw):
+    # Ursprüngliche Umrechnung aus main.py vor der Decoder Registry
+    high = (raw[1] << 8) + raw[0]
+    low = (raw[3] << 8) + raw[2]
+    return round(high + (low / 1000.0), 2)
+
+
+@pytest.fixture(params=["numpy", "struct"])
+def batch_path(request, monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(decoders, "np", False) # NumPy als nicht verfügbar markieren
+    return request.param
+
+
+def test_divisors_reproduce_the_baseline_exactly():
+    decoder = CharacteristicDecoder.from_config(CHARACTERISTICS[1])
+    for high in range(0, 100):
+        for low in range(1000):
+            raw = struct.pack("<HH", high, low)
+            assert decoder.decode(raw) == baseline_temperature(raw)
+    # Mit weights [1, 0.001] wäre das 7.82
+    assert decoder.decode(struct.pack("<HH", 7, 815)) == 7.81
+
+
+def test_main_config_uses_the_baseline_conversion():
+    pytest.importorskip("bluepy") # main importiert ble_session
+    import main
+    registry = main.decoder_registries[main.DEFAULT_SENSOR_TYPE]
+    raw = struct.pack("<HH", 7, 815)
+    assert registry[main.TEMP_UUID].decode(raw) == registry[main.HUM_UUID].decode(raw) == 7.81
+
+
+def test_integer_layouts_stay_int():
+    registry = DecoderRegistry.from_config(CHARACTERISTICS)
+    value = registry[CO2_UUID].decode(b"\x58\x02") # 600, kürzer als das Layout
+    assert value == 600 and isinstance(value, int)
+
+
+def test_decode_many_matches_decode(batch_path):
+    registry = DecoderRegistry.from_config(CHARACTERISTICS)
+    readings_list = [{CO2_UUID: struct.pack("<I", 400 + i), TEMP_UUID: struct.pack("<HH", 7 + i, 815 - i)}
+                     for i in range(50)]
+    readings_list.append({CO2_UUID: b"\x58\x02", TEMP_UUID: struct.pack("<HH", 21, 5)}) # kurzer Puffer
+    readings_list.append({CO2_UUID: b"\x58\x02", TEMP_UUID: struct.pack("<HH", 0, 15)}) # np.round ergäbe 0.02
+    measurements = registry.decode_many(readings_list)
+    assert measurements == [registry.decode(readings)[1] for readings in readings_list]
+    assert all(isinstance(m["CO2_ppm"], int) for m in measurements)
+
+
+def test_decode_many_rejects_truncated_buffers(batch_path):
+    registry = DecoderRegistry.from_config(CHARACTERISTICS)
+    with pytest.raises(struct.error):
+        registry.decode_many([{CO2_UUID: b"\x58\x02", TEMP_UUID: b"\x07\x00"}])
+
+
+def test_decode_many_of_nothing():
+    assert DecoderRegistry.from_config(CHARACTERISTICS).decode_many([]) == []
@@ -0,0 +1,77 @@
+import random
+
+import pytest
+
+from edge import EdgeStage, RollingWindow
+
+
+def item(name, value):
+    return {"name": name, "unit": "", "value": value}
+
+
+def test_rolling_window_tracks_min_max_mean():
+    window = RollingWindow(60)
+    for t, value in [(0, 5), (10, 3), (20, 8), (30, 6)]:
+        window.add(t, value)
+    assert window.stats() == {"min": 3, "max": 8, "mean": 5.5, "last": 6, "n": 4}
+
+
+def test_rolling_window_evicts_old_samples():
+    window = RollingWindow(60)
+    for t, value in [(0, 1), (10, 9), (50, 4)]:
+        window.add(t, value)
+    # Bei t=70 sind die Werte von t=0 und t=10 aus dem Fenster gefallen
+    window.evict(70)
+    assert window.stats() == {"min": 4, "max": 4, "mean": 4.0, "last": 4, "n": 1}
+    window.evict(110)
+    assert len(window) == 0 and window.stats() is None
+
+
+def test_rolling_window_matches_a_full_recomputation():
+    rng = random.Random(7)
+    window = RollingWindow(30)
+    samples = []
+    for t in range(500):
+        value = rng.randint(0, 100)
+        window.add(t, value)
+        samples.append((t, value))
+        current = [v for s, v in samples if s > t - 30]
+        stats = window.stats()
+        assert (stats["min"], stats["max"], stats["n"]) == (min(current), max(current), len(current))
+        assert stats["mean"] == pytest.approx(sum(current) / len(current), abs=0.01)
+
+
+def test_deadband_suppresses_small_changes():
+    stage = EdgeStage({"co2_ppm": 10})
+    assert stage.process("A", [item("co2_ppm", 600)], now=0)[0] == [item("co2_ppm", 600)]
+    assert stage.process("A", [item("co2_ppm", 609)], now=30)[0] == []
+    # Verglichen wird mit dem zuletzt gesendeten Wert, kleine Schritte summieren sich also auf
+    assert stage.process("A", [item("co2_ppm", 610)], now=60)[0] == [item("co2_ppm", 610)]
+
+
+def test_deadband_is_tracked_per_sensor_and_skips_unconfigured_metrics():
+    stage = EdgeStage({"co2_ppm": 10})
+    stage.process("A", [item("co2_ppm", 600)], now=0)
+    assert stage.process("B", [item("co2_ppm", 601)], now=0)[0] == [item("co2_ppm", 601)]
+    published, _ = stage.process("A", [item("co2_ppm", 601), item("pressure_Pa", 101325), item("humidity", None)], now=30)
+    assert published == [item("pressure_Pa", 101325)]
+
+
+def test_heartbeat_after_max_silence():
+    stage = EdgeStage({"co2_ppm": 10}, max_silence=300)
+    stage.process("A", [item("co2_ppm", 600)], now=0)
+    assert stage.process("A", [item("co2_ppm", 601)], now=299)[0] == []
+    assert stage.process("A", [item("co2_ppm", 601)], now=300)[0] == [item("co2_ppm", 601)]
+    # Die Stille zählt ab dem Heartbeat neu
+    assert stage.process("A", [item("co2_ppm", 602)], now=599)[0] == []
+
+
+def test_aggregates_are_emitted_once_per_window():
+    stage = EdgeStage(windows=[60])
+    emitted = []
+    for t in range(0, 181, 30):
+        _, aggregates = stage.process("A", [item("co2_ppm", 600 + t)], now=t)
+        emitted.append((t, aggregates))
+    # Das erste Fenster läuft ab t=0 voll, danach höchstens eine Ausgabe pro Fensterlänge
+    assert [t for t, aggregates in emitted if aggregates] == [60, 120, 180]
+    assert dict(emitted)[120] == [("co2_ppm", 60, {"min": 690, "max": 720, "mean": 705.0, "last": 720, "n": 2})]
@@ -0,0 +1,93 @@
+import json
+import time
+
+import paho.mqtt.client as paho
+import pytest
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+from ingest import AGGREGATE, COMBINED, READING, IngestDaemon, IngestStore, TopicParser
+from mqtt_standin import MqttStandinBroker
+
+
+def test_topic_parser():
+    parser = TopicParser()
+    assert parser.parse("bus/4C313/B827EB76185E/co2_ppm") == (READING, "4C313", "B827EB76185E", "co2_ppm", None)
+    assert parser.parse("bus/4C313/B827EB76185E/reading") == (COMBINED, "4C313", "B827EB76185E", "reading", None)
+    assert parser.parse("bus/4C313/B827EB76185E/co2_ppm/agg/300s") == (AGGREGATE, "4C313", "B827EB76185E", "co2_ppm", 300)
+    assert parser.parse("bus/4C313/B827EB76185E/co2_ppm/agg/300") is None
+    assert parser.parse("gateway/x/health") is None
+    assert parser.parse("bus/4C313") is None
+
+
+@pytest.fixture
+def broker():
+    with MqttStandinBroker() as standin:
+        yield standin
+
+
+@pytest.fixture
+def ingest(broker, tmp_path):
+    store = IngestStore(str(tmp_path / "ingest.db"))
+    daemon = IngestDaemon(store, broker.host, port=broker.port, flush_interval=0.05).start()
+    deadline = time.monotonic() + 5
+    while not broker._subscriptions and time.monotonic() < deadline:
+        time.sleep(0.01)
+    yield store, daemon
+    daemon.stop()
+    store.close()
+
+
+@pytest.fixture
+def publisher(broker):
+    client = paho.Client(paho.CallbackAPIVersion.VERSION2, client_id="gateway", protocol=paho.MQTTv5)
+    client.connect(broker.host, broker.port)
+    client.loop_start()
+    yield client
+    client.disconnect()
+    client.loop_stop()
+
+
+def publish(client, topic, payload, timestamp_utc=None, topic_alias=None):
+    properties = Properties(PacketTypes.PUBLISH)
+    if timestamp_utc is not None:
+        properties.UserProperty = ("timestamp_utc", str(timestamp_utc))
+    if topic_alias is not None:
+        properties.TopicAlias = topic_alias
+    client.publish(topic, payload, qos=1, properties=properties).wait_for_publish(5)
+
+
+def wait_for_rows(store, count, table="readings", timeout=5):
+    deadline = time.monotonic() + timeout
+    while store.count(table) < count and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return store.count(table)
+
+
+def test_measurement_timestamp_is_taken_from_the_user_property(ingest, publisher):
+    store, _ = ingest
+    # Live-Wert und ein später nachgesendeter Wert derselben Metrik mit unterschiedlichen Messzeitpunkten
+    publish(publisher, "bus/R1/AA/co2_ppm", "612", timestamp_utc=1700000060, topic_alias=1)
+    publish(publisher, "", "598", timestamp_utc=12345, topic_alias=1)
+    assert wait_for_rows(store, 2) == 2
+    assert store.query("R1") == [("AA", 12345, "co2_ppm", 598.0), ("AA", 1700000060, "co2_ppm", 612.0)]
+
+
+def test_messages_without_timestamp_use_the_receive_time(ingest, publisher):
+    store, _ = ingest
+    before = int(time.time())
+    publish(publisher, "bus/R1/AA/humidity_percent", "41.5")
+    assert wait_for_rows(store, 1) == 1
+    (sensor, ts, metric, value), = store.query("R1")
+    assert before <= ts <= int(time.time())
+    assert (sensor, metric, value) == ("AA", "humidity_percent", 41.5)
+
+
+def test_combined_payloads_and_aggregates(ingest, publisher):
+    store, _ = ingest
+    publish(publisher, "bus/R2/BB/reading", json.dumps({"ts": 1700000000, "co2_ppm": 700, "temperature_celsius": 21.5}))
+    publish(publisher, "bus/R2/BB/co2_ppm/agg/300s", json.dumps({"min": 600, "max": 700, "mean": 650, "last": 700, "n": 10}),
+            timestamp_utc=1700000000)
+    assert wait_for_rows(store, 2) == 2
+    assert wait_for_rows(store, 1, table="aggregates") == 1
+    assert store.query("R2") == [("BB", 1700000000, "co2_ppm", 700.0), ("BB", 1700000000, "temperature_celsius", 21.5)]
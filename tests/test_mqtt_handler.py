@@ -0,0 +1,74 @@
+import socket
+import time
+
+import pytest
+
+pytest.importorskip("bluepy") # main importiert ble_session
+
+import main
+from mqtt_standin import PROPERTY_TOPIC_ALIAS, PROPERTY_USER, MqttStandinBroker
+
+
+@pytest.fixture
+def broker():
+    with MqttStandinBroker() as standin:
+        standin.received = []
+        standin.on_message = standin.received.append
+        yield standin
+
+
+@pytest.fixture
+def make_handler(broker):
+    handlers = []
+
+    def make(**kwargs):
+        handler = main.MqttClientHandler("test-gateway", broker.host, broker.port, None, None, **kwargs)
+        assert handler.connect(timeout=5)
+        handlers.append(handler)
+        return handler
+
+    yield make
+    for handler in handlers:
+        handler.flush(timeout=1)
+        handler.disconnect()
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return condition()
+
+
+def test_resend_after_a_dropped_connection_keeps_the_timestamp(broker, make_handler):
+    handler = make_handler()
+    broker.ack_delay = 60 # Keine PUBACKs in der ersten Verbindung
+    topic = "bus/R1/AA/co2_ppm"
+    assert handler.publish(topic, "612", timestamp_utc=1700000000)
+    assert handler.publish(topic, "598", timestamp_utc=1700000030)
+    assert wait_for(lambda: len(broker.received) == 2)
+    # Die zweite Nachricht ging nur mit dem Alias raus
+    assert [m.properties.get(PROPERTY_TOPIC_ALIAS) for m in broker.received] == [1, 1]
+
+    broker.ack_delay = 0
+    handler.client.socket().shutdown(socket.SHUT_RDWR)
+    assert wait_for(lambda: len(broker.received) == 4)
+    assert handler.flush(timeout=5)
+    resent = broker.received[2:]
+    assert [m.topic for m in resent] == [topic, topic]
+    assert [m.payload for m in resent] == [b"612", b"598"]
+    assert [m.properties.get(PROPERTY_USER) for m in resent] == [[("timestamp_utc", "1700000000")],
+                                                                 [("timestamp_utc", "1700000030")]]
+    assert all(PROPERTY_TOPIC_ALIAS not in m.properties for m in resent)
+
+
+def test_live_publish_does_not_wait_for_a_full_window(broker, make_handler, tmp_path):
+    outbox = main.MqttOutbox(str(tmp_path / "outbox.db"))
+    handler = make_handler(max_inflight=4, outbox=outbox)
+    broker.ack_delay = 2
+    start = time.monotonic()
+    assert all(handler.publish(f"bus/R1/AA/m{i}", str(i), timestamp_utc=1700000000 + i) for i in range(8))
+    # Die ersten vier füllen das Fenster, der Rest geht sofort in die Outbox
+    assert time.monotonic() - start < 1
+    assert handler.pending_count() == 4
+    assert [row[1] for row in outbox.fetch()] == [f"bus/R1/AA/m{i}" for i in range(4, 8)]
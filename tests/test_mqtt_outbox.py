@@ -0,0 +1,49 @@
+from mqtt_outbox import MqttOutbox
+
+
+def make_outbox(tmp_path, max_bytes=50 * 1024 * 1024):
+    return MqttOutbox(str(tmp_path / "outbox.db"), max_bytes=max_bytes)
+
+
+def test_fetch_returns_oldest_first_with_the_timestamp(tmp_path):
+    outbox = make_outbox(tmp_path)
+    outbox.put("bus/R1/AA/co2_ppm", "612", timestamp_utc=1700000000)
+    outbox.put("bus/R1/AA/co2_ppm", b"598", timestamp_utc=1700000030)
+    rows = outbox.fetch()
+    assert [row[1:] for row in rows] == [("bus/R1/AA/co2_ppm", b"612", 1700000000),
+                                         ("bus/R1/AA/co2_ppm", b"598", 1700000030)]
+    assert outbox.fetch(after_id=rows[0][0]) == rows[1:]
+    assert outbox.fetch(limit=1) == rows[:1]
+
+
+def test_overflow_evicts_the_oldest_messages(tmp_path):
+    # Jede Nachricht belegt len(Topic) + len(Payload) = 10 Bytes
+    outbox = make_outbox(tmp_path, max_bytes=35)
+    for i in range(5):
+        outbox.put("topic", f"p{i:04d}")
+    assert len(outbox) == 3
+    assert outbox._bytes == 30
+    assert [row[2] for row in outbox.fetch()] == [b"p0002", b"p0003", b"p0004"]
+
+
+def test_delete_keeps_count_and_size_in_step(tmp_path):
+    outbox = make_outbox(tmp_path)
+    for i in range(1200):
+        outbox.put("topic", f"p{i:04d}")
+    ids = [row[0] for row in outbox.fetch(limit=1200)]
+    # Mehr als 500 IDs auf einmal (Parameter-Limit von SQLite) und bereits gelöschte IDs
+    outbox.delete(ids[:700])
+    outbox.delete(ids[:10] + ids[700:710])
+    assert len(outbox) == 490
+    assert outbox._bytes == 4900
+    assert outbox.fetch(limit=1)[0][0] == ids[710]
+
+
+def test_reopen_restores_count_and_size(tmp_path):
+    outbox = make_outbox(tmp_path)
+    outbox.put("topic", "p0000")
+    outbox.put("topic", "p0001")
+    outbox.close()
+    reopened = make_outbox(tmp_path)
+    assert len(reopened) == 2
+    assert reopened._bytes == 20
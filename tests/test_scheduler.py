@@ -0,0 +1,119 @@
+import pytest
+
+from scheduler import SensorScheduler
+
+
+def make_scheduler(*sensors, interval=30, backoff_max=600, breaker_threshold=5, probe_interval=900):
+    # Ohne Jitter, damit die Fälligkeiten exakt vorhersagbar sind
+    configs = [dict({"BT_TARGET_ADDRESSES": mac}, **extra) for mac, extra in sensors]
+    return SensorScheduler(configs, default_interval=interval, default_jitter=0.0, backoff_max=backoff_max,
+                           breaker_threshold=breaker_threshold, probe_interval=probe_interval)
+
+
+def due_after(scheduler, mac):
+    # Nächste eingeplante Fälligkeit des Sensors (ohne sie aus dem Heap zu nehmen)
+    return min(due for due, _, m in scheduler._heap if m == mac)
+
+
+def test_all_sensors_are_due_immediately():
+    scheduler = make_scheduler(("A", {}), ("B", {}))
+    assert sorted(scheduler.pop_due(now=scheduler.next_due())) == ["A", "B"]
+    # Bis zum nächsten record() ist nichts mehr eingeplant
+    assert scheduler.next_due() is None
+
+
+def test_pop_due_respects_limit_and_keeps_the_rest_ready():
+    scheduler = make_scheduler(("A", {}), ("B", {}), ("C", {}))
+    now = due_after(scheduler, "C")
+    first = scheduler.pop_due(now=now, limit=2)
+    assert len(first) == 2
+    # Der übrige Sensor bleibt sofort fällig, auch ohne neuen Heap-Eintrag
+    assert scheduler.next_due() <= now + 1
+    assert scheduler.pop_due(now=now, limit=2) == sorted({"A", "B", "C"} - set(first))
+
+
+def test_pop_due_prefers_healthy_and_recently_successful_sensors():
+    scheduler = make_scheduler(("A", {}), ("B", {}), ("C", {}), interval=10)
+    start = due_after(scheduler, "A")
+    scheduler.pop_due(now=start)
+    scheduler.record("A", False, now=start)
+    scheduler.record("B", True, now=start + 1)
+    scheduler.record("C", True, now=start + 2)
+    # Alle drei gleichzeitig fällig: zuletzt erfolgreicher zuerst, fehlerhafter zuletzt
+    assert scheduler.pop_due(now=start + 100) == ["C", "B", "A"]
+
+
+def test_success_stays_on_the_interval_grid_and_skips_missed_slots():
+    scheduler = make_scheduler(("A", {"Interval": 10}))
+    start = due_after(scheduler, "A")
+    scheduler.pop_due(now=start)
+    scheduler.record("A", True, now=start + 3)
+    assert due_after(scheduler, "A") == pytest.approx(start + 10)
+
+    scheduler.pop_due(now=start + 10)
+    scheduler.record("A", True, now=start + 35) # Lesevorgang dauerte über zwei Intervalle
+    assert due_after(scheduler, "A") == pytest.approx(start + 40)
+
+
+def test_failures_back_off_exponentially_up_to_the_maximum():
+    scheduler = make_scheduler(("A", {"Interval": 10}), backoff_max=35, breaker_threshold=10)
+    now = due_after(scheduler, "A")
+    delays = []
+    for _ in range(4):
+        scheduler.pop_due(now=now)
+        scheduler.record("A", False, now=now)
+        due = due_after(scheduler, "A")
+        delays.append(due - now)
+        now = due
+    assert delays == pytest.approx([10, 20, 35, 35])
+
+
+def test_only_one_attempt_per_read_after_a_failure():
+    scheduler = make_scheduler(("A", {}))
+    now = due_after(scheduler, "A")
+    assert scheduler.attempts("A", 3) == 3
+    scheduler.pop_due(now=now)
+    scheduler.record("A", False, now=now)
+    assert scheduler.attempts("A", 3) == 1
+    scheduler.pop_due(now=now + 1000)
+    scheduler.record("A", True, now=now + 1000)
+    assert scheduler.attempts("A", 3) == 3
+
+
+def test_breaker_opens_after_threshold_and_closes_on_success():
+    scheduler = make_scheduler(("A", {"Interval": 10}), breaker_threshold=3, probe_interval=900)
+    now = due_after(scheduler, "A")
+    for attempt in range(3):
+        assert not scheduler.is_open("A")
+        scheduler.pop_due(now=now)
+        scheduler.record("A", False, now=now)
+        if attempt < 2:
+            now = due_after(scheduler, "A")
+    assert scheduler.is_open("A")
+    assert due_after(scheduler, "A") == pytest.approx(now + 900)
+
+    # Weitere Fehlschläge bei offenem Breaker: weiterhin nur Prüfversuche im probe_interval
+    now += 900
+    scheduler.pop_due(now=now)
+    scheduler.record("A", False, now=now)
+    assert scheduler.is_open("A")
+    assert due_after(scheduler, "A") == pytest.approx(now + 900)
+
+    now += 900
+    scheduler.pop_due(now=now)
+    scheduler.record("A", True, now=now)
+    assert not scheduler.is_open("A")
+    assert scheduler.attempts("A", 3) == 3
+
+
+def test_ready_since_reports_the_due_time_of_the_popped_entry():
+    scheduler = make_scheduler(("A", {"Interval": 10}))
+    start = due_after(scheduler, "A")
+    scheduler.pop_due(now=start + 2)
+    assert scheduler.ready_since("A") == pytest.approx(start)
+
+
+def test_next_due_is_none_without_sensors():
+    scheduler = make_scheduler()
+    assert scheduler.next_due() is None
+    assert scheduler.pop_due(now=0) == []
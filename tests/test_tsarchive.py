@@ -0,0 +1,91 @@
+import csv
+import os
+
+import tsarchive
+from tsarchive import (HEADER_SIZE, INDEX_BLOCK_RECORDS, INDEX_ENTRY, RECORD, ArchiveReader, BinaryArchiveWriter,
+                       downsample, pack_measurement, unpack_record)
+
+DAY1 = 1700006400 # 2023-11-15T00:00:00Z
+DAY2 = DAY1 + 86400
+
+
+def measurement(timestamp, mac="AA:BB:CC:DD:EE:01", co2=600, temperature=21.5):
+    return {"Room": "R1", "Position": "Fenster", "Sensor_ID_MAC": mac, "timestamp_utc": timestamp,
+            "CO2_ppm": co2, "Pressure_Pa": 101325, "Temperature_Celsius": temperature, "Humidity_Percent": 41.25}
+
+
+def write_all(base_path, measurements):
+    writer = BinaryArchiveWriter(str(base_path), flush_rows=1000, fsync=False)
+    for m in measurements:
+        writer.write(m)
+    writer.close()
+
+
+def test_pack_and_unpack_round_trip():
+    record = unpack_record("R1", RECORD.unpack(pack_measurement(measurement(DAY1, temperature=None))))
+    assert record == {"datetime_utc": "2023-11-15T00:00:00Z", "timestamp_utc": DAY1, "Room": "R1",
+                      "Position": "Fenster", "Sensor_ID_MAC": "AA:BB:CC:DD:EE:01", "CO2_ppm": 600,
+                      "Pressure_Pa": 101325, "Temperature_Celsius": None, "Humidity_Percent": 41.25}
+
+
+def test_index_has_one_entry_per_full_block(tmp_path):
+    write_all(tmp_path, [measurement(DAY1 + i) for i in range(2 * INDEX_BLOCK_RECORDS + 10)])
+    segment = tmp_path / "R1" / "2023-11-15.tsb"
+    assert os.path.getsize(segment) == HEADER_SIZE + (2 * INDEX_BLOCK_RECORDS + 10) * RECORD.size
+    entries = list(INDEX_ENTRY.iter_unpack((tmp_path / "R1" / "2023-11-15.idx").read_bytes()))
+    assert entries == [(DAY1, DAY1 + INDEX_BLOCK_RECORDS - 1, 0),
+                       (DAY1 + INDEX_BLOCK_RECORDS, DAY1 + 2 * INDEX_BLOCK_RECORDS - 1, INDEX_BLOCK_RECORDS)]
+
+
+def test_range_query_reads_only_overlapping_blocks(tmp_path):
+    count = 3 * INDEX_BLOCK_RECORDS + 10
+    write_all(tmp_path, [measurement(DAY1 + i) for i in range(count)])
+    reader = ArchiveReader(str(tmp_path))
+    path = str(tmp_path / "R1" / "2023-11-15.tsb")
+    start, end = DAY1 + INDEX_BLOCK_RECORDS + 5, DAY1 + INDEX_BLOCK_RECORDS + 20
+    # Nur der zweite Block und der noch nicht indizierte Rest
+    assert reader._record_ranges(path, count, start, end) == [(INDEX_BLOCK_RECORDS, 2 * INDEX_BLOCK_RECORDS),
+                                                              (3 * INDEX_BLOCK_RECORDS, count)]
+    assert [r["timestamp_utc"] for r in reader.query("R1", start, end)] == list(range(start, end + 1))
+
+
+def test_query_spans_days_and_filters_by_sensor(tmp_path):
+    write_all(tmp_path, [measurement(DAY1 + 60, mac="AA:BB:CC:DD:EE:01"), measurement(DAY1 + 60, mac="AA:BB:CC:DD:EE:02"),
+                         measurement(DAY2 + 60, mac="AA:BB:CC:DD:EE:01")])
+    reader = ArchiveReader(str(tmp_path))
+    assert sorted(os.listdir(tmp_path / "R1")) == ["2023-11-15.idx", "2023-11-15.tsb", "2023-11-16.idx", "2023-11-16.tsb"]
+    records = list(reader.query("R1", DAY1, DAY2 + 3600, sensor="AA:BB:CC:DD:EE:01"))
+    assert [r["timestamp_utc"] for r in records] == [DAY1 + 60, DAY2 + 60]
+    assert list(reader.query("R1", DAY2 + 61, DAY2 + 3600)) == []
+    assert reader.rooms() == ["R1"]
+
+
+def test_reopen_truncates_partial_records_and_resumes_the_block(tmp_path):
+    write_all(tmp_path, [measurement(DAY1 + i) for i in range(INDEX_BLOCK_RECORDS - 1)])
+    segment = tmp_path / "R1" / "2023-11-15.tsb"
+    with open(segment, "ab") as f:
+        f.write(b"\x01\x02\x03") # Abgebrochener Datensatz
+    write_all(tmp_path, [measurement(DAY1 + 1000)])
+    assert os.path.getsize(segment) == HEADER_SIZE + INDEX_BLOCK_RECORDS * RECORD.size
+    # Der Block wurde mit dem Minimum aus dem ersten Lauf abgeschlossen
+    assert list(INDEX_ENTRY.iter_unpack((tmp_path / "R1" / "2023-11-15.idx").read_bytes())) == [(DAY1, DAY1 + 1000, 0)]
+    assert len(list(ArchiveReader(str(tmp_path)).query("R1", DAY1, DAY1 + 1000))) == INDEX_BLOCK_RECORDS
+
+
+def test_downsample_averages_per_sensor_and_bucket():
+    records = [unpack_record("R1", RECORD.unpack(pack_measurement(m)))
+               for m in (measurement(DAY1, co2=600), measurement(DAY1 + 30, co2=700, temperature=None),
+                         measurement(DAY1 + 300, co2=800))]
+    result = list(downsample(records, 300))
+    assert [(r["timestamp_utc"], r["CO2_ppm"], r["Temperature_Celsius"]) for r in result] == [(DAY1, 650.0, 21.5),
+                                                                                           (DAY1 + 300, 800.0, 21.5)]
+
+
+def test_export_command_writes_csv(tmp_path):
+    write_all(tmp_path / "tsb", [measurement(DAY1 + i * 60) for i in range(5)])
+    output = tmp_path / "export.csv"
+    tsarchive.main(["--base-path", str(tmp_path / "tsb"), "--start", "2023-11-15T00:01:00Z", "--end", str(DAY1 + 180),
+                    "--output", str(output)])
+    with open(output, newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    assert [row["timestamp_utc"] for row in rows] == [str(DAY1 + 60), str(DAY1 + 120), str(DAY1 + 180)]
@@ -0,0 +1,305 @@
+import argparse
+import calendar
+import csv
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Binäres Zeitreihen-Archiv
+# Jede Messung (Dict aus add_meta_information()) wird als Datensatz fester Länge gespeichert:
+#   timestamp_utc int64 | MAC 6 Byte | Position 8 Byte | None-Flags uint8 | Reserve |
+#   CO2_ppm uint32 | Pressure_Pa uint32 | Temperature_Celsius float32 | Humidity_Percent float32
+# Segmente: <base_path>/<Room>/<YYYY-MM-DD>.tsb (UTC-Tag), dazu ein Block-Index <YYYY-MM-DD>.idx mit
+# (min_ts, max_ts, erster Datensatz) für je INDEX_BLOCK_RECORDS Datensätze.
+SEGMENT_MAGIC = b"CO2TSB1\0"
+RECORD = struct.Struct("<q6s8sBxIIff")
+INDEX_ENTRY = struct.Struct("<qqI")
+INDEX_BLOCK_RECORDS = 256
+HEADER_SIZE = len(SEGMENT_MAGIC)
+
+VALUE_FIELDS = ["CO2_ppm", "Pressure_Pa", "Temperature_Celsius", "Humidity_Percent"]
+EXPORT_FIELDS = ["datetime_utc", "timestamp_utc", "Room", "Position", "Sensor_ID_MAC"] + VALUE_FIELDS
+
+
+def _mac_to_bytes(mac):
+    return bytes.fromhex(mac.replace(":", "")) if mac else b"\0" * 6
+
+def _bytes_to_mac(raw):
+    return ":".join(f"{b:02X}" for b in raw)
+
+def pack_measurement(measurement_data):
+    flags = 0
+    values = []
+    for bit, field in enumerate(VALUE_FIELDS):
+        value = measurement_data.get(field)
+        if value is None:
+            flags |= 1 << bit
+            value = 0
+        values.append(value)
+    position = (measurement_data.get("Position") or "").encode("utf-8")[:8]
+    return RECORD.pack(
+        int(measurement_data["timestamp_utc"]), _mac_to_bytes(measurement_data.get("Sensor_ID_MAC")),
+        position, flags, int(values[0]), int(values[1]), float(values[2]), float(values[3]),
+    )
+
+def unpack_record(room, fields):
+    timestamp, mac, position, flags, co2, pressure, temperature, humidity = fields
+    values = (co2, pressure, round(temperature, 2), round(humidity, 2))
+    record = {
+        "datetime_utc": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(timestamp)),
+        "timestamp_utc": timestamp,
+        "Room": room,
+        "Position": position.rstrip(b"\0").decode("utf-8", "replace"),
+        "Sensor_ID_MAC": _bytes_to_mac(mac),
+    }
+    for bit, (field, value) in enumerate(zip(VALUE_FIELDS, values)):
+        record[field] = None if flags & (1 << bit) else value
+    return record
+
+
+# Offenes Segment eines Raums für einen UTC-Tag
+class _SegmentWriter:
+    def __init__(self, path, day):
+        self.path = path
+        self.day = day
+        new_file = not os.path.exists(path) or os.path.getsize(path) < HEADER_SIZE
+        self.file = open(path, "ab")
+        if new_file:
+            self.file.truncate(0)
+            self.file.write(SEGMENT_MAGIC)
+        # Unvollständige Datensätze (z.B. nach Stromausfall) abschneiden
+        self.count = (self.file.tell() - HEADER_SIZE) // RECORD.size
+        self.file.truncate(HEADER_SIZE + self.count * RECORD.size)
+        self.index_file = open(path[:-4] + ".idx", "ab")
+        indexed_blocks = self.index_file.tell() // INDEX_ENTRY.size
+        self.index_file.truncate(indexed_blocks * INDEX_ENTRY.size)
+        self.block_min, self.block_max = None, None
+        # Begonnenen Block aus dem Segment rekonstruieren
+        if self.count > indexed_blocks * INDEX_BLOCK_RECORDS:
+            with open(path, "rb") as f:
+                f.seek(HEADER_SIZE + indexed_blocks * INDEX_BLOCK_RECORDS * RECORD.size)
+                for fields in RECORD.iter_unpack(f.read((self.count - indexed_blocks * INDEX_BLOCK_RECORDS) * RECORD.size)):
+                    self._track(fields[0])
+
+    def _track(self, timestamp):
+        self.block_min = timestamp if self.block_min is None else min(self.block_min, timestamp)
+        self.block_max = timestamp if self.block_max is None else max(self.block_max, timestamp)
+
+    def append(self, timestamp, record):
+        self.file.write(record)
+        self._track(timestamp)
+        self.count += 1
+        if self.count % INDEX_BLOCK_RECORDS == 0:
+            first = self.count - INDEX_BLOCK_RECORDS
+            self.index_file.write(INDEX_ENTRY.pack(self.block_min, self.block_max, first))
+            self.block_min, self.block_max = None, None
+
+    def sync(self, fsync=True):
+        for f in (self.file, self.index_file):
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+
+    def close(self, fsync=True):
+        self.sync(fsync)
+        self.file.close()
+        self.index_file.close()
+
+
+# Binary Archive Writer (gleiche Flush-Strategie wie CsvArchiveWriter)
+class BinaryArchiveWriter:
+    def __init__(self, base_path, flush_rows=20, flush_interval=60, fsync=True):
+        self.base_path = base_path
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self._segments = {} # Room -> _SegmentWriter
+        self._lock = threading.Lock()
+        self._unflushed_rows = 0
+        self._last_flush = time.monotonic()
+
+    def write(self, measurement_data):
+        room = measurement_data["Room"]
+        timestamp = int(measurement_data["timestamp_utc"])
+        day = time.strftime("%Y-%m-%d", time.gmtime(timestamp))
+        record = pack_measurement(measurement_data)
+        with self._lock:
+            segment = self._segments.get(room)
+            if segment is None or segment.day != day:
+                if segment is not None:
+                    segment.close(self.fsync)
+                room_path = os.path.join(self.base_path, room)
+                os.makedirs(room_path, exist_ok=True)
+                segment = _SegmentWriter(os.path.join(room_path, f"{day}.tsb"), day)
+                self._segments[room] = segment
+            segment.append(timestamp, record)
+            self._unflushed_rows += 1
+            if self._unflushed_rows >= self.flush_rows or time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush_locked()
+
+    def _flush_locked(self):
+        for segment in self._segments.values():
+            segment.sync(self.fsync)
+        self._unflushed_rows = 0
+        self._last_flush = time.monotonic()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def flush_if_due(self):
+        with self._lock:
+            if self._unflushed_rows and time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush_locked()
+
+    def close(self):
+        with self._lock:
+            for segment in self._segments.values():
+                segment.close(self.fsync)
+            self._segments = {}
+            self._unflushed_rows = 0
+
+
+# Archive Reader
+# Liest Segmente per mmap und überspringt mit dem Block-Index alle Blöcke außerhalb des Zeitbereichs.
+class ArchiveReader:
+    def __init__(self, base_path):
+        self.base_path = base_path
+
+    def rooms(self):
+        if not os.path.isdir(self.base_path):
+            return []
+        return sorted(d for d in os.listdir(self.base_path) if os.path.isdir(os.path.join(self.base_path, d)))
+
+    def _segments(self, room, start_ts, end_ts):
+        room_path = os.path.join(self.base_path, room)
+        if not os.path.isdir(room_path):
+            return []
+        first_day = time.strftime("%Y-%m-%d", time.gmtime(start_ts))
+        last_day = time.strftime("%Y-%m-%d", time.gmtime(end_ts))
+        # Dateinamen im ISO-Format sind lexikographisch sortierbar
+        return [os.path.join(room_path, name) for name in sorted(os.listdir(room_path))
+                if name.endswith(".tsb") and first_day <= name[:-4] <= last_day]
+
+    def _record_ranges(self, path, count, start_ts, end_ts):
+        # Liefert (erster, letzter+1) Datensatz der Blöcke, die den Zeitbereich überlappen
+        ranges = []
+        indexed = 0
+        index_path = path[:-4] + ".idx"
+        if os.path.exists(index_path):
+            with open(index_path, "rb") as f:
+                raw = f.read()
+            for block_min, block_max, first in INDEX_ENTRY.iter_unpack(raw[:len(raw) - len(raw) % INDEX_ENTRY.size]):
+                last = min(first + INDEX_BLOCK_RECORDS, count)
+                indexed = max(indexed, last)
+                if block_max >= start_ts and block_min <= end_ts:
+                    if ranges and ranges[-1][1] == first:
+                        ranges[-1] = (ranges[-1][0], last)
+                    else:
+                        ranges.append((first, last))
+        if indexed < count: # Noch nicht indizierter, begonnener Block
+            ranges.append((indexed, count))
+        return ranges
+
+    def query(self, room, start_ts, end_ts, sensor=None):
+        sensor_raw = _mac_to_bytes(sensor) if sensor else None
+        for path in self._segments(room, start_ts, end_ts):
+            size = os.path.getsize(path)
+            count = (size - HEADER_SIZE) // RECORD.size
+            if count <= 0:
+                continue
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if mapped[:HEADER_SIZE] != SEGMENT_MAGIC:
+                    logger.error(f"Skipping {path}: not a binary archive segment.")
+                    continue
+                view = memoryview(mapped)
+                try:
+                    for first, last in self._record_ranges(path, count, start_ts, end_ts):
+                        chunk = view[HEADER_SIZE + first * RECORD.size:HEADER_SIZE + last * RECORD.size]
+                        for fields in RECORD.iter_unpack(chunk):
+                            if start_ts <= fields[0] <= end_ts and (sensor_raw is None or fields[1] == sensor_raw):
+                                yield unpack_record(room, fields)
+                        chunk.release()
+                finally:
+                    view.release()
+
+
+def downsample(records, bucket_seconds):
+    # Mittelwert pro Sensor und Zeitfenster; Zeitstempel = Beginn des Fensters
+    buckets = {}
+    for record in records:
+        bucket_start = record["timestamp_utc"] - record["timestamp_utc"] % bucket_seconds
+        key = (bucket_start, record["Sensor_ID_MAC"])
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = {"record": record, "sums": [0.0] * len(VALUE_FIELDS), "counts": [0] * len(VALUE_FIELDS)}
+        for i, field in enumerate(VALUE_FIELDS):
+            if record[field] is not None:
+                bucket["sums"][i] += record[field]
+                bucket["counts"][i] += 1
+    for (bucket_start, _), bucket in sorted(buckets.items()):
+        result = dict(bucket["record"])
+        result["timestamp_utc"] = bucket_start
+        result["datetime_utc"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(bucket_start))
+        for i, field in enumerate(VALUE_FIELDS):
+            result[field] = round(bucket["sums"][i] / bucket["counts"][i], 2) if bucket["counts"][i] else None
+        yield result
+
+
+# Kommandozeile
+def _parse_time(value):
+    # Akzeptiert Unix-Timestamps oder ISO 8601 (UTC), z.B. 2025-05-13 oder 2025-05-13T08:00:00Z
+    if value.isdigit():
+        return int(value)
+    value = value.rstrip("Z")
+    for fmt in ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M", "%Y-%m-%d"):
+        try:
+            return calendar.timegm(time.strptime(value, fmt))
+        except ValueError:
+            continue
+    raise argparse.ArgumentTypeError(f"Invalid time: {value}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export measurements from the binary time-series archive.")
+    parser.add_argument("--base-path", default=os.path.join(os.path.expanduser("~"), "infineon_co2_sensor", "server", "tsb"))
+    parser.add_argument("--room", help="Room to export (default: all rooms)")
+    parser.add_argument("--sensor", help="Only this sensor MAC, e.g. B8:27:EB:76:18:5E")
+    parser.add_argument("--start", type=_parse_time, default=0, help="Start (UTC, ISO 8601 or Unix timestamp)")
+    parser.add_argument("--end", type=_parse_time, default=None, help="End, inclusive (default: now)")
+    parser.add_argument("--downsample", type=int, default=0, metavar="SECONDS", help="Average into buckets of this size")
+    parser.add_argument("--format", choices=["csv", "json"], default="csv")
+    parser.add_argument("--output", "-o", help="Output file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    end_ts = args.end if args.end is not None else int(time.time())
+    reader = ArchiveReader(args.base_path)
+    rooms = [args.room] if args.room else reader.rooms()
+
+    out = open(args.output, "w", newline="", encoding="utf-8") if args.output else sys.stdout
+    try:
+        for index, room in enumerate(rooms):
+            records = reader.query(room, args.start, end_ts, sensor=args.sensor)
+            if args.downsample > 0:
+                records = downsample(records, args.downsample)
+            if args.format == "csv":
+                writer = csv.DictWriter(out, fieldnames=EXPORT_FIELDS)
+                if index == 0:
+                    writer.writeheader()
+                writer.writerows(records)
+            else:
+                # JSON Lines: ein Objekt pro Zeile, damit auch große Exporte gestreamt werden können
+                for record in records:
+                    out.write(json.dumps(record, separators=(",", ":")) + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+if __name__ == "__main__":
+    main()